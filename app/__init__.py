@@ -19,6 +19,12 @@ def create_app():
     from .routes import register_routes
     from .api import register_api_routes
     from .database import setup_database_migration
+    from .search import init_search_engine
+    from .extraction import init_text_extraction
+    from .related import init_related_articles
+    from .popular_cache import init_popular_cache
+    from .view_buffer import init_view_buffer
+    from .commands import register_commands
     
     app = Flask(__name__, template_folder='../templates', static_folder='../static')
     app.config.from_object(Config)
@@ -38,6 +44,18 @@ def create_app():
     # データベースマイグレーションのセットアップ
     migrate = setup_database_migration(app, db)
     
+    # 全文検索エンジンの初期化
+    init_search_engine(app)
+    
+    # 関連記事の更新ワーカーの初期化
+    init_related_articles(app)
+    
+    # 人気記事ランキングのキャッシュの初期化
+    init_popular_cache(app)
+    
+    # 閲覧履歴の書き込みバッファの初期化
+    init_view_buffer(app)
+    
     # ルートの登録
     register_routes(app)
     
@@ -50,9 +68,15 @@ def create_app():
     # エラーハンドラーの登録
     register_error_handlers(app)
     
+    # CLIコマンドの登録
+    register_commands(app)
+    
     # イベントリスナーの登録
     register_event_listeners()
     
+    # 添付ファイルのテキスト抽出ワーカーの初期化（抽出結果を検索インデックスに反映するリスナーの登録後に開始）
+    init_text_extraction(app)
+    
     # コンテキストプロセッサーの登録
     register_context_processors(app)
     
@@ -60,12 +84,12 @@ def create_app():
 
 def register_template_filters(app):
     """テンプレートフィルターを登録"""
-    import markdown
     from markupsafe import Markup
     
     @app.template_filter('markdown')
     def markdown_filter(text):
-        return Markup(markdown.markdown(text, extensions=['fenced_code', 'tables', 'codehilite', 'nl2br']))
+        from .rendering import render_markdown
+        return Markup(render_markdown(text))
 
     @app.template_filter('preview')
     def preview_filter(text, max_lines=5):
@@ -124,9 +148,15 @@ def register_error_handlers(app):
 
 def register_event_listeners():
     """SQLAlchemyイベントリスナーを登録"""
-    from sqlalchemy import event
-    from .models import Knowledge, Comment, Like, CommentLike
-    from .utils import get_current_user_id, audit_logger
+    from sqlalchemy import event, inspect
+    from sqlalchemy.orm import Session, object_session
+    from .models import Knowledge, Comment, Like, CommentLike, Tag, Attachment
+    from .utils import get_current_user_id, audit_logger, make_excerpt
+    from .search import index_knowledge, remove_knowledge
+    from .search_index import apply_staged_updates, discard_staged_updates, stage_suggestion_update
+    from .extraction import is_text_extractable, schedule_text_extraction
+    from .related import schedule_related_update
+    from .rendering import invalidate_rendered_html
     
     @event.listens_for(Knowledge, 'after_insert')
     def log_insert(mapper, connection, target):
@@ -173,6 +203,129 @@ def register_event_listeners():
         user_id = get_current_user_id()
         audit_logger.info(f"COMMENT LIKE DELETE - User:{user_id}, CommentLike ID:{target.id}, Comment ID:{target.comment_id}, User ID:'{target.user_id}'")
 
+    # 全文検索インデックスの同期
+    @event.listens_for(Knowledge, 'after_insert')
+    def index_knowledge_insert(mapper, connection, target):
+        index_knowledge(connection, target.id, object_session(target))
+
+    @event.listens_for(Knowledge, 'after_update')
+    def index_knowledge_update(mapper, connection, target):
+        # タイトル・本文が変わっていない更新（タグ変更など）では再インデックスしない
+        state = inspect(target)
+        if state.attrs.title.history.has_changes() or state.attrs.content.history.has_changes():
+            index_knowledge(connection, target.id, object_session(target))
+
+    @event.listens_for(Knowledge, 'after_delete')
+    def index_knowledge_delete(mapper, connection, target):
+        remove_knowledge(connection, target.id, object_session(target))
+
+    @event.listens_for(Comment, 'after_insert')
+    @event.listens_for(Comment, 'after_delete')
+    def index_comment_change(mapper, connection, target):
+        index_knowledge(connection, target.knowledge_id, object_session(target))
+
+    # 添付ファイルのテキストを検索インデックスに反映
+    @event.listens_for(Attachment, 'after_update')
+    def index_attachment_update(mapper, connection, target):
+        state = inspect(target)
+        if state.attrs.extracted_text.history.has_changes() or state.attrs.knowledge_id.history.has_changes():
+            # 関連付け先が変わった場合は変更前の記事も更新
+            knowledge_ids = set(state.attrs.knowledge_id.history.deleted) | {target.knowledge_id}
+            for knowledge_id in knowledge_ids - {None}:
+                index_knowledge(connection, knowledge_id, object_session(target))
+
+    @event.listens_for(Attachment, 'after_delete')
+    def index_attachment_delete(mapper, connection, target):
+        if target.knowledge_id is not None and target.extracted_text:
+            index_knowledge(connection, target.knowledge_id, object_session(target))
+
+    # テキスト系の添付ファイルはコミット後にバックグラウンドでテキストを抽出
+    @event.listens_for(Attachment, 'after_insert')
+    def queue_text_extraction(mapper, connection, target):
+        session = object_session(target)
+        if session is not None and is_text_extractable(target.filename):
+            session.info.setdefault('text_extraction_pending', []).append(target.id)
+
+    # 入力補完候補の同期（公開記事のタイトルと全タグ名）
+    @event.listens_for(Knowledge, 'after_insert')
+    @event.listens_for(Knowledge, 'after_update')
+    def suggest_knowledge_change(mapper, connection, target):
+        title = None if target.is_draft else target.title
+        stage_suggestion_update(object_session(target), 'title', target.id, title)
+
+    @event.listens_for(Knowledge, 'after_delete')
+    def suggest_knowledge_delete(mapper, connection, target):
+        stage_suggestion_update(object_session(target), 'title', target.id, None)
+
+    @event.listens_for(Tag, 'after_insert')
+    def suggest_tag_insert(mapper, connection, target):
+        stage_suggestion_update(object_session(target), 'tag', target.id, target.name)
+
+    @event.listens_for(Tag, 'after_delete')
+    def suggest_tag_delete(mapper, connection, target):
+        stage_suggestion_update(object_session(target), 'tag', target.id, None)
+
+    # 一覧表示用の抜粋を保存時に作成
+    @event.listens_for(Knowledge, 'before_insert')
+    @event.listens_for(Knowledge, 'before_update')
+    def update_excerpt(mapper, connection, target):
+        if target.excerpt is None or inspect(target).attrs.content.history.has_changes():
+            target.excerpt = make_excerpt(target.content)
+
+    # 本文が編集されたら保存済みの描画結果を破棄
+    @event.listens_for(Knowledge, 'before_update')
+    @event.listens_for(Comment, 'before_update')
+    def invalidate_rendered_content(mapper, connection, target):
+        if inspect(target).attrs.content.history.has_changes():
+            invalidate_rendered_html(target)
+
+    # 記事の削除時に日別集計・保存済みの閲覧数・閲覧者のスケッチも削除
+    @event.listens_for(Knowledge, 'before_delete')
+    def delete_daily_stats(mapper, connection, target):
+        from .models import KnowledgeDailyStats, KnowledgeDailyReaders, ViewHistoryArchive
+        for table in (KnowledgeDailyStats.__table__, KnowledgeDailyReaders.__table__, ViewHistoryArchive.__table__):
+            connection.execute(table.delete().where(table.c.knowledge_id == target.id))
+
+    # 関連記事はコミット後にバックグラウンドで差分更新
+    @event.listens_for(Knowledge, 'after_insert')
+    @event.listens_for(Knowledge, 'after_update')
+    def queue_related_update(mapper, connection, target):
+        state = inspect(target)
+        changed = any(state.attrs[name].history.has_changes() for name in ('title', 'content', 'is_draft'))
+        session = object_session(target)
+        if session is not None and changed:
+            session.info.setdefault('related_pending', set()).add(target.id)
+
+    @event.listens_for(Knowledge, 'before_delete')
+    def delete_related_entries(mapper, connection, target):
+        from .models import RelatedKnowledge
+        table = RelatedKnowledge.__table__
+        # 削除する記事を一覧に含んでいた記事はコミット後に再計算（削除する記事自体もモデルから除く）
+        referrers = connection.execute(
+            table.select().with_only_columns(table.c.knowledge_id).where(table.c.related_id == target.id)
+        ).scalars().all()
+        connection.execute(table.delete().where(
+            (table.c.knowledge_id == target.id) | (table.c.related_id == target.id)
+        ))
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('related_pending', set()).update(set(referrers) | {target.id})
+
+    # プロセス内インデックスはコミット確定後に反映
+    @event.listens_for(Session, 'after_commit')
+    def apply_search_index_updates(session):
+        apply_staged_updates(session)
+        for attachment_id in session.info.pop('text_extraction_pending', []):
+            schedule_text_extraction(attachment_id)
+        schedule_related_update(session.info.pop('related_pending', set()))
+
+    @event.listens_for(Session, 'after_rollback')
+    def discard_search_index_updates(session):
+        discard_staged_updates(session)
+        session.info.pop('text_extraction_pending', None)
+        session.info.pop('related_pending', None)
+        session.info.pop('rendered_html_pending', None)
+
 def register_context_processors(app):
     """コンテキストプロセッサーを登録"""
     from .models import Knowledge
@@ -69,11 +69,18 @@ def serialize_comment(comment):
         'content': comment.content,
         'author': comment.author,
         'created_at': created_at_jst,
-        'like_count': len(comment.comment_likes)
+        'like_count': comment.like_count
     }
 
-def serialize_knowledge(knowledge, include_comments=False):
-    """Knowledge オブジェクトをJSON形式にシリアライズ"""
+def serialize_knowledge(knowledge, include_comments=False, listing=None, comments=None):
+    """Knowledge オブジェクトをJSON形式にシリアライズ
+    
+    複数の記事をシリアライズする場合は serialize_knowledge_list() で件数・タグとコメントを一括取得して渡す。
+    
+    Args:
+        listing: utils.get_listing_engagement() の記事ごとの値（添付ファイル数とタグ、省略時はクエリで取得）
+        comments: 作成日時の新しい順のコメント（include_comments 指定時、省略時はクエリで取得）
+    """
     # 日本時間に変換
     created_at_jst = None
     updated_at_jst = None
@@ -92,6 +99,10 @@ def serialize_knowledge(knowledge, include_comments=False):
             updated_at_utc = knowledge.updated_at
         updated_at_jst = updated_at_utc.astimezone(JST).strftime('%Y-%m-%d %H:%M:%S')
     
+    if listing is None:
+        from .utils import get_listing_engagement
+        listing = get_listing_engagement([knowledge.id]).get(knowledge.id, {'attachments': 0, 'tags': []})
+    
     result = {
         'id': knowledge.id,
         'title': knowledge.title,
@@ -99,21 +110,56 @@ def serialize_knowledge(knowledge, include_comments=False):
         'author': knowledge.author,
         'created_at': created_at_jst,
         'updated_at': updated_at_jst,
-        'like_count': len(knowledge.likes),
-        'comment_count': len(knowledge.comments),
-        'attachment_count': len(knowledge.attachments),
-        'tags': [{'id': tag.id, 'name': tag.name, 'color': tag.color} for tag in knowledge.tags],
+        'like_count': knowledge.like_count,
+        'comment_count': knowledge.comment_count,
+        'attachment_count': listing['attachments'],
+        'tags': [{'id': tag.id, 'name': tag.name, 'color': tag.color} for tag in listing['tags']],
         'is_draft': knowledge.is_draft
     }
     
     # コメント詳細を含める場合
     if include_comments:
-        # コメントを作成日時の新しい順でソート
-        comments = sorted(knowledge.comments, key=lambda x: x.created_at, reverse=True)
+        if comments is None:
+            comments = get_comments_by_article([knowledge.id]).get(knowledge.id, [])
         result['comments'] = [serialize_comment(comment) for comment in comments]
     
     return result
 
+def get_comments_by_article(knowledge_ids):
+    """複数の記事のコメントを1回のクエリで取得（記事ごとに作成日時の新しい順）"""
+    from .models import Comment
+    
+    comments = {}
+    if knowledge_ids:
+        for comment in Comment.query.filter(Comment.knowledge_id.in_(knowledge_ids)).order_by(
+            Comment.created_at.desc(), Comment.id
+        ):
+            comments.setdefault(comment.knowledge_id, []).append(comment)
+    return comments
+
+def serialize_knowledge_list(articles, include_comments=False):
+    """複数の記事をシリアライズ（添付ファイル数・タグ・コメントは記事数によらず一括取得）"""
+    from .utils import get_listing_engagement
+    
+    knowledge_ids = [article.id for article in articles]
+    listing = get_listing_engagement(knowledge_ids)
+    comments = get_comments_by_article(knowledge_ids) if include_comments else {}
+    return [
+        serialize_knowledge(
+            article,
+            include_comments=include_comments,
+            listing=listing.get(article.id, {'attachments': 0, 'tags': []}),
+            comments=comments.get(article.id, [])
+        )
+        for article in articles
+    ]
+
+def article_query_options():
+    """APIで記事を取得するクエリのオプション（タグ・添付ファイル数は get_listing_engagement() で一括取得する）"""
+    from sqlalchemy.orm import raiseload
+    return (raiseload(Knowledge.tags), raiseload(Knowledge.attachments))
+
+
 @api_bp.route('/articles/latest', methods=['GET'])
 @require_api_key
 def get_latest_articles():
@@ -122,8 +168,12 @@ def get_latest_articles():
         # クエリパラメータの取得
         limit = request.args.get('limit', 10, type=int)
         offset = request.args.get('offset', 0, type=int)
+        cursor = request.args.get('cursor', '').strip()
+        # 総件数（COUNT）はオフセット指定時は既定で返し、カーソル指定時は include_total=true の場合のみ返す
+        include_total = request.args.get('include_total', 'false' if cursor else 'true').lower() in ['true', '1', 'yes']
         author = request.args.get('author', None)
         tag = request.args.get('tag', None)
+        search = request.args.get('search', '').strip()
         since = request.args.get('since', None)  # 指定日付以降の記事フィルタ
         
         # limitの上限設定（100件まで）
@@ -131,7 +181,7 @@ def get_latest_articles():
             limit = 100
         
         # 基本クエリ（下書きを除外）
-        query = Knowledge.query.filter(Knowledge.is_draft == False)
+        query = Knowledge.query.options(*article_query_options()).filter(Knowledge.is_draft == False)
         
         # 作成者フィルタ
         if author:
@@ -141,6 +191,11 @@ def get_latest_articles():
         if tag:
             query = query.filter(Knowledge.tags.any(Tag.name == tag))
         
+        # キーワード検索（タイトル・本文・コメント）
+        if search:
+            from .search import get_search_filter
+            query = query.filter(get_search_filter(search))
+        
         # 日付フィルタ（指定日付以降の記事）
         if since:
             try:
@@ -177,18 +232,104 @@ def get_latest_articles():
                     'message': f'日付パラメータの処理中にエラーが発生しました: {str(e)}'
                 }, 400)
         
-        # 最新順でソート
-        query = query.order_by(Knowledge.updated_at.desc())
+        from .utils import get_facet_counts, apply_keyset_cursor, encode_cursor
         
-        # ページネーション
-        articles = query.offset(offset).limit(limit).all()
-        total_count = query.count()
+        # 絞り込み結果のタグ別・作成者別件数（カーソル指定時は2ページ目以降のため省略）
+        facets = None if cursor else get_facet_counts(query)
+        total_count = query.count() if include_total else None
+        
+        # 最新順（更新日時・記事IDの降順）でソートし、カーソル指定時はカーソルの位置から、それ以外はオフセットで取得
+        try:
+            page_query = apply_keyset_cursor(query, Knowledge.updated_at, cursor)
+        except ValueError:
+            return json_response({
+                'status': 'error',
+                'message': 'カーソルが無効です'
+            }, 400)
+        if not cursor:
+            page_query = page_query.offset(offset)
+        
+        # 1件多く取得して次のページの有無を判定
+        articles = page_query.limit(limit + 1).all()
+        has_more = len(articles) > limit
+        articles = articles[:limit]
+        next_cursor = encode_cursor(articles[-1].updated_at, articles[-1].id) if has_more and articles else None
         
         # レスポンス構築
         response_data = {
             'status': 'success',
             'data': {
-                'articles': [serialize_knowledge(article) for article in articles],
+                'articles': serialize_knowledge_list(articles),
+                'facets': facets,
+                'pagination': {
+                    'total': total_count,
+                    'limit': limit,
+                    'offset': None if cursor else offset,
+                    'has_more': has_more,
+                    'next_cursor': next_cursor
+                }
+            }
+        }
+        
+        return json_response(response_data, 200)
+        
+    except Exception as e:
+        return json_response({
+            'status': 'error',
+            'message': f'記事の取得中にエラーが発生しました: {str(e)}'
+        }, 500)
+
+@api_bp.route('/search', methods=['GET'])
+@require_api_key
+def search_articles():
+    """記事を関連度順に検索（公開記事のみ、一致箇所のスニペット付き）"""
+    try:
+        from .search import search_ranked
+        
+        search_query = request.args.get('q', '').strip()
+        limit = request.args.get('limit', 10, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        fuzzy = request.args.get('fuzzy', 'false').lower() in ['true', '1', 'yes']
+        
+        if not search_query:
+            return json_response({
+                'status': 'error',
+                'message': '検索キーワード（q）を指定してください。'
+            }, 400)
+        
+        # limitの上限設定（100件まで）
+        if limit > 100:
+            limit = 100
+        
+        total_count, results = search_ranked(search_query, limit=limit, offset=offset)
+        
+        # 検索結果の記事を一括取得して関連度順に並べる
+        articles = {article.id: article for article in Knowledge.query.options(*article_query_options()).filter(
+            Knowledge.id.in_([result['id'] for result in results])
+        )}
+        
+        # 検索結果全体のタグ別・作成者別件数
+        from .search import get_search_filter
+        from .utils import get_facet_counts
+        facets = get_facet_counts(Knowledge.query.filter(
+            Knowledge.is_draft == False,
+            get_search_filter(search_query)
+        ))
+        
+        found = [result for result in results if result['id'] in articles]
+        serialized = serialize_knowledge_list([articles[result['id']] for result in found])
+        for article_data, result in zip(serialized, found):
+            article_data.update({
+                'score': result['score'],
+                'snippet': result['snippet'],
+                'matched_attachments': result['matched_attachments']
+            })
+        
+        response_data = {
+            'status': 'success',
+            'data': {
+                'articles': serialized,
+                'facets': facets,
                 'pagination': {
                     'total': total_count,
                     'limit': limit,
@@ -198,12 +339,50 @@ def get_latest_articles():
             }
         }
         
+        # あいまい検索指定時、または一致する記事がない場合は類似タイトル・タグと「もしかして」候補を付与
+        if fuzzy or total_count == 0:
+            from .search import fuzzy_search, get_did_you_mean
+            near_matches = fuzzy_search(search_query, limit=limit)
+            response_data['data']['near_matches'] = near_matches
+            response_data['data']['did_you_mean'] = get_did_you_mean(search_query, near_matches)
+        
         return json_response(response_data, 200)
         
     except Exception as e:
         return json_response({
             'status': 'error',
-            'message': f'記事の取得中にエラーが発生しました: {str(e)}'
+            'message': f'検索中にエラーが発生しました: {str(e)}'
+        }, 500)
+
+@api_bp.route('/suggest', methods=['GET'])
+@require_api_key
+def suggest_keywords():
+    """記事タイトル・タグ名の入力補完候補を取得（前方一致）"""
+    try:
+        from .search import suggest
+        
+        prefix = request.args.get('q', '').strip()
+        limit = request.args.get('limit', 10, type=int)
+        suggest_type = request.args.get('type', None)  # 'title' または 'tag'
+        
+        # limitの上限設定（50件まで）
+        if limit > 50:
+            limit = 50
+        
+        kinds = {suggest_type} if suggest_type in ('title', 'tag') else None
+        suggestions = suggest(prefix, limit=limit, kinds=kinds) if prefix else []
+        
+        return json_response({
+            'status': 'success',
+            'data': {
+                'suggestions': suggestions
+            }
+        }, 200)
+        
+    except Exception as e:
+        return json_response({
+            'status': 'error',
+            'message': f'入力補完候補の取得中にエラーが発生しました: {str(e)}'
         }, 500)
 
 @api_bp.route('/articles/<int:article_id>', methods=['GET'])
@@ -214,7 +393,7 @@ def get_article(article_id):
         # include_comments パラメータをチェック（デフォルトは true）
         include_comments = request.args.get('include_comments', 'true').lower() in ['true', '1', 'yes']
         
-        article = Knowledge.query.filter(
+        article = Knowledge.query.options(*article_query_options()).filter(
             Knowledge.id == article_id,
             Knowledge.is_draft == False
         ).first()
@@ -236,6 +415,121 @@ def get_article(article_id):
             'message': f'記事の取得中にエラーが発生しました: {str(e)}'
         }, 500)
 
+@api_bp.route('/articles/<int:article_id>/related', methods=['GET'])
+@require_api_key
+def get_related(article_id):
+    """関連記事を取得（事前計算済みのTF-IDFコサイン類似度順）"""
+    try:
+        from .related import get_related_articles
+        
+        article = Knowledge.query.filter(
+            Knowledge.id == article_id,
+            Knowledge.is_draft == False
+        ).first()
+        
+        if not article:
+            return json_response({
+                'status': 'error',
+                'message': '記事が見つかりません'
+            }, 404)
+        
+        related = get_related_articles(article_id)
+        related_articles = serialize_knowledge_list([article for article, _ in related])
+        for article_data, (_, score) in zip(related_articles, related):
+            article_data['score'] = round(score, 4)
+        
+        return json_response({
+            'status': 'success',
+            'data': {
+                'article_id': article_id,
+                'articles': related_articles
+            }
+        }, 200)
+        
+    except Exception as e:
+        return json_response({
+            'status': 'error',
+            'message': f'関連記事の取得中にエラーが発生しました: {str(e)}'
+        }, 500)
+
+def _readers_period():
+    """ユニーク閲覧者数の集計期間（日数、0は全期間、最大365）"""
+    days = request.args.get('days', 30, type=int)
+    return min(max(days, 0), 365)
+
+@api_bp.route('/articles/<int:article_id>/readers', methods=['GET'])
+@require_api_key
+def get_article_readers(article_id):
+    """記事のユニーク閲覧者数を取得（HyperLogLogによる推定値）"""
+    try:
+        from .readers import get_unique_readers
+        
+        article = Knowledge.query.filter(
+            Knowledge.id == article_id,
+            Knowledge.is_draft == False
+        ).first()
+        
+        if not article:
+            return json_response({
+                'status': 'error',
+                'message': '記事が見つかりません'
+            }, 404)
+        
+        days = _readers_period()
+        readers = get_unique_readers([article_id], days=days or None)
+        
+        return json_response({
+            'status': 'success',
+            'data': {
+                'article_id': article_id,
+                'unique_readers': readers['unique_readers'],
+                'period_days': days
+            }
+        }, 200)
+        
+    except Exception as e:
+        return json_response({
+            'status': 'error',
+            'message': f'閲覧者数の取得中にエラーが発生しました: {str(e)}'
+        }, 500)
+
+@api_bp.route('/tags/<tag_name>/readers', methods=['GET'])
+@require_api_key
+def get_tag_readers(tag_name):
+    """タグが付いた公開記事全体のユニーク閲覧者数を取得（HyperLogLogによる推定値）"""
+    try:
+        from .readers import get_unique_readers
+        
+        tag = Tag.query.filter_by(name=tag_name).first()
+        if not tag:
+            return json_response({
+                'status': 'error',
+                'message': 'タグが見つかりません'
+            }, 404)
+        
+        knowledge_ids = [row.id for row in Knowledge.query.with_entities(Knowledge.id).filter(
+            Knowledge.is_draft == False,
+            Knowledge.tags.any(Tag.id == tag.id)
+        )]
+        days = _readers_period()
+        readers = get_unique_readers(knowledge_ids, days=days or None)
+        
+        return json_response({
+            'status': 'success',
+            'data': {
+                'tag': tag.name,
+                'article_count': len(knowledge_ids),
+                'unique_readers': readers['unique_readers'],
+                'period_days': days
+            }
+        }, 200)
+        
+    except Exception as e:
+        return json_response({
+            'status': 'error',
+            'message': f'閲覧者数の取得中にエラーが発生しました: {str(e)}'
+        }, 500)
+
 @api_bp.route('/tags', methods=['GET'])
 @require_api_key
 def get_tags():
@@ -266,10 +560,10 @@ def get_tags():
 @api_bp.route('/articles/popular', methods=['GET'])
 @require_api_key
 def get_popular_articles():
-    """人気記事ランキングを取得（直近30日の閲覧数・いいね数・コメント数別）"""
+    """人気記事ランキングを取得（直近30日の閲覧数・いいね数・コメント数別、トレンドスコア順）"""
     try:
         from .config import POPULAR_ARTICLES_COUNT
-        from .utils import get_bulk_engagement_stats
+        from .popular_cache import get_cached_popular_rankings
         
         limit = request.args.get('limit', POPULAR_ARTICLES_COUNT, type=int)
         days = request.args.get('days', 30, type=int)
@@ -280,45 +574,43 @@ def get_popular_articles():
         if days > 365:
             days = 365  # 最大1年間
         
-        # 全記事を取得（下書きを除外）
-        all_knowledge = Knowledge.query.filter(Knowledge.is_draft == False).all()
-        
-        if not all_knowledge:
-            return json_response({
-                'status': 'success',
-                'data': {
-                    'top_by_views': [],
-                    'top_by_likes': [],
-                    'top_by_comments': [],
-                    'period_days': days,
-                    'limit': limit
-                }
-            }, 200)
-        
-        # 指定期間の統計を一括取得
-        recent_stats = get_bulk_engagement_stats(all_knowledge, days=days)
-        
-        # 各記事に統計情報を付与してシリアライズ
-        articles_with_stats = []
-        for knowledge in all_knowledge:
-            stats = recent_stats[knowledge.id]
-            
-            # 基本記事データをシリアライズ
-            article_data = serialize_knowledge(knowledge)
-            
-            # 期間別統計を追加
-            article_data.update({
-                'recent_views': stats['views'],
-                'recent_likes': stats['likes'],
-                'recent_comments': stats['comments']
-            })
-            
-            articles_with_stats.append(article_data)
-        
-        # 各カテゴリでソートしてトップN件を取得
-        top_by_views = sorted(articles_with_stats, key=lambda x: x['recent_views'], reverse=True)[:limit]
-        top_by_likes = sorted(articles_with_stats, key=lambda x: x['recent_likes'], reverse=True)[:limit]
-        top_by_comments = sorted(articles_with_stats, key=lambda x: x['recent_comments'], reverse=True)[:limit]
+        # 各指標の上位記事（キャッシュ済みの記事IDと件数）を取得し、上位に入った記事のみ読み込む
+        rankings = get_cached_popular_rankings(limit, days=days)
+        winner_ids = {knowledge_id for ranking in rankings.values() for knowledge_id, _ in ranking}
+        articles = Knowledge.query.options(*article_query_options()).filter(
+            Knowledge.id.in_(winner_ids), Knowledge.is_draft == False
+        ).all()
+        base_data = {article.id: data for article, data in zip(articles, serialize_knowledge_list(articles))}
+        
+        # 統計情報を付与（同じ記事は1回だけ付与、キャッシュ後に削除・非公開化された記事は除く）
+        serialized = {}
+        def serialize_ranking(ranking):
+            result = []
+            for knowledge_id, stats in ranking:
+                if knowledge_id not in base_data:
+                    continue
+                if knowledge_id not in serialized:
+                    article_data = base_data[knowledge_id]
+                    
+                    # 期間別統計を追加
+                    article_data.update({
+                        'recent_views': stats['views'],
+                        'recent_likes': stats['likes'],
+                        'recent_comments': stats['comments']
+                    })
+                    serialized[knowledge_id] = article_data
+                result.append(serialized[knowledge_id])
+            return result
+        
+        top_by_views = serialize_ranking(rankings['views'])
+        top_by_likes = serialize_ranking(rankings['likes'])
+        top_by_comments = serialize_ranking(rankings['comments'])
+        
+        # トレンドスコア（現在時刻まで減衰させた重み付き件数）を追加
+        top_trending = []
+        for knowledge_id, stats in rankings['trending']:
+            for article_data in serialize_ranking([(knowledge_id, stats)]):
+                top_trending.append(dict(article_data, trending_score=stats['score']))
         
         response_data = {
             'status': 'success',
@@ -326,6 +618,7 @@ def get_popular_articles():
                 'top_by_views': top_by_views,
                 'top_by_likes': top_by_likes,
                 'top_by_comments': top_by_comments,
+                'top_trending': top_trending,
                 'period_days': days,
                 'limit': limit
             }
@@ -339,6 +632,28 @@ def get_popular_articles():
             'message': f'人気記事の取得中にエラーが発生しました: {str(e)}'
         }, 500)
 
+@api_bp.route('/metrics', methods=['GET'])
+@require_api_key
+def get_metrics():
+    """キャッシュの統計情報を取得（監視用）"""
+    try:
+        from .popular_cache import get_popular_cache_stats
+        from .rendering import get_render_cache_stats
+        
+        return json_response({
+            'status': 'success',
+            'data': {
+                'popular_rankings': get_popular_cache_stats(),
+                'render_cache': get_render_cache_stats()
+            }
+        }, 200)
+        
+    except Exception as e:
+        return json_response({
+            'status': 'error',
+            'message': f'統計情報の取得中にエラーが発生しました: {str(e)}'
+        }, 500)
+
 @api_bp.route('/health', methods=['GET'])
 def health_check():
     """APIヘルスチェック"""
@@ -0,0 +1,92 @@
+"""
+Flask CLIコマンド
+
+使用方法:
+    flask --app app rebuild-related
+    flask --app app rerender [--force]
+    flask --app app reconcile-counters
+    flask --app app rebuild-daily-stats
+    flask --app app compact-view-history [--retention-days N]
+    flask --app app rebuild-reader-sketches
+    flask --app app rebuild-trending
+"""
+
+import time
+import click
+
+
+def register_commands(app):
+    """CLIコマンドを登録"""
+
+    @app.cli.command('rebuild-related')
+    @click.option('--top-k', type=int, default=None, help='記事ごとに保存する関連記事数（既定: RELATED_ARTICLES_COUNT）')
+    def rebuild_related_command(top_k):
+        """全公開記事の関連記事を再計算する"""
+        from .related import rebuild_related_articles
+
+        started = time.perf_counter()
+        count = rebuild_related_articles(top_k)
+        elapsed = time.perf_counter() - started
+        click.echo(f"関連記事を再計算しました: {count}件 ({elapsed:.2f}秒)")
+
+    @app.cli.command('rerender')
+    @click.option('--force', is_flag=True, help='保存済みのHTMLが最新でも再描画する')
+    def rerender_command(force):
+        """全記事・全コメントのMarkdownをワーカープロセスで並列に再描画する"""
+        from .rendering import rerender_all
+
+        started = time.perf_counter()
+        result = rerender_all(force=force)
+        elapsed = time.perf_counter() - started
+        rate = result['rendered'] / elapsed if elapsed > 0 else 0
+        click.echo(f"再描画しました: {result['rendered']}件 (最新のため省略: {result['skipped']}件, "
+                   f"失敗: {result['failed']}件) {elapsed:.2f}秒, {rate:.1f}件/秒")
+
+    @app.cli.command('reconcile-counters')
+    def reconcile_counters_command():
+        """閲覧数・いいね数・コメント数の集計カラムを実データの件数で修復する"""
+        from .engagement import reconcile_engagement_counters
+
+        result = reconcile_engagement_counters()
+        click.echo(f"集計値を修復しました: 記事 {result['knowledge']}件, コメント {result['comment']}件")
+
+    @app.cli.command('rebuild-daily-stats')
+    def rebuild_daily_stats_command():
+        """日別のエンゲージメント集計を閲覧履歴・いいね・コメントから再構築する"""
+        from .engagement import rebuild_daily_stats
+
+        started = time.perf_counter()
+        count = rebuild_daily_stats()
+        elapsed = time.perf_counter() - started
+        click.echo(f"日別集計を再構築しました: {count}行 ({elapsed:.2f}秒)")
+
+    @app.cli.command('compact-view-history')
+    @click.option('--retention-days', type=int, default=None, help='閲覧履歴を保持する日数（既定: VIEW_HISTORY_RETENTION_DAYS）')
+    def compact_view_history_command(retention_days):
+        """保持期間を過ぎた閲覧履歴を記事ごと・日ごとの件数に集約して削除する"""
+        from .engagement import compact_view_history
+
+        started = time.perf_counter()
+        count = compact_view_history(retention_days)
+        elapsed = time.perf_counter() - started
+        click.echo(f"閲覧履歴を集約しました: {count}件 ({elapsed:.2f}秒)")
+
+    @app.cli.command('rebuild-reader-sketches')
+    def rebuild_reader_sketches_command():
+        """ユニーク閲覧者数のスケッチを閲覧履歴から再構築する"""
+        from .readers import rebuild_reader_sketches
+
+        started = time.perf_counter()
+        count = rebuild_reader_sketches()
+        elapsed = time.perf_counter() - started
+        click.echo(f"閲覧者のスケッチを再構築しました: {count}件 ({elapsed:.2f}秒)")
+
+    @app.cli.command('rebuild-trending')
+    def rebuild_trending_command():
+        """トレンドスコアを閲覧履歴・いいね・コメントから再計算する（半減期の変更後など）"""
+        from .engagement import rebuild_trending_scores
+
+        started = time.perf_counter()
+        count = rebuild_trending_scores()
+        elapsed = time.perf_counter() - started
+        click.echo(f"トレンドスコアを再計算しました: {count}件 ({elapsed:.2f}秒)")
@@ -46,6 +46,37 @@ API_KEY_HEADER_NAME = os.environ.get('API_KEY_HEADER_NAME', 'X-API-Key')
 # 人気記事表示件数設定
 POPULAR_ARTICLES_COUNT = int(os.environ.get('POPULAR_ARTICLES_COUNT', '5'))
 
+# 人気記事ランキングのキャッシュ設定（有効期限切れ後は古い結果を返しつつバックグラウンドで再計算）
+POPULAR_CACHE_TTL_SECONDS = float(os.environ.get('POPULAR_CACHE_TTL_SECONDS', '300'))
+POPULAR_CACHE_MAX_ENTRIES = int(os.environ.get('POPULAR_CACHE_MAX_ENTRIES', '64'))
+
+# 閲覧履歴の書き込みバッファ設定（件数または間隔に達したらまとめて書き込む、間隔0以下で閲覧ごとに書き込み）
+VIEW_BUFFER_SIZE = int(os.environ.get('VIEW_BUFFER_SIZE', '100'))
+VIEW_FLUSH_INTERVAL_SECONDS = float(os.environ.get('VIEW_FLUSH_INTERVAL_SECONDS', '5'))
+
+# 閲覧履歴の保持日数（過ぎた分は記事ごと・日ごとの件数に集約して削除、0で無期限）
+VIEW_HISTORY_RETENTION_DAYS = int(os.environ.get('VIEW_HISTORY_RETENTION_DAYS', '365'))
+
+# トレンドスコアの半減期（時間、変更後は flask rebuild-trending で再計算）
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', '24'))
+
+# 関連記事表示件数設定
+RELATED_ARTICLES_COUNT = int(os.environ.get('RELATED_ARTICLES_COUNT', '5'))
+
+# Markdown描画結果のキャッシュ件数（プロセス内LRU）
+RENDER_CACHE_SIZE = int(os.environ.get('RENDER_CACHE_SIZE', '1000'))
+
+# コードブロックのハイライト結果のキャッシュ件数（プロセス内LRU）
+CODE_HIGHLIGHT_CACHE_SIZE = int(os.environ.get('CODE_HIGHLIGHT_CACHE_SIZE', '2000'))
+
+# Markdown変換のワーカープロセス設定（この文字数以上の本文をワーカーで変換し、時間切れは代替表示）
+RENDER_POOL_WORKERS = int(os.environ.get('RENDER_POOL_WORKERS', str(os.cpu_count() or 1)))
+RENDER_POOL_MIN_LENGTH = int(os.environ.get('RENDER_POOL_MIN_LENGTH', '20000'))
+RENDER_TIMEOUT_SECONDS = float(os.environ.get('RENDER_TIMEOUT_SECONDS', '5'))
+
+# 検索エンジン設定（auto: SQLiteではFTS5、それ以外はプロセス内インデックス / fts5 / memory / like）
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto').lower()
+
 # タイムゾーン設定
 import pytz
 JST = pytz.timezone('Asia/Tokyo')
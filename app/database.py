@@ -113,9 +113,16 @@ def auto_migrate_database(app, db):
 def setup_database_migration(app, db):
     """データベースとマイグレーションの初期設定"""
     from flask_migrate import Migrate
+    from .search import is_search_index_table
+    
+    def include_object(object, name, type_, reflected, compare_to):
+        # 全文検索インデックス（FTS5仮想テーブル）はマイグレーション管理の対象外
+        if type_ == 'table' and is_search_index_table(name):
+            return False
+        return True
     
     # マイグレーションの初期化
-    migrate = Migrate(app, db)
+    migrate = Migrate(app, db, include_object=include_object)
     
     # アプリケーション起動時にマイグレーションを自動実行
     auto_migrate_database(app, db)
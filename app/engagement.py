@@ -0,0 +1,499 @@
+"""
+エンゲージメント集計値（閲覧数・いいね数・コメント数）の管理
+
+Knowledge.view_count / like_count / comment_count と Comment.like_count は
+閲覧・いいね・コメントの書き込みと同じトランザクション内で
+UPDATE ... SET col = col + :delta により原子的に更新する。
+集計値のずれは reconcile_engagement_counters()（flask reconcile-counters）で一括修復する。
+
+期間指定の統計用に、記事ごと・日ごと（UTC）の件数を knowledge_daily_stats に同じく書き込み時に加算する。
+いいねの取り消し・コメントの削除は元の作成日の件数から減算する。
+既存データからの再構築は rebuild_daily_stats()（flask rebuild-daily-stats）で行う。
+
+トレンドスコア（Knowledge.trending_score）は閲覧・いいね・コメントを半減期 TRENDING_HALF_LIFE_HOURS で
+減衰させた重み付き件数の合計で、基準時刻からの経過時間で重みを増やして log2 で保存する（forward decay）。
+全記事に共通の減衰は読み出し時にだけ掛ければよいため、イベントごとに1行を更新するだけで定期的な再計算は不要。
+
+閲覧履歴は VIEW_HISTORY_RETENTION_DAYS 日を過ぎると compact_view_history() で記事ごと・日ごとの件数
+（view_history_archive）に集約して削除する。修復・再構築では保存済みの件数を合算するため、全期間の閲覧数は変わらない。
+"""
+
+import math
+from datetime import datetime, timezone
+
+# 日別集計の再構築で1回に処理する記事IDの範囲
+DAILY_STATS_CHUNK_SIZE = 500
+
+# 保持期間を過ぎた閲覧履歴の集約・削除で1回に処理する件数
+VIEW_COMPACTION_BATCH_SIZE = 1000
+
+# トレンドスコアの重み（1件あたり）と、経過時間を数える基準時刻
+TRENDING_WEIGHTS = {'views': 1.0, 'likes': 3.0, 'comments': 5.0}
+TRENDING_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def _increment(table, object_id, column, delta):
+    """集計カラムを原子的に増減（ORMのイベントと更新日時の自動更新を起こさない）"""
+    from .models import db
+
+    values = {column: table.c[column] + delta}
+    if 'updated_at' in table.c:
+        values['updated_at'] = table.c.updated_at  # 集計値の更新では更新日時を変えない
+    db.session.execute(table.update().where(table.c.id == object_id).values(**values))
+
+
+def increment_view_count(knowledge_id, delta=1, day=None):
+    """記事の閲覧数（合計・日別）を増減"""
+    from .models import Knowledge
+    _increment(Knowledge.__table__, knowledge_id, 'view_count', delta)
+    record_daily_stats(knowledge_id, day, views=delta)
+    record_trending(knowledge_id, 'views', delta, day)
+
+
+def increment_like_count(knowledge_id, delta=1, day=None):
+    """記事のいいね数（合計・日別）を増減（取り消し時は day にいいねの作成日時を指定）"""
+    from .models import Knowledge
+    _increment(Knowledge.__table__, knowledge_id, 'like_count', delta)
+    record_daily_stats(knowledge_id, day, likes=delta)
+    record_trending(knowledge_id, 'likes', delta, day)
+
+
+def increment_comment_count(knowledge_id, delta=1, day=None):
+    """記事のコメント数（合計・日別）を増減（削除時は day にコメントの作成日時を指定）"""
+    from .models import Knowledge
+    _increment(Knowledge.__table__, knowledge_id, 'comment_count', delta)
+    record_daily_stats(knowledge_id, day, comments=delta)
+    record_trending(knowledge_id, 'comments', delta, day)
+
+
+def increment_comment_like_count(comment_id, delta=1):
+    """コメントのいいね数を増減"""
+    from .models import Comment
+    _increment(Comment.__table__, comment_id, 'like_count', delta)
+
+
+def reconcile_engagement_counters():
+    """集計カラムを実データの件数で一括修復
+
+    相関サブクエリによるUPDATEを表ごとに1回実行し、値がずれている行のみ更新する。
+
+    Returns:
+        dict: {'knowledge': 修復した記事数, 'comment': 修復したコメント数}
+    """
+    from .models import db, Knowledge, Comment, Like, CommentLike, ViewHistory, ViewHistoryArchive
+    from sqlalchemy import func, or_, select
+
+    knowledge = Knowledge.__table__
+    # 閲覧数は保持期間内の閲覧履歴と、保持期間を過ぎて削除した閲覧履歴の保存済み件数の合計
+    view_count = select(func.count(ViewHistory.id)).where(
+        ViewHistory.knowledge_id == knowledge.c.id
+    ).scalar_subquery() + select(func.coalesce(func.sum(ViewHistoryArchive.views), 0)).where(
+        ViewHistoryArchive.knowledge_id == knowledge.c.id
+    ).scalar_subquery()
+    like_count = select(func.count(Like.id)).where(
+        Like.knowledge_id == knowledge.c.id
+    ).scalar_subquery()
+    comment_count = select(func.count(Comment.id)).where(
+        Comment.knowledge_id == knowledge.c.id
+    ).scalar_subquery()
+    knowledge_result = db.session.execute(
+        knowledge.update().where(or_(
+            knowledge.c.view_count != view_count,
+            knowledge.c.like_count != like_count,
+            knowledge.c.comment_count != comment_count
+        )).values(
+            view_count=view_count,
+            like_count=like_count,
+            comment_count=comment_count,
+            updated_at=knowledge.c.updated_at
+        )
+    )
+
+    comment = Comment.__table__
+    comment_like_count = select(func.count(CommentLike.id)).where(
+        CommentLike.comment_id == comment.c.id
+    ).scalar_subquery()
+    comment_result = db.session.execute(
+        comment.update().where(
+            comment.c.like_count != comment_like_count
+        ).values(like_count=comment_like_count)
+    )
+
+    db.session.commit()
+    return {'knowledge': knowledge_result.rowcount, 'comment': comment_result.rowcount}
+
+
+def upsert_increment(table, keys, increments):
+    """キーに一致する行があれば加算し、なければ挿入（データベースごとのUPSERT構文を使用）
+
+    Args:
+        table: 対象テーブル（keys のカラムが主キーまたは一意制約であること）
+        keys: {カラム名: 値} 行を特定するキー
+        increments: {カラム名: 加算値}
+    """
+    from .models import db
+
+    dialect = db.session.get_bind().dialect.name
+    row = {**keys, **increments}
+
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table).values(**row)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: table.c[column] + statement.excluded[column] for column in increments}
+        )
+    elif dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table).values(**row)
+        statement = statement.on_duplicate_key_update(
+            {column: table.c[column] + statement.inserted[column] for column in increments}
+        )
+    else:
+        # UPSERT構文がない場合は更新してから、対象行がなければ挿入
+        condition = [table.c[column] == value for column, value in keys.items()]
+        result = db.session.execute(table.update().where(*condition).values(
+            {column: table.c[column] + value for column, value in increments.items()}
+        ))
+        if result.rowcount == 0:
+            db.session.execute(table.insert().values(**row))
+        return
+
+    db.session.execute(statement)
+
+
+def record_daily_stats(knowledge_id, day=None, views=0, likes=0, comments=0):
+    """記事の日別集計を加算（day を省略した場合は今日、UTC）"""
+    from .models import KnowledgeDailyStats
+
+    if day is None:
+        day = datetime.now(timezone.utc).date()
+    elif isinstance(day, datetime):
+        day = day.date()
+    upsert_increment(
+        KnowledgeDailyStats.__table__,
+        {'knowledge_id': knowledge_id, 'day': day},
+        {'views': views, 'likes': likes, 'comments': comments}
+    )
+
+
+def trending_exponent(at):
+    """基準時刻から at までの経過時間（半減期単位）"""
+    from .config import TRENDING_HALF_LIFE_HOURS
+
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    return (at - TRENDING_EPOCH).total_seconds() / 3600 / TRENDING_HALF_LIFE_HOURS
+
+
+def add_log2(a, b):
+    """log2(2^a + 2^b)（どちらかが None の場合はもう一方）"""
+    if a is None or b is None:
+        return b if a is None else a
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def record_trending(knowledge_id, metric, delta=1, at=None):
+    """記事のトレンドスコアにイベントを加算（delta が負の場合は同じ時刻の分を減算）
+
+    Args:
+        at: イベントの日時（取り消し時は元の作成日時、日時でない場合は現在時刻）
+    """
+    from .models import db, Knowledge
+    from sqlalchemy import select
+
+    if not delta:
+        return
+    if not isinstance(at, datetime):
+        at = datetime.now(timezone.utc)
+    contribution = math.log2(TRENDING_WEIGHTS[metric] * abs(delta)) + trending_exponent(at)
+
+    table = Knowledge.__table__
+    current = db.session.execute(
+        select(table.c.trending_score).where(table.c.id == knowledge_id).with_for_update()
+    ).scalar()
+    if delta > 0:
+        score = add_log2(current, contribution)
+    elif current is None or contribution >= current - 1e-9:
+        score = None
+    else:
+        score = current + math.log2(1 - 2 ** (contribution - current))
+
+    db.session.execute(table.update().where(table.c.id == knowledge_id).values(
+        trending_score=score, updated_at=table.c.updated_at
+    ))
+
+
+def rebuild_trending_scores(chunk_size=DAILY_STATS_CHUNK_SIZE):
+    """トレンドスコアを閲覧履歴・いいね・コメントから再計算（半減期の変更後など）
+
+    保持期間を過ぎて削除した閲覧履歴は、保存済みの日別件数をその日の正午の閲覧として扱う。
+
+    Returns:
+        int: スコアのある記事数
+    """
+    from .models import db, Knowledge, Comment, Like, ViewHistory, ViewHistoryArchive
+    from sqlalchemy import func
+
+    table = Knowledge.__table__
+    max_id = db.session.query(func.max(Knowledge.id)).scalar() or 0
+    scored = 0
+    for first_id in range(1, max_id + 1, chunk_size):
+        last_id = first_id + chunk_size - 1
+        scores = {}
+
+        def add(knowledge_id, metric, at, count=1):
+            contribution = math.log2(TRENDING_WEIGHTS[metric] * count) + trending_exponent(at)
+            scores[knowledge_id] = add_log2(scores.get(knowledge_id), contribution)
+
+        for row in db.session.query(ViewHistory.knowledge_id, ViewHistory.viewed_at).filter(
+            ViewHistory.knowledge_id.between(first_id, last_id), ViewHistory.viewed_at.isnot(None)
+        ):
+            add(row.knowledge_id, 'views', row.viewed_at)
+        for row in db.session.query(ViewHistoryArchive).filter(
+            ViewHistoryArchive.knowledge_id.between(first_id, last_id), ViewHistoryArchive.views > 0
+        ):
+            add(row.knowledge_id, 'views', datetime(row.day.year, row.day.month, row.day.day, 12), row.views)
+        for model, metric in ((Like, 'likes'), (Comment, 'comments')):
+            for row in db.session.query(model.knowledge_id, model.created_at).filter(
+                model.knowledge_id.between(first_id, last_id), model.created_at.isnot(None)
+            ):
+                add(row.knowledge_id, metric, row.created_at)
+
+        db.session.execute(table.update().where(table.c.id.between(first_id, last_id)).values(
+            trending_score=None, updated_at=table.c.updated_at
+        ))
+        for knowledge_id, score in scores.items():
+            db.session.execute(table.update().where(table.c.id == knowledge_id).values(
+                trending_score=score, updated_at=table.c.updated_at
+            ))
+        db.session.commit()
+        scored += len(scores)
+
+    return scored
+
+
+def daily_stats_source_query(first_id, last_id):
+    """指定した記事ID範囲の日別集計を実データから求めるSELECT文"""
+    from .models import Comment, Like, ViewHistory, ViewHistoryArchive
+    from sqlalchemy import func, literal, select, union_all
+
+    def per_day(model, timestamp, column):
+        day = func.date(timestamp)
+        counts = {name: literal(0) for name in ('views', 'likes', 'comments')}
+        counts[column] = func.count()
+        return select(
+            model.knowledge_id.label('knowledge_id'),
+            day.label('day'),
+            *[value.label(name) for name, value in counts.items()]
+        ).where(
+            model.knowledge_id.between(first_id, last_id)
+        ).group_by(model.knowledge_id, day)
+
+    # 保持期間を過ぎて削除した閲覧履歴は保存済みの日別件数を使う
+    archived_views = select(
+        ViewHistoryArchive.knowledge_id.label('knowledge_id'),
+        ViewHistoryArchive.day.label('day'),
+        ViewHistoryArchive.views.label('views'),
+        literal(0).label('likes'),
+        literal(0).label('comments')
+    ).where(ViewHistoryArchive.knowledge_id.between(first_id, last_id))
+
+    events = union_all(
+        per_day(ViewHistory, ViewHistory.viewed_at, 'views'),
+        archived_views,
+        per_day(Like, Like.created_at, 'likes'),
+        per_day(Comment, Comment.created_at, 'comments')
+    ).subquery()
+    return select(
+        events.c.knowledge_id,
+        events.c.day,
+        func.sum(events.c.views),
+        func.sum(events.c.likes),
+        func.sum(events.c.comments)
+    ).group_by(events.c.knowledge_id, events.c.day)
+
+
+def rebuild_daily_stats(chunk_size=DAILY_STATS_CHUNK_SIZE):
+    """日別集計を実データから再構築（記事IDの範囲ごとに集計・コミット）
+
+    Returns:
+        int: 作成した集計行数
+    """
+    from .models import db, Knowledge, KnowledgeDailyStats
+    from sqlalchemy import func
+
+    table = KnowledgeDailyStats.__table__
+    db.session.execute(table.delete())
+    db.session.commit()
+
+    max_id = db.session.query(func.max(Knowledge.id)).scalar() or 0
+    for first_id in range(1, max_id + 1, chunk_size):
+        db.session.execute(table.insert().from_select(
+            ['knowledge_id', 'day', 'views', 'likes', 'comments'],
+            daily_stats_source_query(first_id, first_id + chunk_size - 1)
+        ))
+        db.session.commit()
+
+    return db.session.query(func.count()).select_from(table).scalar()
+
+
+def compact_view_history(retention_days=None, batch_size=VIEW_COMPACTION_BATCH_SIZE):
+    """保持期間を過ぎた閲覧履歴を記事ごと・日ごとの件数に集約して削除
+
+    batch_size 件ずつ、件数の加算と閲覧履歴の削除を1トランザクションで行う。
+    閲覧数の集計カラムと日別集計は変わらない（再集計時は保存済みの件数を合算する）。
+
+    Args:
+        retention_days: 閲覧履歴を保持する日数（省略時は VIEW_HISTORY_RETENTION_DAYS、0以下の場合は何もしない）
+
+    Returns:
+        int: 削除した閲覧履歴の件数
+    """
+    from .models import db, ViewHistory, ViewHistoryArchive
+    from .config import VIEW_HISTORY_RETENTION_DAYS
+    from datetime import timedelta
+    from sqlalchemy import func
+
+    if retention_days is None:
+        retention_days = VIEW_HISTORY_RETENTION_DAYS
+    if retention_days <= 0:
+        return 0
+
+    cutoff = datetime.now(timezone.utc).date() - timedelta(days=retention_days)
+    table = ViewHistory.__table__
+    archived = 0
+    while True:
+        ids = [row.id for row in db.session.query(ViewHistory.id).filter(
+            ViewHistory.view_date < cutoff
+        ).order_by(ViewHistory.id).limit(batch_size)]
+        if not ids:
+            break
+
+        for row in db.session.query(
+            ViewHistory.knowledge_id, ViewHistory.view_date, func.count().label('views')
+        ).filter(ViewHistory.id.in_(ids)).group_by(ViewHistory.knowledge_id, ViewHistory.view_date):
+            upsert_increment(
+                ViewHistoryArchive.__table__,
+                {'knowledge_id': row.knowledge_id, 'day': row.view_date},
+                {'views': row.views}
+            )
+        db.session.execute(table.delete().where(table.c.id.in_(ids)))
+        db.session.commit()
+        archived += len(ids)
+
+    return archived
+
+
+def get_daily_stats_totals(knowledge_ids, days):
+    """直近 days 日（days 日前の日付から今日まで、UTC）の閲覧・いいね・コメント数の合計を日別集計から取得
+
+    Returns:
+        dict: {knowledge_id: {'views': count, 'likes': count, 'comments': count}} 集計のない記事は含まない
+    """
+    from .models import db, KnowledgeDailyStats
+    from datetime import timedelta
+    from sqlalchemy import func
+
+    if not knowledge_ids:
+        return {}
+
+    first_day = datetime.now(timezone.utc).date() - timedelta(days=days)
+    rows = db.session.query(
+        KnowledgeDailyStats.knowledge_id,
+        func.sum(KnowledgeDailyStats.views).label('views'),
+        func.sum(KnowledgeDailyStats.likes).label('likes'),
+        func.sum(KnowledgeDailyStats.comments).label('comments')
+    ).filter(
+        KnowledgeDailyStats.knowledge_id.in_(knowledge_ids),
+        KnowledgeDailyStats.day >= first_day
+    ).group_by(KnowledgeDailyStats.knowledge_id).all()
+    return {
+        row.knowledge_id: {'views': row.views or 0, 'likes': row.likes or 0, 'comments': row.comments or 0}
+        for row in rows
+    }
+
+
+POPULAR_METRICS = ('views', 'likes', 'comments')
+
+
+def get_popular_rankings(limit, days=None):
+    """閲覧数・いいね数・コメント数それぞれの上位 limit 件の公開記事をデータベース側で求める
+
+    各指標について件数の多い順（同数は記事ID順）に LIMIT 付きで取得し、
+    件数が limit に満たない場合は該当期間の件数が0の記事を記事ID順に補う。
+    期間指定がない場合は集計カラム、ある場合は日別集計を参照する。
+    'trending' にはトレンドスコアの上位（スコアのある記事のみ、件数に現在のスコア 'score' を追加）を含む。
+
+    Returns:
+        dict: {'views' | 'likes' | 'comments' | 'trending': [(knowledge_id, {'views', 'likes', 'comments'})]}
+    """
+    from .models import db, Knowledge, KnowledgeDailyStats
+    from datetime import timedelta
+    from sqlalchemy import func
+
+    if limit <= 0:
+        return {metric: [] for metric in POPULAR_METRICS + ('trending',)}
+
+    published = Knowledge.is_draft == False
+    ranked_ids = {}
+    for metric in POPULAR_METRICS:
+        if days:
+            first_day = datetime.now(timezone.utc).date() - timedelta(days=days)
+            total = func.sum(getattr(KnowledgeDailyStats, metric))
+            query = db.session.query(KnowledgeDailyStats.knowledge_id).join(
+                Knowledge, Knowledge.id == KnowledgeDailyStats.knowledge_id
+            ).filter(
+                published,
+                KnowledgeDailyStats.day >= first_day
+            ).group_by(KnowledgeDailyStats.knowledge_id).having(total > 0).order_by(
+                total.desc(), KnowledgeDailyStats.knowledge_id
+            )
+        else:
+            counter = getattr(Knowledge, f'{metric[:-1]}_count')
+            query = db.session.query(Knowledge.id).filter(published, counter > 0).order_by(
+                counter.desc(), Knowledge.id
+            )
+        ids = [row[0] for row in query.limit(limit)]
+
+        # 件数が0の記事で不足分を補う（元の並び順と同じく記事ID順）
+        if len(ids) < limit:
+            ids += [row[0] for row in db.session.query(Knowledge.id).filter(
+                published, Knowledge.id.notin_(ids)
+            ).order_by(Knowledge.id).limit(limit - len(ids))]
+        ranked_ids[metric] = ids
+
+    # トレンドスコアの上位（スコアのある記事のみ）
+    now_exponent = trending_exponent(datetime.now(timezone.utc))
+    trending = db.session.query(Knowledge.id, Knowledge.trending_score).filter(
+        published, Knowledge.trending_score.isnot(None)
+    ).order_by(Knowledge.trending_score.desc(), Knowledge.id).limit(limit).all()
+
+    # 上位に入った記事のみ3指標の件数を取得
+    winner_ids = sorted({knowledge_id for ids in ranked_ids.values() for knowledge_id in ids} |
+                        {row.id for row in trending})
+    if days:
+        totals = get_daily_stats_totals(winner_ids, days)
+    else:
+        totals = {
+            row.id: {'views': row.view_count, 'likes': row.like_count, 'comments': row.comment_count}
+            for row in db.session.query(
+                Knowledge.id, Knowledge.view_count, Knowledge.like_count, Knowledge.comment_count
+            ).filter(Knowledge.id.in_(winner_ids))
+        }
+
+    zero = {'views': 0, 'likes': 0, 'comments': 0}
+    rankings = {
+        metric: [(knowledge_id, totals.get(knowledge_id, zero)) for knowledge_id in ids]
+        for metric, ids in ranked_ids.items()
+    }
+    # 現在時刻まで減衰させたスコア（今の時点での重み付き件数）
+    rankings['trending'] = [
+        (row.id, {**totals.get(row.id, zero), 'score': round(2 ** (row.trending_score - now_exponent), 4)})
+        for row in trending
+    ]
+    return rankings
@@ -0,0 +1,115 @@
+"""
+添付ファイルのテキスト抽出
+
+テキスト系の添付ファイル（md/txt/csv/json/xml）から本文を抽出して
+Attachment.extracted_text に保存する。抽出はバックグラウンドのワーカースレッドで
+実行し、保存時のイベントで記事の検索インデックスに反映される。
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# テキストを抽出する拡張子
+TEXT_EXTRACTABLE_EXTENSIONS = {'md', 'txt', 'csv', 'json', 'xml'}
+
+# 抽出するテキストの最大文字数
+MAX_EXTRACTED_TEXT_LENGTH = 200000
+
+# 試行する文字コード（日本語環境のShift_JISファイルにも対応）
+_ENCODINGS = ('utf-8-sig', 'cp932')
+
+_XML_TAG_PATTERN = re.compile(r'<[^>]+>')
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='text-extraction')
+_app = None
+
+
+def is_text_extractable(filename):
+    """テキスト抽出対象の拡張子かどうか"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in TEXT_EXTRACTABLE_EXTENSIONS
+
+
+def extract_text(file_path, filename):
+    """ファイルからテキストを抽出"""
+    with open(file_path, 'rb') as f:
+        data = f.read(MAX_EXTRACTED_TEXT_LENGTH * 4)
+
+    for encoding in _ENCODINGS:
+        try:
+            content = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        content = data.decode('utf-8', errors='replace')
+
+    # XMLはタグを除いた文字列のみを対象にする
+    if filename.rsplit('.', 1)[1].lower() == 'xml':
+        content = _XML_TAG_PATTERN.sub(' ', content)
+
+    return content[:MAX_EXTRACTED_TEXT_LENGTH]
+
+
+def init_text_extraction(app):
+    """テキスト抽出ワーカーを初期化し、未抽出の添付ファイルを処理待ちに追加
+
+    抽出結果の保存時のイベントで検索インデックスを更新するため、イベントリスナーの登録後に呼び出す。
+    未抽出の添付ファイルは拡張子をSQLで絞り込み、画像・アーカイブなど抽出対象外のファイルは読み込まない。
+    """
+    global _app
+    from sqlalchemy import func, or_
+    from .models import Attachment
+    from .utils import audit_logger
+
+    _app = app
+    try:
+        with app.app_context():
+            pending = Attachment.query.with_entities(Attachment.id).filter(
+                Attachment.extracted_text.is_(None),
+                or_(*[
+                    func.lower(Attachment.filename).like(f'%.{extension}')
+                    for extension in sorted(TEXT_EXTRACTABLE_EXTENSIONS)
+                ])
+            ).all()
+    except Exception as e:
+        audit_logger.error(f"Failed to load attachments for text extraction: {e}")
+        return
+
+    for attachment_id, in pending:
+        schedule_text_extraction(attachment_id)
+
+
+def schedule_text_extraction(attachment_id):
+    """添付ファイルのテキスト抽出をワーカーに投入"""
+    if _app is None:
+        return
+    _executor.submit(_run_extraction, attachment_id)
+
+
+def _run_extraction(attachment_id):
+    """ワーカースレッドでテキストを抽出して保存"""
+    from .models import db, Attachment
+    from .utils import audit_logger
+
+    with _app.app_context():
+        try:
+            attachment = db.session.get(Attachment, attachment_id)
+            if attachment is None or attachment.extracted_text is not None:
+                return
+
+            file_path = os.path.join(_app.config['UPLOAD_FOLDER'], attachment.stored_filename)
+            try:
+                attachment.extracted_text = extract_text(file_path, attachment.filename)
+            except OSError as e:
+                # 読み込めないファイルは再試行しないよう空文字を保存
+                audit_logger.error(f"Text extraction failed for {attachment.stored_filename}: {e}")
+                attachment.extracted_text = ''
+
+            db.session.commit()
+            audit_logger.info(f"Extracted text from attachment - Attachment ID:{attachment_id}, Knowledge ID:{attachment.knowledge_id}")
+        except Exception as e:
+            db.session.rollback()
+            audit_logger.error(f"Text extraction failed - Attachment ID:{attachment_id}: {e}")
+        finally:
+            db.session.remove()
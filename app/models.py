@@ -18,6 +18,13 @@ class Knowledge(db.Model):
     is_draft = db.Column(db.Boolean, default=False, nullable=False)  # 下書きフラグ
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    view_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # 閲覧数（集計値）
+    like_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # いいね数（集計値）
+    comment_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # コメント数（集計値）
+    trending_score = db.Column(db.Float, nullable=True, index=True)  # トレンドスコア（減衰付き重み付き件数のlog2、イベントなしはNull）
+    excerpt = db.Column(db.Text, nullable=True)  # 一覧表示用の抜粋（本文の先頭5行、保存時に作成）
+    rendered_html = db.Column(db.Text, nullable=True)  # 本文の描画結果（キャッシュ）
+    rendered_key = db.Column(db.String(100), nullable=True)  # 描画時の本文ハッシュと拡張機能構成のキー
     
     # コメントとのリレーションシップ
     comments = db.relationship('Comment', backref='knowledge', lazy=True, cascade='all, delete-orphan')
@@ -31,20 +38,20 @@ class Knowledge(db.Model):
     view_histories = db.relationship('ViewHistory', backref='knowledge', lazy=True, cascade='all, delete-orphan')
     
     # 統計取得メソッド群（統一されたAPI）
-    # 【個別記事用】get_xxx_count(): 総数取得（リレーションシップベース）
-    # 【複数記事用】utils.get_bulk_engagement_stats() でN+1問題を回避
+    # 【個別記事用】get_xxx_count(): 総数取得（集計カラム、engagement.py で更新）
+    # 【複数記事用】utils.get_listing_engagement() で件数・添付ファイル数・タグを1回のクエリで取得（N+1問題を回避）
     
     def get_view_count(self):
-        """総閲覧数を効率的に計算（リレーションシップベース）"""
-        return len(self.view_histories)
+        """総閲覧数（集計カラム）"""
+        return self.view_count
     
     def get_like_count(self):
-        """総いいね数を効率的に計算（リレーションシップベース）"""
-        return len(self.likes)
+        """総いいね数（集計カラム）"""
+        return self.like_count
     
     def get_comment_count(self):
-        """総コメント数を効率的に計算（リレーションシップベース）"""
-        return len(self.comments)
+        """総コメント数（集計カラム）"""
+        return self.comment_count
 
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -52,6 +59,9 @@ class Comment(db.Model):
     author = db.Column(db.String(100), nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     knowledge_id = db.Column(db.Integer, db.ForeignKey('knowledge.id'), nullable=False)
+    like_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # いいね数（集計値）
+    rendered_html = db.Column(db.Text, nullable=True)  # 本文の描画結果（キャッシュ）
+    rendered_key = db.Column(db.String(100), nullable=True)  # 描画時の本文ハッシュと拡張機能構成のキー
     
     # コメントいいねとのリレーションシップ
     comment_likes = db.relationship('CommentLike', backref='comment', lazy=True, cascade='all, delete-orphan')
@@ -83,6 +93,7 @@ class Attachment(db.Model):
     knowledge_id = db.Column(db.Integer, db.ForeignKey('knowledge.id'), nullable=True)  # ドラッグ&ドロップ時は一時的にNullを許可
     uploaded_by = db.Column(db.String(100), nullable=False)  # アップロードしたユーザー
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    extracted_text = db.Column(db.Text, nullable=True)  # 検索用に抽出したテキスト（未抽出はNull）
 
 class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -95,14 +106,69 @@ class Tag(db.Model):
     def __repr__(self):
         return f'<Tag {self.name}>'
 
+def _view_date_default(context):
+    """閲覧日時の日付部分（閲覧日時の指定がない場合は今日、UTC）"""
+    viewed_at = context.get_current_parameters().get('viewed_at')
+    return (viewed_at or datetime.now(timezone.utc)).date()
+
 class ViewHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(100), nullable=False)  # 閲覧したユーザー
     knowledge_id = db.Column(db.Integer, db.ForeignKey('knowledge.id'), nullable=False)  # 閲覧された記事
     viewed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))  # 閲覧日時
+    view_date = db.Column(db.Date, nullable=False, default=_view_date_default)  # 閲覧日（UTC）
     
     # 同一ユーザーが同一記事を同じ日に複数回閲覧しても1回とカウント
-    # 日付部分のみでユニーク制約を設定するため、アプリケーションレベルで制御
+    __table_args__ = (db.UniqueConstraint('user_id', 'knowledge_id', 'view_date', name='unique_user_knowledge_view_date'),)
+    
+    def __repr__(self):
+        return f'<ViewHistory user:{self.user_id} knowledge:{self.knowledge_id} at:{self.viewed_at}>'
+
+class RelatedKnowledge(db.Model):
+    """関連記事（TF-IDFのコサイン類似度で事前計算した上位k件）"""
+    __tablename__ = 'related_knowledge'
+    
+    knowledge_id = db.Column(db.Integer, db.ForeignKey('knowledge.id'), primary_key=True)  # 基準の記事
+    rank = db.Column(db.Integer, primary_key=True)  # 類似度の順位（0始まり）
+    related_id = db.Column(db.Integer, db.ForeignKey('knowledge.id'), nullable=False, index=True)  # 関連記事
+    score = db.Column(db.Float, nullable=False)  # コサイン類似度
+    
+    related = db.relationship('Knowledge', foreign_keys=[related_id], lazy='joined')
+    
+    def __repr__(self):
+        return f'<RelatedKnowledge {self.knowledge_id} -> {self.related_id} ({self.score:.3f})>'
+
+class ViewHistoryArchive(db.Model):
+    """保持期間を過ぎて削除した閲覧履歴の記事ごと・日ごとの件数（日付はUTC）"""
+    __tablename__ = 'view_history_archive'
+    
+    knowledge_id = db.Column(db.Integer, db.ForeignKey('knowledge.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    views = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # 閲覧数
+    
+    def __repr__(self):
+        return f'<ViewHistoryArchive {self.knowledge_id} {self.day} v:{self.views}>'
+
+class KnowledgeDailyReaders(db.Model):
+    """記事ごと・日ごとの閲覧ユーザーのHyperLogLogスケッチ（ユニーク閲覧者数の推定用、日付はUTC）"""
+    __tablename__ = 'knowledge_daily_readers'
+    
+    knowledge_id = db.Column(db.Integer, db.ForeignKey('knowledge.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True, index=True)
+    sketch = db.Column(db.LargeBinary, nullable=False)  # zlib圧縮したレジスタ
+    
+    def __repr__(self):
+        return f'<KnowledgeDailyReaders {self.knowledge_id} {self.day}>'
+
+class KnowledgeDailyStats(db.Model):
+    """記事ごと・日ごとのエンゲージメント集計（期間指定の統計用、日付はUTC）"""
+    __tablename__ = 'knowledge_daily_stats'
+    
+    knowledge_id = db.Column(db.Integer, db.ForeignKey('knowledge.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True, index=True)
+    views = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # 閲覧数
+    likes = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # いいね数（取り消し分は作成日から減算）
+    comments = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # コメント数（削除分は作成日から減算）
     
     def __repr__(self):
-        return f'<ViewHistory user:{self.user_id} knowledge:{self.knowledge_id} at:{self.viewed_at}>'
\ No newline at end of file
+        return f'<KnowledgeDailyStats {self.knowledge_id} {self.day} v:{self.views} l:{self.likes} c:{self.comments}>'
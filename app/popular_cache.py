@@ -0,0 +1,180 @@
+"""
+人気記事ランキングのキャッシュ
+
+ランキングは全利用者で同じ結果になるため、(集計期間, 件数) ごとに計算結果（記事IDと件数）を
+プロセス内に保持する。有効期限（POPULAR_CACHE_TTL_SECONDS）を過ぎた結果は返しつつ、
+キーごとに1つだけバックグラウンドで再計算する（stale-while-revalidate）。
+キャッシュにない場合も計算はキーごとに1つだけ行い、同時に要求した他のリクエストはその結果を待つ。
+保持件数は POPULAR_CACHE_MAX_ENTRIES を上限とし、超えた場合は最も使われていないものから破棄する。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='popular-cache')
+_entries = OrderedDict()  # {(days, limit): (rankings, computed_at)}
+_refreshing = set()
+_computing = {}  # {(days, limit): threading.Event} キャッシュにないキーを計算中
+_lock = threading.Lock()
+_app = None
+
+_metrics = {
+    'hits': 0,
+    'stale_hits': 0,
+    'misses': 0,
+    'miss_waits': 0,
+    'evictions': 0,
+    'refreshes': 0,
+    'refresh_failures': 0,
+    'compute_seconds_total': 0.0,
+    'compute_seconds_max': 0.0,
+    'refresh_seconds_total': 0.0,
+    'refresh_seconds_max': 0.0
+}
+
+
+def init_popular_cache(app):
+    """バックグラウンド再計算で使うアプリケーションを登録"""
+    global _app
+    _app = app
+
+
+def _compute(days, limit):
+    from .engagement import get_popular_rankings
+    return get_popular_rankings(limit, days=days)
+
+
+def _store(key, rankings):
+    from .config import POPULAR_CACHE_MAX_ENTRIES
+
+    with _lock:
+        _entries[key] = (rankings, time.monotonic())
+        _entries.move_to_end(key)
+        while len(_entries) > max(POPULAR_CACHE_MAX_ENTRIES, 1):
+            _entries.popitem(last=False)
+            _metrics['evictions'] += 1
+
+
+def _record_timing(kind, elapsed):
+    with _lock:
+        _metrics[f'{kind}_seconds_total'] += elapsed
+        _metrics[f'{kind}_seconds_max'] = max(_metrics[f'{kind}_seconds_max'], elapsed)
+
+
+def get_cached_popular_rankings(limit, days=None):
+    """キャッシュ経由で人気記事ランキングを取得（get_popular_rankings と同じ形式）"""
+    from .config import POPULAR_CACHE_TTL_SECONDS
+
+    if POPULAR_CACHE_TTL_SECONDS <= 0:
+        return _compute(days, limit)
+
+    key = (days or None, limit)
+    waited = False
+    while True:
+        with _lock:
+            entry = _entries.get(key)
+            if entry is not None:
+                _entries.move_to_end(key)
+                rankings, computed_at = entry
+                if time.monotonic() - computed_at < POPULAR_CACHE_TTL_SECONDS:
+                    if not waited:
+                        _metrics['hits'] += 1
+                    return rankings
+                _metrics['stale_hits'] += 1
+                schedule_refresh = _app is not None and key not in _refreshing
+                if schedule_refresh:
+                    _refreshing.add(key)
+                break
+            computing = _computing.get(key)
+            if computing is None:
+                _metrics['misses'] += 1
+                computing = _computing[key] = threading.Event()
+                break
+            if not waited:
+                _metrics['miss_waits'] += 1
+                waited = True
+
+        # 他のリクエストが計算中のため完了を待ち、結果をキャッシュから読む（失敗した場合は自分で計算）
+        computing.wait()
+
+    if entry is not None:
+        if schedule_refresh:
+            _executor.submit(_run_refresh, key)
+        return rankings
+
+    try:
+        started = time.perf_counter()
+        rankings = _compute(days, limit)
+        _record_timing('compute', time.perf_counter() - started)
+        _store(key, rankings)
+    finally:
+        with _lock:
+            _computing.pop(key, None)
+        computing.set()
+    return rankings
+
+
+def _run_refresh(key):
+    from .models import db
+    from .utils import audit_logger
+
+    days, limit = key
+    started = time.perf_counter()
+    try:
+        with _app.app_context():
+            try:
+                rankings = _compute(days, limit)
+            finally:
+                db.session.remove()
+        _store(key, rankings)
+        _record_timing('refresh', time.perf_counter() - started)
+        with _lock:
+            _metrics['refreshes'] += 1
+    except Exception as e:
+        with _lock:
+            _metrics['refresh_failures'] += 1
+        audit_logger.error(f"Popular rankings refresh failed - Days:{days}, Limit:{limit}, Error:{e}")
+    finally:
+        with _lock:
+            _refreshing.discard(key)
+
+
+def clear_popular_cache():
+    """キャッシュと統計情報を消去"""
+    with _lock:
+        _entries.clear()
+        for name in _metrics:
+            _metrics[name] = 0.0 if name.endswith('seconds_total') or name.endswith('seconds_max') else 0
+
+
+def get_popular_cache_stats():
+    """ランキングキャッシュの統計情報（件数・ヒット率・計算時間）"""
+    from .config import POPULAR_CACHE_TTL_SECONDS, POPULAR_CACHE_MAX_ENTRIES
+
+    with _lock:
+        metrics = dict(_metrics)
+        size = len(_entries)
+        refreshing = len(_refreshing)
+
+    served = metrics['hits'] + metrics['stale_hits']
+    requests = served + metrics['misses'] + metrics['miss_waits']
+    return {
+        'size': size,
+        'max_size': POPULAR_CACHE_MAX_ENTRIES,
+        'ttl_seconds': POPULAR_CACHE_TTL_SECONDS,
+        'hits': metrics['hits'],
+        'stale_hits': metrics['stale_hits'],
+        'misses': metrics['misses'],
+        'miss_waits': metrics['miss_waits'],
+        'hit_rate': round(served / requests, 4) if requests else None,
+        'evictions': metrics['evictions'],
+        'refreshes': metrics['refreshes'],
+        'refresh_failures': metrics['refresh_failures'],
+        'refreshing': refreshing,
+        'compute_seconds_avg': round(metrics['compute_seconds_total'] / metrics['misses'], 6) if metrics['misses'] else None,
+        'compute_seconds_max': round(metrics['compute_seconds_max'], 6),
+        'refresh_seconds_avg': round(metrics['refresh_seconds_total'] / metrics['refreshes'], 6) if metrics['refreshes'] else None,
+        'refresh_seconds_max': round(metrics['refresh_seconds_max'], 6)
+    }
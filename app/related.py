@@ -0,0 +1,509 @@
+"""
+関連記事の事前計算
+
+公開記事ごとにTF-IDFベクトル（英数字は単語、日本語は文字バイグラム）を作成し、NumPyでバッチ単位に
+コサイン類似度を計算して上位k件を related_knowledge テーブルに保存する。
+記事の表示時は保存済みの一覧を読むだけで、リクエストごとの計算は行わない。
+
+- rebuild_related_articles(): 全件再計算（flask rebuild-related）
+- update_related_articles(): 変更された記事と、その記事が上位k件に入りうる記事のみ再計算
+
+差分更新では全件再計算時の語彙・IDFと記事ごとの疎なベクトル（RelatedModel）をプロセス内に保持し、
+変更された記事のみをベクトル化して保持済みのベクトルと比較する（全記事の再トークン化・密行列の作成は行わない）。
+公開記事数が語彙作成時から一定以上増えた場合は、語彙・IDFを作り直すため全件再計算する。
+保持するモデルはプロセスごとのため、他のプロセスで変更された記事の反映は全件再計算で行う。
+"""
+
+import math
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from .search_index import normalize_text, tokenize
+
+# 語彙の上限（文書頻度の高い順）
+RELATED_MAX_FEATURES = 4096
+
+# 全件計算のバッチサイズと、バッチとの積を求めるために密にする行数（メモリ使用量は (両者の和) × 語彙数 × 4バイト程度）
+RELATED_BATCH_SIZE = 1024
+RELATED_CHUNK_SIZE = 4096
+
+# タイトルの重み（タイトルの語を本文より重視する）
+TITLE_REPEAT = 3
+
+# 英数字の連続と、それ以外の文字（日本語など）の連続
+_TERM_PATTERN = re.compile(r'([a-z0-9_]+)|([^\W_a-z0-9]+)')
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='related-articles')
+_pending_ids = set()
+_pending_lock = threading.Lock()
+_app = None
+
+
+def _load_numpy():
+    """NumPyを読み込む（未インストールの場合は None）"""
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        from .utils import audit_logger
+        audit_logger.warning("NumPy is not installed. Related articles are disabled (pip install -r requirements.txt).")
+        return None
+
+
+def extract_terms(text):
+    """類似度計算用の語を取り出す（英数字は2文字以上の単語、日本語は文字バイグラム）"""
+    terms = []
+    for word, other in _TERM_PATTERN.findall(normalize_text(text)):
+        if word:
+            if len(word) >= 2:
+                terms.append(word)
+        else:
+            terms.extend(tokenize(other))
+    return terms
+
+
+def _load_documents():
+    """公開記事のIDとトークン列を取得"""
+    from .models import db, Knowledge
+
+    rows = db.session.query(Knowledge.id, Knowledge.title, Knowledge.content).filter(
+        Knowledge.is_draft == False
+    ).order_by(Knowledge.id).all()
+    ids = [row.id for row in rows]
+    tokens = [
+        extract_terms(((row.title or '') + ' ') * TITLE_REPEAT + (row.content or ''))
+        for row in rows
+    ]
+    return ids, tokens
+
+
+def fit_vocabulary(token_lists, max_features=RELATED_MAX_FEATURES):
+    """語彙（語→列番号）と列ごとのIDFを求める
+
+    1文書にしか出現しない語と半数を超える文書に出現する語は類似度に寄与しないため除外する。
+    """
+    document_count = len(token_lists)
+    document_frequency = Counter()
+    for tokens in token_lists:
+        document_frequency.update(set(tokens))
+
+    max_df = max(2, document_count // 2)
+    terms = [term for term, df in document_frequency.most_common() if 2 <= df <= max_df][:max_features]
+    vocabulary = {term: index for index, term in enumerate(terms)}
+    idf = [math.log((1 + document_count) / (1 + document_frequency[term])) + 1 for term in terms]
+    return vocabulary, idf
+
+
+def vectorize(np, tokens, vocabulary, idf):
+    """トークン列を疎なTF-IDFベクトル（列番号と重みの配列、L2正規化）に変換"""
+    columns, weights = [], []
+    for term, count in Counter(tokens).items():
+        column = vocabulary.get(term)
+        if column is not None:
+            columns.append(column)
+            weights.append((1 + math.log(count)) * idf[column])
+
+    columns = np.asarray(columns, dtype=np.int32)
+    weights = np.asarray(weights, dtype=np.float32)
+    norm = np.linalg.norm(weights)
+    if norm > 0:
+        weights /= norm
+    return columns, weights
+
+
+class RelatedModel:
+    """全件計算時の語彙・IDFと、公開記事ごとの疎なTF-IDFベクトル
+
+    ベクトルはCSR形式の配列（indptr / indices / data）で保持し、変更された記事のベクトルは
+    作り直すまで _changes に保持する（削除・非公開化された記事は None）。
+    """
+
+    # CSR配列を作り直す変更件数（記事数に対する割合、最小件数）
+    COMPACT_RATIO = 0.1
+    COMPACT_MIN_CHANGES = 256
+
+    # 語彙・IDFを作り直す記事数の増加（語彙作成時の記事数に対する割合）。この記事数未満では変更ごとに作り直す
+    REFIT_GROWTH_RATIO = 0.2
+    REFIT_MIN_DOCUMENTS = 100
+
+    def __init__(self, np, ids, token_lists, max_features=RELATED_MAX_FEATURES):
+        self.np = np
+        self.vocabulary, self.idf = fit_vocabulary(token_lists, max_features)
+        self.fitted_count = len(token_lists)
+        self._changes = {}
+        self._set_vectors(list(ids), [vectorize(np, tokens, self.vocabulary, self.idf) for tokens in token_lists])
+
+    def _set_vectors(self, ids, vectors):
+        np = self.np
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self._row_of = {knowledge_id: row for row, knowledge_id in enumerate(ids)}
+        self._indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        self._indptr[1:] = np.cumsum([len(columns) for columns, _ in vectors])
+        self._indices = np.concatenate([columns for columns, _ in vectors]) if vectors else np.zeros(0, dtype=np.int32)
+        self._data = np.concatenate([weights for _, weights in vectors]) if vectors else np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        removed = sum(1 for knowledge_id in self._changes if knowledge_id in self._row_of)
+        added = sum(1 for vector in self._changes.values() if vector is not None)
+        return len(self.ids) - removed + added
+
+    def needs_refit(self):
+        """語彙・IDFの作成後に記事が増え、作り直しが必要か"""
+        if self.fitted_count < self.REFIT_MIN_DOCUMENTS:
+            return bool(self._changes)
+        return len(self) > self.fitted_count * (1 + self.REFIT_GROWTH_RATIO)
+
+    def __contains__(self, knowledge_id):
+        if knowledge_id in self._changes:
+            return self._changes[knowledge_id] is not None
+        return knowledge_id in self._row_of
+
+    def vector(self, knowledge_id):
+        """記事のベクトル（列番号と重みの配列、ない場合は None）"""
+        if knowledge_id in self._changes:
+            return self._changes[knowledge_id]
+        row = self._row_of.get(knowledge_id)
+        if row is None:
+            return None
+        start, end = self._indptr[row], self._indptr[row + 1]
+        return self._indices[start:end], self._data[start:end]
+
+    def set_document(self, knowledge_id, tokens):
+        """記事のベクトルを作り直す（追加・更新）"""
+        self._changes[knowledge_id] = vectorize(self.np, tokens, self.vocabulary, self.idf)
+        self._compact_if_needed()
+
+    def remove_document(self, knowledge_id):
+        """削除・非公開化された記事を除く"""
+        if knowledge_id in self:
+            self._changes[knowledge_id] = None
+            self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        if len(self._changes) < max(self.COMPACT_MIN_CHANGES, len(self.ids) * self.COMPACT_RATIO):
+            return
+        ids = [knowledge_id for knowledge_id in self.ids.tolist() if knowledge_id not in self._changes]
+        ids += [knowledge_id for knowledge_id, vector in self._changes.items() if vector is not None]
+        ids.sort()
+        vectors = [self.vector(knowledge_id) for knowledge_id in ids]
+        self._changes = {}
+        self._set_vectors(ids, vectors)
+
+    def similarities(self, vector):
+        """ベクトルと全記事のコサイン類似度
+
+        Returns:
+            tuple: (記事IDの配列, 類似度の配列) 削除・非公開化された記事は含まない
+        """
+        np = self.np
+        columns, weights = vector
+        query = np.zeros(len(self.vocabulary), dtype=np.float32)
+        query[columns] = weights
+
+        # 行ごとの内積（非ゼロ要素の積の累積和の差）
+        cumulative = np.concatenate(([0.0], np.cumsum(self._data * query[self._indices], dtype=np.float64)))
+        scores = cumulative[self._indptr[1:]] - cumulative[self._indptr[:-1]]
+        ids = self.ids
+
+        if self._changes:
+            keep = np.ones(len(ids), dtype=bool)
+            extra_ids, extra_scores = [], []
+            for knowledge_id, changed in self._changes.items():
+                row = self._row_of.get(knowledge_id)
+                if row is not None:
+                    keep[row] = False
+                if changed is not None:
+                    extra_ids.append(knowledge_id)
+                    extra_scores.append(float(np.dot(query[changed[0]], changed[1])))
+            ids = np.concatenate((ids[keep], np.asarray(extra_ids, dtype=np.int64)))
+            scores = np.concatenate((scores[keep], np.asarray(extra_scores, dtype=np.float64)))
+        return ids, scores
+
+    def top_k(self, knowledge_id, k):
+        """記事の類似度上位k件 [(related_id, score)]（スコアの高い順、類似度0以下は除外）"""
+        np = self.np
+        vector = self.vector(knowledge_id)
+        if vector is None or k <= 0:
+            return []
+        ids, scores = self.similarities(vector)
+        scores[ids == knowledge_id] = -1.0  # 自分自身を除外
+        k = min(k, len(ids))
+        if k == 0:
+            return []
+        candidates = np.argpartition(-scores, k - 1)[:k] if k < len(ids) else np.arange(len(ids))
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(int(ids[index]), float(scores[index])) for index in candidates if scores[index] > 0]
+
+    def dense_rows(self, start, end):
+        """start〜end-1 行目の密なTF-IDF行列（行は self.ids の順、変更分は含まない。全件計算のバッチ用）"""
+        np = self.np
+        first, last = self._indptr[start], self._indptr[end]
+        matrix = np.zeros((end - start, len(self.vocabulary)), dtype=np.float32)
+        rows = np.repeat(np.arange(end - start), np.diff(self._indptr[start:end + 1]))
+        matrix[rows, self._indices[first:last]] = self._data[first:last]
+        return matrix
+
+_model = None
+
+
+def _get_model(np):
+    """差分更新用のモデルを取得（未作成の場合は公開記事から作成）"""
+    global _model
+    if _model is None:
+        ids, token_lists = _load_documents()
+        _model = RelatedModel(np, ids, token_lists)
+    return _model
+
+
+def top_k_neighbours(model, k, batch_size=RELATED_BATCH_SIZE, chunk_size=RELATED_CHUNK_SIZE):
+    """全記事のコサイン類似度上位k件を求める（全件計算用、変更分のないモデル）
+
+    全記事の密行列は作らず、batch_size 行ずつの密行列と chunk_size 行ずつ密にした行列の積から
+    上位k件を絞り込む（メモリ使用量は (batch_size + chunk_size) × 語彙数 程度）。
+
+    Returns:
+        dict: {knowledge_id: [(related_id, score)]} スコアの高い順（類似度0以下は除外）
+    """
+    np = model.np
+    ids = model.ids
+    count = len(ids)
+    k = min(k, count - 1)
+    if k <= 0:
+        return {knowledge_id: [] for knowledge_id in ids.tolist()}
+
+    neighbours = {}
+    for start in range(0, count, batch_size):
+        end = min(start + batch_size, count)
+        batch = model.dense_rows(start, end)
+        best_rows = np.zeros((end - start, 0), dtype=np.int64)
+        best_scores = np.zeros((end - start, 0), dtype=np.float32)
+
+        for chunk_start in range(0, count, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, count)
+            similarities = batch @ model.dense_rows(chunk_start, chunk_end).T
+            own = np.arange(max(start, chunk_start), min(end, chunk_end))
+            similarities[own - start, own - chunk_start] = -1.0  # 自分自身を除外
+
+            rows = np.concatenate((best_rows, np.broadcast_to(
+                np.arange(chunk_start, chunk_end), similarities.shape
+            )), axis=1)
+            scores = np.concatenate((best_scores, similarities), axis=1)
+            keep = min(k, scores.shape[1])
+            candidates = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+            best_rows = np.take_along_axis(rows, candidates, axis=1)
+            best_scores = np.take_along_axis(scores, candidates, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        for index in range(end - start):
+            neighbours[int(ids[start + index])] = [
+                (int(ids[row]), float(score))
+                for row, score in zip(best_rows[index], best_scores[index]) if score > 0
+            ]
+    return neighbours
+
+
+def _save_neighbours(neighbours):
+    """関連記事一覧を保存（対象記事の既存行は置き換え）
+
+    Args:
+        neighbours: {knowledge_id: [(related_id, score)]}
+    """
+    from .models import db, RelatedKnowledge
+
+    knowledge_ids = list(neighbours)
+    for start in range(0, len(knowledge_ids), 500):
+        RelatedKnowledge.query.filter(
+            RelatedKnowledge.knowledge_id.in_(knowledge_ids[start:start + 500])
+        ).delete(synchronize_session=False)
+
+    db.session.bulk_insert_mappings(RelatedKnowledge, [
+        {'knowledge_id': knowledge_id, 'rank': rank, 'related_id': related_id, 'score': score}
+        for knowledge_id, items in neighbours.items()
+        for rank, (related_id, score) in enumerate(items)
+    ])
+
+
+def rebuild_related_articles(k=None):
+    """全公開記事の関連記事を再計算（差分更新用のモデルも作り直す）
+
+    Returns:
+        int: 計算した記事数
+    """
+    global _model
+    from .models import db, RelatedKnowledge
+    from .config import RELATED_ARTICLES_COUNT
+
+    np = _load_numpy()
+    if np is None:
+        return 0
+
+    k = k or RELATED_ARTICLES_COUNT
+    ids, token_lists = _load_documents()
+    model = RelatedModel(np, ids, token_lists)
+    RelatedKnowledge.query.delete(synchronize_session=False)
+    if ids:
+        _save_neighbours(top_k_neighbours(model, k))
+    db.session.commit()
+    _model = model
+    return len(ids)
+
+
+def update_related_articles(knowledge_ids, k=None):
+    """変更された記事に関係する関連記事のみ再計算
+
+    変更された記事のみを読み込んでベクトル化し、保持済みのベクトルとの類似度から、
+    変更された記事自身・変更された記事を一覧に含む記事・変更された記事との類似度が
+    現在の下限を上回る（または一覧がk件未満の）記事を再計算する。
+
+    Returns:
+        int: 再計算した記事数
+    """
+    from sqlalchemy import func
+    from .models import db, Knowledge, RelatedKnowledge
+    from .config import RELATED_ARTICLES_COUNT
+
+    np = _load_numpy()
+    if np is None:
+        return 0
+
+    k = k or RELATED_ARTICLES_COUNT
+    knowledge_ids = set(knowledge_ids)
+    model = _get_model(np)
+
+    # 変更された記事のみ読み込んでベクトルを更新
+    published = {
+        row.id: row for row in db.session.query(Knowledge.id, Knowledge.title, Knowledge.content).filter(
+            Knowledge.id.in_(knowledge_ids), Knowledge.is_draft == False
+        )
+    }
+    removed_ids = knowledge_ids - set(published)
+    for knowledge_id in removed_ids:
+        model.remove_document(knowledge_id)
+    for row in published.values():
+        model.set_document(row.id, extract_terms(((row.title or '') + ' ') * TITLE_REPEAT + (row.content or '')))
+    if model.needs_refit():
+        return rebuild_related_articles(k)
+
+    # 非公開になった・削除された記事の一覧を削除
+    if removed_ids:
+        RelatedKnowledge.query.filter(
+            RelatedKnowledge.knowledge_id.in_(removed_ids)
+        ).delete(synchronize_session=False)
+
+    # 変更された記事を一覧に含む記事
+    affected = set(published)
+    affected.update(row.knowledge_id for row in RelatedKnowledge.query.with_entities(
+        RelatedKnowledge.knowledge_id
+    ).filter(RelatedKnowledge.related_id.in_(knowledge_ids)))
+
+    # 変更された記事との類似度が、現在の一覧の下限を上回る（または一覧がk件未満の）記事
+    best = {}
+    for knowledge_id in published:
+        ids, scores = model.similarities(model.vector(knowledge_id))
+        positive = scores > 0
+        for other_id, score in zip(ids[positive].tolist(), scores[positive].tolist()):
+            if other_id != knowledge_id and score > best.get(other_id, 0.0):
+                best[other_id] = score
+    candidate_ids = [knowledge_id for knowledge_id in best if knowledge_id not in affected]
+    current = {}
+    for start in range(0, len(candidate_ids), 500):
+        for row in db.session.query(
+            RelatedKnowledge.knowledge_id, func.count().label('size'), func.min(RelatedKnowledge.score).label('min_score')
+        ).filter(
+            RelatedKnowledge.knowledge_id.in_(candidate_ids[start:start + 500])
+        ).group_by(RelatedKnowledge.knowledge_id):
+            current[row.knowledge_id] = (row.size, row.min_score)
+    for knowledge_id in candidate_ids:
+        size, min_score = current.get(knowledge_id, (0, 0.0))
+        if size < k or best[knowledge_id] > min_score:
+            affected.add(knowledge_id)
+
+    affected = {knowledge_id for knowledge_id in affected if knowledge_id in model}
+    if affected:
+        _save_neighbours({knowledge_id: model.top_k(knowledge_id, k) for knowledge_id in sorted(affected)})
+    db.session.commit()
+    return len(affected)
+
+
+def get_related_articles(knowledge_id):
+    """保存済みの関連記事一覧を取得（公開記事のみ）
+
+    Returns:
+        list: [(Knowledge, score)] 類似度の高い順
+    """
+    from .models import Knowledge, RelatedKnowledge
+
+    entries = RelatedKnowledge.query.join(
+        Knowledge, Knowledge.id == RelatedKnowledge.related_id
+    ).filter(
+        RelatedKnowledge.knowledge_id == knowledge_id,
+        Knowledge.is_draft == False
+    ).order_by(RelatedKnowledge.rank).all()
+    return [(entry.related, entry.score) for entry in entries]
+
+
+def init_related_articles(app):
+    """関連記事の更新ワーカーを初期化（未計算の場合はバックグラウンドで全件計算）"""
+    global _app
+    from .models import Knowledge, RelatedKnowledge
+    from .utils import audit_logger
+
+    _app = app
+    try:
+        with app.app_context():
+            needs_rebuild = RelatedKnowledge.query.first() is None and \
+                Knowledge.query.filter(Knowledge.is_draft == False).first() is not None
+    except Exception as e:
+        audit_logger.error(f"Failed to check related articles: {e}")
+        return
+
+    if needs_rebuild:
+        _executor.submit(_run_rebuild)
+
+
+def schedule_related_update(knowledge_ids):
+    """関連記事の差分更新をワーカーに投入（実行待ちの記事はまとめて処理）"""
+    if _app is None or not knowledge_ids:
+        return
+    with _pending_lock:
+        _pending_ids.update(knowledge_ids)
+    _executor.submit(_run_update)
+
+
+def _run_update():
+    from .models import db
+    from .utils import audit_logger
+
+    with _pending_lock:
+        knowledge_ids = set(_pending_ids)
+        _pending_ids.clear()
+    if not knowledge_ids:
+        return
+
+    with _app.app_context():
+        try:
+            updated = update_related_articles(knowledge_ids)
+            audit_logger.info(f"Related articles updated - Knowledge IDs:{sorted(knowledge_ids)}, Recomputed:{updated}")
+        except Exception as e:
+            db.session.rollback()
+            audit_logger.error(f"Related articles update failed: {e}")
+        finally:
+            db.session.remove()
+
+
+def _run_rebuild():
+    from .models import db
+    from .utils import audit_logger
+
+    with _app.app_context():
+        try:
+            count = rebuild_related_articles()
+            audit_logger.info(f"Related articles rebuilt for {count} articles")
+        except Exception as e:
+            db.session.rollback()
+            audit_logger.error(f"Related articles rebuild failed: {e}")
+        finally:
+            db.session.remove()
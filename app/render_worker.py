@@ -0,0 +1,35 @@
+"""
+Markdown変換ワーカープロセス（rendering.RenderWorkerPool が python -m app.render_worker で起動）
+
+起動後に ('ready', None) を送り、標準入力から pickle された本文を1件ずつ受け取って変換結果 ('ok', html) または
+('error', メッセージ) を標準出力に pickle して返す。標準入力が閉じられると終了する。
+"""
+
+import pickle
+import sys
+
+
+def main():
+    # 変換結果の送信には元の標準出力を使い、print などの出力は標準エラーに回す
+    requests, responses = sys.stdin.buffer, sys.stdout.buffer
+    sys.stdout = sys.stderr
+
+    from app.rendering import convert_markdown
+    pickle.dump(('ready', None), responses)
+    responses.flush()
+
+    while True:
+        try:
+            text = pickle.load(requests)
+        except EOFError:
+            break
+        try:
+            response = ('ok', convert_markdown(text))
+        except Exception as e:
+            response = ('error', f'{type(e).__name__}: {e}')
+        pickle.dump(response, responses)
+        responses.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,547 @@
+"""
+Markdownの描画とHTMLキャッシュ
+
+本文のハッシュと拡張機能の設定から作ったキーで描画結果をキャッシュする。
+プロセス内のLRUキャッシュを先に参照し、記事・コメントの描画結果は
+rendered_html / rendered_key カラムにも保存して再起動後も再利用する。
+本文が編集されると保存済みのHTMLは破棄される（イベントリスナーで制御）。
+
+コードブロックのハイライト（Pygments）は (言語, コードのハッシュ) ごとにキャッシュし、
+本文の一部だけが変わった記事の再描画では変更のないコードブロックを再利用する。
+
+長い本文の変換はワーカープロセス（RenderWorkerPool）で実行し、
+時間内に終わらない場合はエスケープしたプレーンテキストを表示する。
+時間切れの場合はその文書を変換中のワーカーだけを停止し、他の文書の変換には影響しない。
+"""
+
+import hashlib
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from markdown.extensions import codehilite, fenced_code
+
+# Markdownの拡張機能と設定（変更するとキャッシュキーが変わり、全件が再描画される）
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables', 'codehilite', 'nl2br']
+MARKDOWN_EXTENSION_CONFIGS = {}
+
+
+class LRUCache:
+    """スレッドセーフなLRUキャッシュ（ヒット・ミス数を記録）"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """キャッシュの統計情報"""
+        requests = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / requests, 4) if requests else None
+        }
+
+
+# 起動時にLexerを解決しておく言語
+PRELOADED_LEXERS = (
+    'python', 'javascript', 'typescript', 'java', 'go', 'c', 'cpp', 'csharp', 'ruby', 'php',
+    'bash', 'powershell', 'sql', 'json', 'yaml', 'xml', 'html', 'css', 'ini', 'diff', 'text'
+)
+
+# Lexerの生成に影響するオプション（それ以外のCodeHiliteのオプションはFormatter用）
+_LEXER_OPTION_NAMES = ('stripnl', 'stripall', 'ensurenl', 'tabsize', 'encoding', 'inencoding')
+
+_lexers = {}
+_lexers_lock = threading.Lock()
+
+
+def get_lexer(lang, options=None):
+    """言語名からLexerを取得（解決済みのインスタンスを再利用、未対応の言語は None）"""
+    from pygments.lexers import get_lexer_by_name
+
+    lexer_options = {name: value for name, value in (options or {}).items() if name in _LEXER_OPTION_NAMES}
+    key = (lang.lower(), tuple(sorted(lexer_options.items())))
+    try:
+        return _lexers[key]
+    except KeyError:
+        pass
+
+    try:
+        lexer = get_lexer_by_name(lang, **lexer_options)
+    except ValueError:
+        lexer = None
+    with _lexers_lock:
+        _lexers[key] = lexer
+    return lexer
+
+
+def preload_lexers():
+    """よく使う言語のLexerを事前に解決"""
+    if not codehilite.pygments:
+        return
+    for lang in PRELOADED_LEXERS:
+        get_lexer(lang)
+
+
+class CachedCodeHilite(codehilite.CodeHilite):
+    """ハイライト結果をキャッシュする CodeHilite
+
+    キャッシュキーは (言語, 出力オプション, コードのハッシュ)。
+    Lexerは get_lexer() で解決済みのものを使い、言語の推定はキャッシュミス時のみ行う。
+    """
+
+    def hilite(self, shebang=True):
+        if not (codehilite.pygments and self.use_pygments):
+            return super().hilite(shebang)
+
+        self.src = self.src.strip('\n')
+        if self.lang is None and shebang:
+            self._parseHeader()
+
+        key = (
+            self.lang, self.guess_lang, self.lang_prefix, repr(self.pygments_formatter),
+            repr(sorted(self.options.items())),
+            hashlib.sha256(self.src.encode('utf-8')).hexdigest()
+        )
+        html = code_cache.get(key)
+        if html is None:
+            html = self._highlight()
+            code_cache.put(key, html)
+        return html
+
+    def _highlight(self):
+        """Pygmentsでハイライト（CodeHilite.hilite と同じ規則で Lexer・Formatter を選ぶ）"""
+        from pygments import highlight
+        from pygments.formatters import get_formatter_by_name
+        from pygments.lexers import guess_lexer
+        from pygments.util import ClassNotFound
+
+        lexer = get_lexer(self.lang, self.options) if self.lang else None
+        if lexer is None:
+            try:
+                lexer = guess_lexer(self.src, **self.options) if self.guess_lang else get_lexer('text')
+            except ValueError:
+                lexer = get_lexer('text')
+        if not self.lang:
+            # 推定した言語名を使用
+            self.lang = lexer.aliases[0]
+
+        lang_str = f'{self.lang_prefix}{self.lang}'
+        if isinstance(self.pygments_formatter, str):
+            try:
+                formatter = get_formatter_by_name(self.pygments_formatter, **self.options)
+            except ClassNotFound:
+                formatter = get_formatter_by_name('html', **self.options)
+        else:
+            formatter = self.pygments_formatter(lang_str=lang_str, **self.options)
+        return highlight(self.src, lexer, formatter)
+
+
+def _install_code_highlight_cache():
+    """fenced_code・codehilite 拡張が CachedCodeHilite を使うように差し替え"""
+    fenced_code.CodeHilite = CachedCodeHilite
+    codehilite.CodeHilite = CachedCodeHilite
+
+
+def _build_config_key():
+    """拡張機能の構成を表すキー（Markdownのバージョンを含む）"""
+    import markdown
+    config = repr((markdown.__version__, MARKDOWN_EXTENSIONS, sorted(MARKDOWN_EXTENSION_CONFIGS.items())))
+    return hashlib.sha256(config.encode('utf-8')).hexdigest()[:16]
+
+
+def _create_caches():
+    from .config import RENDER_CACHE_SIZE, CODE_HIGHLIGHT_CACHE_SIZE
+    return LRUCache(RENDER_CACHE_SIZE), LRUCache(CODE_HIGHLIGHT_CACHE_SIZE)
+
+
+CONFIG_KEY = _build_config_key()
+html_cache, code_cache = _create_caches()
+_install_code_highlight_cache()
+preload_lexers()
+
+
+def get_render_cache_stats():
+    """描画キャッシュの統計情報（HTML全体・コードブロック）"""
+    return {
+        'html': html_cache.stats(),
+        'code_blocks': code_cache.stats(),
+        'lexers': len(_lexers)
+    }
+
+
+def get_cache_key(text):
+    """本文と拡張機能の構成からキャッシュキーを作成"""
+    digest = hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+    return f'{CONFIG_KEY}:{digest}'
+
+
+def convert_markdown(text):
+    """MarkdownをHTMLに変換（キャッシュなし）"""
+    import markdown
+    return markdown.markdown(text or '', extensions=MARKDOWN_EXTENSIONS,
+                             extension_configs=MARKDOWN_EXTENSION_CONFIGS)
+
+
+def fallback_html(text):
+    """変換できなかった本文の代替表示（エスケープしたプレーンテキスト）"""
+    from markupsafe import escape
+    return f'<pre class="render-fallback">{escape(text or "")}</pre>'
+
+
+# 時間切れになった本文に、再変換せず代替表示を返す時間（秒）
+RENDER_FALLBACK_TTL_SECONDS = 60
+
+# ワーカープロセスの起動を待つ時間（秒）
+RENDER_WORKER_START_TIMEOUT_SECONDS = 30
+
+# ワーカープロセスの起動ディレクトリ（app パッケージの親ディレクトリ）
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _RenderWorker:
+    """1件ずつ本文を変換するワーカープロセス
+
+    fork せずに新しいインタプリタで起動する（親プロセスのデータベース接続・スレッドを引き継がず、
+    spawn のように起動スクリプトの app.py が再実行されることもない）。
+    """
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'app.render_worker'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=_PACKAGE_ROOT
+        )
+        # パイプの読み込みは時間制限を付けられないため、受信用のスレッドからキューに渡す
+        self._responses = queue.Queue()
+        threading.Thread(target=self._receive, name='render-worker-reader', daemon=True).start()
+
+        # 起動（モジュールの読み込み）にかかった時間は文書の変換時間に含めない
+        try:
+            status, value = self._responses.get(timeout=RENDER_WORKER_START_TIMEOUT_SECONDS)
+        except queue.Empty:
+            status, value = 'exit', 'render worker did not start in time'
+        if status != 'ready':
+            self.stop()
+            raise RuntimeError(value)
+
+    def _receive(self):
+        try:
+            while True:
+                self._responses.put(pickle.load(self.process.stdout))
+        except Exception:
+            self._responses.put(('exit', f'render worker exited (code {self.process.poll()})'))
+
+    def render(self, text, timeout):
+        """本文を変換して ('ok', html) / ('error', メッセージ) を返す
+
+        Raises:
+            TimeoutError: 本文を渡してから timeout 秒以内に結果が返らない場合
+            RuntimeError: ワーカープロセスが終了していた場合
+        """
+        try:
+            pickle.dump(text, self.process.stdin)
+            self.process.stdin.flush()
+        except OSError as e:
+            raise RuntimeError(f'render worker is not running: {e}') from e
+        try:
+            status, value = self._responses.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f'rendering timed out after {timeout}s') from None
+        if status == 'exit':
+            raise RuntimeError(value)
+        return status, value
+
+    def stop(self):
+        """ワーカープロセスを停止"""
+        try:
+            self.process.kill()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class RenderWorkerPool:
+    """Markdown変換のワーカープロセス群（最大 max_workers 件を同時に変換）
+
+    変換時間は空きワーカーに本文を渡した時点から数える（空きを待つ時間は含めない）。
+    時間切れ・異常終了したワーカーはそのワーカーだけを停止し、次の変換時に新しいワーカーを起動する。
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max(1, max_workers)
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def render(self, text, timeout):
+        """本文をワーカープロセスで変換
+
+        Raises:
+            TimeoutError: 変換が timeout 秒以内に終わらない場合
+            RuntimeError: 変換中のエラー・ワーカープロセスの異常終了
+        """
+        with self._slots:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError('render pool is shut down')
+                worker = self._idle.pop() if self._idle else None
+            if worker is None:
+                worker = _RenderWorker()
+            try:
+                status, value = worker.render(text, timeout)
+            except BaseException:
+                worker.stop()
+                raise
+            with self._lock:
+                if self._closed:
+                    worker.stop()
+                else:
+                    self._idle.append(worker)
+        if status == 'error':
+            raise RuntimeError(value)
+        return value
+
+    def shutdown(self):
+        """待機中のワーカープロセスを停止（変換中のワーカーは変換後に停止）"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool(max_workers=None):
+    """Markdown変換用のワーカープロセス群を取得（初回呼び出し時に作成、プロセスは変換時に起動）"""
+    global _pool
+    import atexit
+    from .config import RENDER_POOL_WORKERS
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderWorkerPool(max_workers or RENDER_POOL_WORKERS)
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+_timed_out = {}  # {キャッシュキー: 代替表示を返す期限（time.monotonic()）}
+_timed_out_lock = threading.Lock()
+
+
+def _recently_timed_out(key):
+    """直近に時間切れになった本文かどうか（RENDER_FALLBACK_TTL_SECONDS 秒間）"""
+    with _timed_out_lock:
+        expires = _timed_out.get(key)
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            del _timed_out[key]
+            return False
+        return True
+
+
+def _mark_timed_out(key):
+    now = time.monotonic()
+    with _timed_out_lock:
+        for expired in [k for k, expires in _timed_out.items() if expires <= now]:
+            del _timed_out[expired]
+        _timed_out[key] = now + RENDER_FALLBACK_TTL_SECONDS
+
+
+def convert_markdown_with_timeout(text, key=None):
+    """MarkdownをHTMLに変換（長い本文はワーカープロセスで時間制限付きで変換）
+
+    時間切れになった本文は key を指定した場合に記録し、RENDER_FALLBACK_TTL_SECONDS 秒間は再変換しない。
+
+    Returns:
+        tuple: (html, 変換できたかどうか) 時間切れ・エラーの場合は代替表示を返す
+    """
+    from .config import RENDER_POOL_MIN_LENGTH, RENDER_TIMEOUT_SECONDS
+    from .utils import audit_logger
+
+    if len(text or '') < RENDER_POOL_MIN_LENGTH:
+        return convert_markdown(text), True
+
+    try:
+        return get_render_pool().render(text, RENDER_TIMEOUT_SECONDS), True
+    except TimeoutError:
+        audit_logger.warning(f"Markdown rendering timed out after {RENDER_TIMEOUT_SECONDS}s ({len(text)} chars)")
+        if key is not None:
+            _mark_timed_out(key)
+    except Exception as e:
+        audit_logger.error(f"Markdown rendering failed ({len(text)} chars): {e}")
+    return fallback_html(text), False
+
+
+def _render(text, key):
+    """LRUキャッシュを参照して変換
+
+    代替表示はキャッシュしない（時間切れの本文のみ、しばらくの間は再変換せず代替表示を返す）。
+    """
+    html = html_cache.get(key)
+    if html is not None:
+        return html, True
+    if _recently_timed_out(key):
+        return fallback_html(text), False
+    html, rendered = convert_markdown_with_timeout(text, key)
+    if rendered:
+        html_cache.put(key, html)
+    return html, rendered
+
+
+def render_markdown(text, key=None):
+    """MarkdownをHTMLに変換（LRUキャッシュを使用）"""
+    html, _ = _render(text, key or get_cache_key(text))
+    return html
+
+
+def render_document(document):
+    """記事・コメントの本文をHTMLに変換
+
+    保存済みのHTMLが現在の本文と構成のものであれば再利用し、
+    新たに描画した場合は rendered_html / rendered_key に保存する（代替表示は保存しない）。
+    コミットは呼び出し元で行う（保存があった場合は session.info['rendered_html_pending'] が立つ）。
+    """
+    from sqlalchemy.orm.attributes import set_committed_value
+    from .models import db
+
+    key = get_cache_key(document.content)
+    if document.rendered_key == key and document.rendered_html is not None:
+        html_cache.put(key, document.rendered_html)
+        return document.rendered_html
+
+    html, rendered = _render(document.content, key)
+    if not rendered:
+        return html
+
+    # ORMのイベント（監査ログ・検索インデックス更新）を起こさないようテーブルを直接更新
+    table = type(document).__table__
+    db.session.execute(_rendered_update(table), {'doc_id': document.id, 'html': html, 'key': key})
+    set_committed_value(document, 'rendered_html', html)
+    set_committed_value(document, 'rendered_key', key)
+    db.session.info['rendered_html_pending'] = True
+    return html
+
+
+def _rendered_update(table):
+    """描画結果を保存するUPDATE文（パラメータ: doc_id, html, key）"""
+    from sqlalchemy import bindparam
+
+    values = {'rendered_html': bindparam('html'), 'rendered_key': bindparam('key')}
+    if 'updated_at' in table.c:
+        values['updated_at'] = table.c.updated_at  # 描画結果の保存では更新日時を変えない
+    return table.update().where(table.c.id == bindparam('doc_id')).values(**values)
+
+
+def rerender_all(force=False, batch_size=200):
+    """全記事・全コメントをワーカープロセスで並列に再描画して保存
+
+    時間切れ・エラーの文書は失敗として数え、他の文書の再描画は続ける。
+
+    Args:
+        force: True の場合は保存済みのHTMLが最新でも再描画する
+    Returns:
+        dict: {'rendered': 件数, 'skipped': 最新のため省略, 'failed': 時間切れ・エラー}
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from .config import RENDER_TIMEOUT_SECONDS
+    from .models import db, Knowledge, Comment
+    from .utils import audit_logger
+
+    pool = get_render_pool()
+
+    def render_in_worker(content):
+        try:
+            return pool.render(content, RENDER_TIMEOUT_SECONDS)
+        except Exception as e:
+            audit_logger.error(f"Markdown rerendering failed ({len(content or '')} chars): {e}")
+            return None
+
+    result = {'rendered': 0, 'skipped': 0, 'failed': 0}
+    with ThreadPoolExecutor(max_workers=pool.max_workers) as executor:
+        for model in (Knowledge, Comment):
+            table = model.__table__
+            last_id = 0
+            while True:
+                rows = db.session.execute(
+                    db.select(table.c.id, table.c.content, table.c.rendered_key)
+                    .where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+
+                documents = []
+                for row in rows:
+                    key = get_cache_key(row.content)
+                    if not force and row.rendered_key == key:
+                        result['skipped'] += 1
+                    else:
+                        documents.append((row.id, key, row.content))
+
+                updates = []
+                htmls = executor.map(render_in_worker, [content for _, _, content in documents])
+                for (doc_id, key, _), html in zip(documents, htmls):
+                    if html is None:
+                        result['failed'] += 1
+                    else:
+                        updates.append({'doc_id': doc_id, 'html': html, 'key': key})
+
+                if updates:
+                    db.session.execute(_rendered_update(table), updates)
+                    db.session.commit()
+                    result['rendered'] += len(updates)
+    return result
+
+
+def invalidate_rendered_html(document):
+    """本文の変更時に保存済みのHTMLを破棄（before_update から呼び出す）"""
+    document.rendered_html = None
+    document.rendered_key = None
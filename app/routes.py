@@ -3,8 +3,12 @@ import uuid
 from flask import render_template, request, redirect, url_for, flash, abort, send_from_directory, jsonify
 from werkzeug.utils import secure_filename
 from datetime import datetime, timezone
-from .models import db, Knowledge, Comment, Like, CommentLike, Attachment, Tag, ViewHistory
-from .utils import get_current_user_id, handle_file_uploads, handle_tags, audit_logger, get_bulk_engagement_stats
+from .models import db, Knowledge, Comment, Like, CommentLike, Attachment, Tag
+from .utils import get_current_user_id, handle_file_uploads, handle_tags, audit_logger, get_listing_engagement, get_bulk_comment_engagement, get_facet_counts, get_tag_cloud, listing_query_options, apply_keyset_cursor, encode_cursor
+from .engagement import increment_view_count, increment_like_count, increment_comment_count, increment_comment_like_count
+from .popular_cache import get_cached_popular_rankings
+from .view_buffer import record_view
+from .search import get_search_filter, get_fuzzy_filter, fuzzy_search, get_did_you_mean, find_matching_attachments
 from .config import SYSTEM_TITLE, MAX_FILE_SIZE_MB, POPULAR_ARTICLES_COUNT, allowed_file
 
 def register_routes(app):
@@ -16,7 +20,9 @@ def register_routes(app):
         my_posts = request.args.get('my_posts', '').strip()
         liked_posts = request.args.get('liked_posts', '').strip()
         tag_filter = request.args.get('tag', '').strip()
+        fuzzy = request.args.get('fuzzy', '').strip()
         page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor', '').strip()  # 前のページの最後の記事を指すカーソル（「次」のリンク）
         per_page = 10  # 1ページあたりの件数
         current_user_id = get_current_user_id()
         
@@ -43,43 +49,79 @@ def register_routes(app):
             query = query.filter(Knowledge.tags.any(Tag.name == tag_filter))
         
         # 検索フィルター
+        filtered_query = query
+        near_matches = []
         if search_query:
-            # タイトル、内容、またはコメントで検索
-            query = query.filter(
-                db.or_(
-                    Knowledge.title.contains(search_query),
-                    Knowledge.content.contains(search_query),
-                    Knowledge.comments.any(Comment.content.contains(search_query))
-                )
-            )
-        
-        pagination = query.order_by(Knowledge.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
-        
-        knowledge_list = pagination.items
+            if fuzzy == '1':
+                # あいまい検索（類似タイトル・類似タグの記事も含める）
+                near_matches = fuzzy_search(search_query, limit=20)
+                query = query.filter(get_fuzzy_filter(search_query, near_matches))
+            else:
+                # タイトル、内容、またはコメントで検索（全文検索インデックスを使用）
+                query = query.filter(get_search_filter(search_query))
         
-        # 一括でエンゲージメント統計を取得（N+1問題回避）
-        engagement_stats = get_bulk_engagement_stats(knowledge_list)
+        fuzzy_applied = fuzzy == '1'
+        if cursor:
+            # カーソル指定時はカーソルの位置から索引で読み始め、総件数（COUNT）とページ番号は求めない
+            try:
+                knowledge_list = apply_keyset_cursor(
+                    query.options(*listing_query_options()), Knowledge.created_at, cursor
+                ).limit(per_page + 1).all()
+            except ValueError:
+                abort(400)
+            has_next = len(knowledge_list) > per_page
+            knowledge_list = knowledge_list[:per_page]
+            pagination = None
+        else:
+            pagination = apply_keyset_cursor(query.options(*listing_query_options()), Knowledge.created_at).paginate(
+                page=page, per_page=per_page, error_out=False
+            )
+            
+            # 完全一致の結果がない場合は、同じリクエスト内であいまい検索の結果を返す
+            if search_query and not fuzzy_applied and pagination.total == 0:
+                near_matches = fuzzy_search(search_query, limit=20)
+                if near_matches:
+                    fuzzy_applied = True
+                    query = filtered_query.filter(get_fuzzy_filter(search_query, near_matches))
+                    pagination = apply_keyset_cursor(query.options(*listing_query_options()), Knowledge.created_at).paginate(
+                        page=page, per_page=per_page, error_out=False
+                    )
+            knowledge_list = pagination.items
+            has_next = pagination.has_next
+        did_you_mean = get_did_you_mean(search_query, near_matches) if search_query else []
+        
+        # 次のページはページ番号によらずカーソルで取得（OFFSETで読み飛ばさない）
+        next_cursor = encode_cursor(knowledge_list[-1].created_at, knowledge_list[-1].id) if has_next and knowledge_list else None
+        
+        # 閲覧・いいね・コメント数、添付ファイル数、タグを1回のクエリで取得（N+1問題回避）
+        engagement_stats = get_listing_engagement([k.id for k in knowledge_list])
+        
+        # 検索語に一致した添付ファイル（記事カードに表示）
+        matched_attachments = {}
+        if search_query:
+            matched_attachments = find_matching_attachments([k.id for k in knowledge_list], search_query)
         
-        # タグ一覧を取得（公開記事で使用されているタグのみ、使用回数順）
-        all_tags = Tag.query.join(
-            Tag.knowledge_items
-        ).filter(
-            Knowledge.is_draft == False,
-            Tag.usage_count > 0
-        ).distinct().order_by(Tag.usage_count.desc()).all()
+        # 検索・絞り込み時は結果内のタグ別・作成者別件数（1回の集計クエリ）、絞り込みなしは使用回数順のタグ一覧
+        if search_query or tag_filter or my_posts == '1' or liked_posts == '1':
+            facets = get_facet_counts(query)
+        else:
+            facets = get_tag_cloud()
         
         return render_template('index.html', 
                              knowledge_list=knowledge_list, 
                              engagement_stats=engagement_stats,
+                             matched_attachments=matched_attachments,
                              current_user_id=current_user_id, 
                              search_query=search_query,
+                             fuzzy=fuzzy,
+                             fuzzy_applied=fuzzy_applied,
+                             did_you_mean=did_you_mean,
                              my_posts=my_posts,
                              liked_posts=liked_posts,
                              tag_filter=tag_filter,
-                             all_tags=all_tags,
+                             facets=facets,
                              pagination=pagination,
+                             next_cursor=next_cursor,
                              system_title=SYSTEM_TITLE)
 
     @app.route('/create', methods=['GET', 'POST'])
@@ -125,42 +167,35 @@ def register_routes(app):
         attachments = Attachment.query.filter_by(knowledge_id=id).order_by(Attachment.created_at.asc()).all()
         current_user_id = get_current_user_id()
         
-        # 閲覧履歴を記録（作成者以外の場合のみ）
+        # 閲覧履歴を記録（作成者以外の場合のみ、同じ日の閲覧は1回。書き込みはバッファ経由でまとめて行う）
         if knowledge.author != current_user_id:
-            # 今日の日付を取得
-            today = datetime.now(timezone.utc).date()
-            
-            # 同じユーザーが同じ記事を今日既に閲覧しているかチェック
-            existing_view_today = ViewHistory.query.filter(
-                ViewHistory.user_id == current_user_id,
-                ViewHistory.knowledge_id == id,
-                db.func.date(ViewHistory.viewed_at) == today
-            ).first()
-            
-            # 今日初回の閲覧の場合のみ記録
-            if not existing_view_today:
-                # 閲覧履歴を記録
-                view_history = ViewHistory(
-                    user_id=current_user_id,
-                    knowledge_id=id
-                )
-                db.session.add(view_history)
-                db.session.commit()
-                audit_logger.info(f"View history recorded - Knowledge ID:{id}, User:{current_user_id}")
+            if record_view(current_user_id, id):
+                audit_logger.info(f"View history queued - Knowledge ID:{id}, User:{current_user_id}")
             else:
                 audit_logger.debug(f"Duplicate view today prevented - Knowledge ID:{id}, User:{current_user_id}")
         
         # 現在のユーザーがこのナレッジにいいねしているかチェック
         user_liked = Like.query.filter_by(user_id=current_user_id, knowledge_id=id).first() is not None
         
-        # 各コメントに対するユーザーのいいね状態をチェック
-        comment_likes = {}
-        for comment in comments:
-            comment_likes[comment.id] = CommentLike.query.filter_by(user_id=current_user_id, comment_id=comment.id).first() is not None
+        # 各コメントのいいね数とユーザーのいいね状態を一括取得
+        comment_engagement = get_bulk_comment_engagement(comments, current_user_id)
+        
+        # 本文・コメントのMarkdownを描画（保存済みのHTMLを再利用し、新たに描画した分は保存）
+        from .rendering import render_document
+        content_html = render_document(knowledge)
+        comment_html = {comment.id: render_document(comment) for comment in comments}
+        if db.session.info.pop('rendered_html_pending', False):
+            db.session.commit()
+        
+        # 事前計算済みの関連記事
+        from .related import get_related_articles
+        related_articles = get_related_articles(id)
         
         return render_template('view.html', knowledge=knowledge, comments=comments, attachments=attachments,
+                             content_html=content_html, comment_html=comment_html,
                              current_user_id=current_user_id, user_liked=user_liked, 
-                             comment_likes=comment_likes, system_title=SYSTEM_TITLE)
+                             comment_engagement=comment_engagement, related_articles=related_articles,
+                             system_title=SYSTEM_TITLE)
 
     @app.route('/edit/<int:id>', methods=['GET', 'POST'])
     def edit(id):
@@ -249,6 +284,7 @@ def register_routes(app):
         
         new_comment = Comment(content=content, author=author, knowledge_id=knowledge_id)
         db.session.add(new_comment)
+        increment_comment_count(knowledge_id)
         db.session.commit()
         
         flash('コメントが投稿されました！', 'success')
@@ -266,6 +302,7 @@ def register_routes(app):
         
         knowledge_id = comment.knowledge_id
         db.session.delete(comment)
+        increment_comment_count(knowledge_id, -1, day=comment.created_at)
         db.session.commit()
         flash('コメントが削除されました！', 'success')
         return redirect(url_for('view', id=knowledge_id))
@@ -287,12 +324,14 @@ def register_routes(app):
         if existing_like:
             # いいねを取り消し
             db.session.delete(existing_like)
+            increment_like_count(knowledge_id, -1, day=existing_like.created_at)
             db.session.commit()
             flash('いいねを取り消しました！', 'info')
         else:
             # いいねを追加
             new_like = Like(user_id=current_user_id, knowledge_id=knowledge_id)
             db.session.add(new_like)
+            increment_like_count(knowledge_id)
             db.session.commit()
             flash('いいねしました！', 'success')
         
@@ -315,12 +354,14 @@ def register_routes(app):
         if existing_like:
             # いいねを取り消し
             db.session.delete(existing_like)
+            increment_comment_like_count(comment_id, -1)
             db.session.commit()
             flash('コメントのいいねを取り消しました！', 'info')
         else:
             # いいねを追加
             new_like = CommentLike(user_id=current_user_id, comment_id=comment_id)
             db.session.add(new_like)
+            increment_comment_like_count(comment_id)
             db.session.commit()
             flash('コメントにいいねしました！', 'success')
         
@@ -377,14 +418,18 @@ def register_routes(app):
             Knowledge.author == current_user_id
         )
         
-        pagination = query.order_by(Knowledge.updated_at.desc()).paginate(
+        pagination = query.options(*listing_query_options()).order_by(Knowledge.updated_at.desc()).paginate(
             page=page, per_page=per_page, error_out=False
         )
         
         draft_list = pagination.items
         
+        # 添付ファイル数とタグを1回のクエリで取得
+        engagement_stats = get_listing_engagement([draft.id for draft in draft_list])
+        
         return render_template('drafts.html', 
                              draft_list=draft_list,
+                             engagement_stats=engagement_stats,
                              current_user_id=current_user_id,
                              pagination=pagination,
                              system_title=SYSTEM_TITLE)
@@ -394,41 +439,35 @@ def register_routes(app):
         """人気記事ページ - 直近一ヶ月のアクティビティでトップ3を表示"""
         current_user_id = get_current_user_id()
         
-        # 全記事を取得（下書きを除外）
-        all_knowledge = Knowledge.query.filter(Knowledge.is_draft == False).all()
-        
-        # 記事がない場合は空のリストを返す
-        if not all_knowledge:
-            return render_template('popular.html',
-                                 top_by_views=[],
-                                 top_by_likes=[],
-                                 top_by_comments=[],
-                                 current_user_id=current_user_id,
-                                 system_title=SYSTEM_TITLE)
-        
-        # 直近30日の統計を一括取得（効率的）
-        recent_stats = get_bulk_engagement_stats(all_knowledge, days=30)
-        
-        # 各記事に統計情報を付与
-        articles_with_stats = []
-        for knowledge in all_knowledge:
-            stats = recent_stats[knowledge.id]
-            articles_with_stats.append({
-                'knowledge': knowledge,
+        # 各指標の上位記事（キャッシュ済みの記事IDと件数）を取得し、上位に入った記事のみ読み込む（本文は読み込まない）
+        rankings = get_cached_popular_rankings(POPULAR_ARTICLES_COUNT, days=30)
+        winner_ids = {knowledge_id for ranking in rankings.values() for knowledge_id, _ in ranking}
+        articles = {knowledge.id: knowledge for knowledge in Knowledge.query.options(
+            *listing_query_options()
+        ).filter(Knowledge.id.in_(winner_ids), Knowledge.is_draft == False)}
+        listing_stats = get_listing_engagement(list(articles))
+        
+        # 各記事に統計情報を付与（キャッシュ後に削除・非公開化された記事は除く）
+        def with_counts(ranking):
+            return [{
+                'knowledge': articles[knowledge_id],
+                'tags': listing_stats[knowledge_id]['tags'],
                 'recent_views': stats['views'],
                 'recent_likes': stats['likes'],
-                'recent_comments': stats['comments']
-            })
+                'recent_comments': stats['comments'],
+                'trending_score': stats.get('score')
+            } for knowledge_id, stats in ranking if knowledge_id in articles]
         
-        # 各カテゴリでソートしてトップN件を取得
-        top_by_views_with_counts = sorted(articles_with_stats, key=lambda x: x['recent_views'], reverse=True)[:POPULAR_ARTICLES_COUNT]
-        top_by_likes_with_counts = sorted(articles_with_stats, key=lambda x: x['recent_likes'], reverse=True)[:POPULAR_ARTICLES_COUNT]
-        top_by_comments_with_counts = sorted(articles_with_stats, key=lambda x: x['recent_comments'], reverse=True)[:POPULAR_ARTICLES_COUNT]
+        top_by_views_with_counts = with_counts(rankings['views'])
+        top_by_likes_with_counts = with_counts(rankings['likes'])
+        top_by_comments_with_counts = with_counts(rankings['comments'])
+        top_trending_with_counts = with_counts(rankings['trending'])
         
         return render_template('popular.html',
                              top_by_views=top_by_views_with_counts,
                              top_by_likes=top_by_likes_with_counts,
                              top_by_comments=top_by_comments_with_counts,
+                             top_trending=top_trending_with_counts,
                              current_user_id=current_user_id,
                              system_title=SYSTEM_TITLE)
 
@@ -0,0 +1,403 @@
+"""
+全文検索エンジン
+
+記事タイトル・本文・コメントの全文検索。SEARCH_BACKEND で検索方式を切り替える。
+- fts5: SQLite FTS5（trigramトークナイザー）
+- memory: プロセス内の文字バイグラム転置インデックス（データベース非依存）
+- like: LIKE検索
+"""
+
+from markupsafe import escape
+from sqlalchemy import text, table, column, select, literal_column
+from .models import db, Knowledge, Comment, Attachment, Tag
+from .search_index import (
+    knowledge_index, build_knowledge_index, stage_knowledge_update, build_snippet,
+    suggest_index, similarity_index, build_suggest_index, normalize_text
+)
+
+# FTS5仮想テーブル名
+FTS_TABLE_NAME = 'knowledge_fts'
+
+# trigramトークナイザーを使用（分かち書きのない日本語も部分一致で検索可能）
+FTS_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE {FTS_TABLE_NAME} "
+    f"USING fts5(title, content, comments, attachments, tokenize='trigram')"
+)
+
+# trigramトークナイザーで検索可能な最短の語長
+FTS_MIN_TERM_LENGTH = 3
+
+# 記事1件分のインデックス行を組み立てるSELECT（コメント・添付ファイルのテキストは改行区切りで連結）
+_FTS_ROW_SELECT = """
+    SELECT k.id, k.title, k.content,
+           COALESCE((SELECT group_concat(c.content, char(10))
+                     FROM comment c WHERE c.knowledge_id = k.id), ''),
+           COALESCE((SELECT group_concat(a.extracted_text, char(10))
+                     FROM attachment a WHERE a.knowledge_id = k.id AND a.extracted_text IS NOT NULL), '')
+    FROM knowledge k
+"""
+
+knowledge_fts = table(FTS_TABLE_NAME, column('rowid'))
+
+# 関連度計算のフィールド重み（タイトル一致を優先）
+SEARCH_FIELD_WEIGHTS = {'title': 5.0, 'content': 1.0, 'comments': 1.0, 'attachments': 0.5}
+
+# スニペットの長さ（FTS5はトークン数、それ以外は文字数）
+SNIPPET_TOKENS = 24
+SNIPPET_LENGTH = 100
+
+# プロセス内インデックスで一覧の絞り込み条件に渡す記事IDの上限（新しい記事から、IN句のパラメータ数を抑える）
+MEMORY_FILTER_MAX_IDS = 1000
+
+# FTS5のsnippet()で一致箇所を囲む区切り文字（エスケープ後に<mark>へ置換）
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+# 使用中の検索方式（init_search_engine()で決定）
+_backend = 'like'
+
+
+def get_search_backend():
+    """使用中の検索方式（'fts5' / 'memory' / 'like'）"""
+    return _backend
+
+
+def is_fts_enabled():
+    """FTS5による全文検索が有効かどうか"""
+    return _backend == 'fts5'
+
+
+def is_search_index_table(name):
+    """FTS5の仮想テーブル・シャドウテーブルかどうか（マイグレーション自動生成の対象外にする）"""
+    return bool(name) and name.startswith(FTS_TABLE_NAME)
+
+
+def init_search_engine(app):
+    """全文検索エンジンを初期化
+
+    SQLiteでFTS5が利用できる場合はFTS5仮想テーブルを作成し、それ以外の場合は
+    プロセス内インデックスを使用する（初回検索時に構築）。
+    """
+    global _backend
+    from .config import SEARCH_BACKEND
+    from .utils import audit_logger
+
+    if SEARCH_BACKEND == 'like':
+        _backend = 'like'
+        return
+
+    with app.app_context():
+        if SEARCH_BACKEND in ('auto', 'fts5') and db.engine.dialect.name == 'sqlite' and _init_fts():
+            _backend = 'fts5'
+            return
+
+    if SEARCH_BACKEND == 'fts5':
+        audit_logger.warning("FTS5 is not available for this database, using in-process search index")
+    _backend = 'memory'
+
+
+def _init_fts():
+    """FTS5仮想テーブルを作成（定義が変わっていた場合や新規作成時はインデックスを再構築）"""
+    from .utils import audit_logger
+
+    try:
+        with db.engine.begin() as connection:
+            existing_sql = connection.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': FTS_TABLE_NAME}
+            ).scalar()
+
+            if existing_sql == FTS_TABLE_SQL:
+                return True
+
+            # 定義が古い場合は作り直す
+            if existing_sql:
+                connection.execute(text(f"DROP TABLE {FTS_TABLE_NAME}"))
+            connection.execute(text(FTS_TABLE_SQL))
+            _rebuild(connection)
+
+        audit_logger.info(f"Full-text search index created: {FTS_TABLE_NAME}")
+        return True
+    except Exception as e:
+        # FTS5またはtrigramトークナイザーが使えないSQLiteビルド
+        audit_logger.warning(f"FTS5 full-text search unavailable: {e}")
+        return False
+
+
+def _rebuild(connection):
+    """インデックスを全件再構築"""
+    connection.execute(text(f"DELETE FROM {FTS_TABLE_NAME}"))
+    connection.execute(text(
+        f"INSERT INTO {FTS_TABLE_NAME}(rowid, title, content, comments, attachments) {_FTS_ROW_SELECT}"
+    ))
+
+
+def rebuild_search_index():
+    """全文検索インデックスを全件再構築"""
+    if _backend == 'fts5':
+        with db.engine.begin() as connection:
+            _rebuild(connection)
+    elif _backend == 'memory':
+        def build():
+            with db.engine.connect() as connection:
+                build_knowledge_index(connection)
+        knowledge_index.rebuild(build)
+
+
+def _ensure_memory_index():
+    """プロセス内インデックスが未構築であれば構築"""
+    def build():
+        with db.engine.connect() as connection:
+            build_knowledge_index(connection)
+    knowledge_index.ensure_built(build)
+
+
+def index_knowledge(connection, knowledge_id, session=None):
+    """記事1件分のインデックスを更新（SQLAlchemyイベントリスナーから呼び出す）
+
+    FTS5は同一トランザクション内で更新し、プロセス内インデックスはコミット時に反映する。
+    """
+    if _backend == 'memory':
+        stage_knowledge_update(session, connection, knowledge_id)
+        return
+    if _backend != 'fts5':
+        return
+    connection.execute(text(f"DELETE FROM {FTS_TABLE_NAME} WHERE rowid = :id"), {'id': knowledge_id})
+    connection.execute(text(
+        f"INSERT INTO {FTS_TABLE_NAME}(rowid, title, content, comments, attachments) {_FTS_ROW_SELECT} WHERE k.id = :id"
+    ), {'id': knowledge_id})
+
+
+def remove_knowledge(connection, knowledge_id, session=None):
+    """記事1件分のインデックスを削除"""
+    if _backend == 'memory':
+        stage_knowledge_update(session, connection, knowledge_id)
+        return
+    if _backend != 'fts5':
+        return
+    connection.execute(text(f"DELETE FROM {FTS_TABLE_NAME} WHERE rowid = :id"), {'id': knowledge_id})
+
+
+def split_search_terms(search_query):
+    """検索文字列を空白区切りの検索語リストに分割"""
+    return [term for term in search_query.split() if term]
+
+
+def build_match_query(search_query):
+    """FTS5のMATCH構文を組み立てる
+
+    各検索語をフレーズとしてクォートし、AND で結合する。
+    trigramで検索できない短い語が含まれる場合は None を返す。
+    """
+    terms = split_search_terms(search_query)
+    if not terms or any(len(term) < FTS_MIN_TERM_LENGTH for term in terms):
+        return None
+    return ' AND '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _like_filter(search_query):
+    """LIKE検索の条件式（FTS5が使えない場合のフォールバック）"""
+    return db.or_(
+        Knowledge.title.contains(search_query),
+        Knowledge.content.contains(search_query),
+        Knowledge.comments.any(Comment.content.contains(search_query)),
+        Knowledge.attachments.any(Attachment.extracted_text.contains(search_query))
+    )
+
+
+def get_search_filter(search_query):
+    """記事クエリに適用する検索条件を取得
+
+    Returns:
+        Knowledge クエリの filter() に渡せる条件式
+    """
+    if _backend == 'memory':
+        _ensure_memory_index()
+        # 検索結果はID順のため、末尾（新しい記事）から上限件数まで
+        return Knowledge.id.in_(knowledge_index.search(search_query)[-MEMORY_FILTER_MAX_IDS:])
+
+    match_query = build_match_query(search_query) if _backend == 'fts5' else None
+    if match_query is None:
+        return _like_filter(search_query)
+
+    matched_ids = select(knowledge_fts.c.rowid).where(
+        literal_column(FTS_TABLE_NAME).op('MATCH')(match_query)
+    )
+    return Knowledge.id.in_(matched_ids)
+
+
+def search_ranked(search_query, limit=10, offset=0):
+    """公開記事を関連度順に検索（BM25、タイトル一致を重み付け）
+
+    Returns:
+        tuple: (総件数, [{'id': 記事ID, 'score': スコア, 'snippet': 一致箇所のHTML,
+                          'matched_attachments': 一致した添付ファイル}])
+    """
+    total, results = _search_ranked(search_query, limit, offset)
+
+    # 一致した添付ファイルを付与（本文などに一致箇所がなければ添付ファイルのスニペットを使用）
+    matched_attachments = find_matching_attachments([result['id'] for result in results], search_query)
+    for result in results:
+        result['matched_attachments'] = matched_attachments.get(result['id'], [])
+        if '<mark>' not in result['snippet'] and result['matched_attachments']:
+            result['snippet'] = result['matched_attachments'][0]['snippet']
+    return total, results
+
+
+def _search_ranked(search_query, limit, offset):
+    if _backend == 'fts5':
+        match_query = build_match_query(search_query)
+        if match_query is not None:
+            return _search_ranked_fts(match_query, limit, offset)
+    elif _backend == 'memory':
+        return _search_ranked_memory(search_query, limit, offset)
+
+    # 関連度を計算できない場合は更新日時順
+    query = Knowledge.query.filter(Knowledge.is_draft == False, _like_filter(search_query))
+    total = query.count()
+    articles = query.order_by(Knowledge.updated_at.desc()).offset(offset).limit(limit).all()
+    return total, [_build_result(article.id, None, article, search_query) for article in articles]
+
+
+def _search_ranked_fts(match_query, limit, offset):
+    """FTS5のbm25()とsnippet()で検索"""
+    weights = ', '.join(str(SEARCH_FIELD_WEIGHTS[field]) for field in ('title', 'content', 'comments', 'attachments'))
+    where = f"""
+        FROM {FTS_TABLE_NAME} JOIN knowledge k ON k.id = {FTS_TABLE_NAME}.rowid
+        WHERE {FTS_TABLE_NAME} MATCH :query AND k.is_draft = :is_draft
+    """
+    params = {'query': match_query, 'is_draft': False}
+
+    total = db.session.execute(text(f"SELECT count(*) {where}"), params).scalar()
+    rows = db.session.execute(text(f"""
+        SELECT {FTS_TABLE_NAME}.rowid AS id,
+               bm25({FTS_TABLE_NAME}, {weights}) AS rank,
+               snippet({FTS_TABLE_NAME}, -1, :mark_start, :mark_end, '…', {SNIPPET_TOKENS}) AS snippet
+        {where}
+        ORDER BY rank, {FTS_TABLE_NAME}.rowid
+        LIMIT :limit OFFSET :offset
+    """), dict(params, mark_start=_MARK_START, mark_end=_MARK_END, limit=limit, offset=offset)).all()
+
+    results = []
+    for row in rows:
+        snippet = str(escape(row.snippet or '')).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+        # bm25()は小さいほど関連度が高いため符号を反転
+        results.append({'id': row.id, 'score': round(-row.rank, 6), 'snippet': snippet.replace('\n', ' ')})
+    return total, results
+
+
+def _search_ranked_memory(search_query, limit, offset):
+    """プロセス内インデックスのBM25で検索"""
+    _ensure_memory_index()
+    ranked = knowledge_index.rank(search_query, SEARCH_FIELD_WEIGHTS)
+    if not ranked:
+        return 0, []
+
+    # 下書きを除外（一致した記事数によらずIN句のパラメータ数を抑えるため分割して確認）
+    ranked_ids = [doc_id for doc_id, _ in ranked]
+    published_ids = set()
+    for start in range(0, len(ranked_ids), 500):
+        published_ids.update(row.id for row in db.session.query(Knowledge.id).filter(
+            Knowledge.id.in_(ranked_ids[start:start + 500]),
+            Knowledge.is_draft == False
+        ))
+    ranked = [(doc_id, score) for doc_id, score in ranked if doc_id in published_ids]
+    page = ranked[offset:offset + limit]
+
+    articles = {article.id: article for article in Knowledge.query.filter(
+        Knowledge.id.in_([doc_id for doc_id, _ in page])
+    )}
+    return len(ranked), [
+        _build_result(doc_id, round(score, 6), articles.get(doc_id), search_query) for doc_id, score in page
+    ]
+
+
+def _build_result(knowledge_id, score, knowledge, search_query):
+    """検索結果1件分（スニペットは本文、なければタイトルから作成）"""
+    snippet = ''
+    if knowledge is not None:
+        snippet = build_snippet(knowledge.content, search_query, SNIPPET_LENGTH)
+        if '<mark>' not in snippet:
+            title_snippet = build_snippet(knowledge.title, search_query, SNIPPET_LENGTH)
+            if '<mark>' in title_snippet:
+                snippet = title_snippet
+    return {'id': knowledge_id, 'score': score, 'snippet': snippet}
+
+
+def find_matching_attachments(knowledge_ids, search_query):
+    """検索語を含む添付ファイルを記事ごとに取得
+
+    Returns:
+        dict: {knowledge_id: [{'id': 添付ファイルID, 'filename': ファイル名, 'snippet': 一致箇所のHTML}]}
+    """
+    terms = normalize_text(search_query).split()
+    if not knowledge_ids or not terms:
+        return {}
+
+    rows = db.session.query(
+        Attachment.id, Attachment.knowledge_id, Attachment.filename, Attachment.extracted_text
+    ).filter(
+        Attachment.knowledge_id.in_(knowledge_ids),
+        Attachment.extracted_text.isnot(None),
+        Attachment.extracted_text != ''
+    ).order_by(Attachment.id).all()
+
+    matches = {}
+    for row in rows:
+        normalized = normalize_text(row.extracted_text)
+        if any(term in normalized for term in terms):
+            matches.setdefault(row.knowledge_id, []).append({
+                'id': row.id,
+                'filename': row.filename,
+                'snippet': build_snippet(row.extracted_text, search_query, SNIPPET_LENGTH)
+            })
+    return matches
+
+
+def _ensure_suggest_index():
+    """入力補完・あいまい検索インデックスが未構築であれば構築"""
+    def build():
+        with db.engine.connect() as connection:
+            build_suggest_index(connection)
+    suggest_index.ensure_built(build)
+
+
+def suggest(prefix, limit=10, kinds=None):
+    """タイトル・タグ名の入力補完候補を取得"""
+    _ensure_suggest_index()
+    return suggest_index.suggest(prefix, limit=limit, kinds=kinds)
+
+
+def fuzzy_search(search_query, limit=5, kinds=None):
+    """タイトル・タグ名をトライグラム類似度であいまい検索（タイプミス対策）
+
+    Returns:
+        list: [{'type': 'title'/'tag', 'id': ID, 'text': 表示文字列, 'similarity': 類似度}]
+    """
+    _ensure_suggest_index()
+    return similarity_index.search(search_query, limit=limit, kinds=kinds)
+
+
+def get_fuzzy_filter(search_query, near_matches=None):
+    """あいまい検索の条件式（完全一致に加えて、類似タイトルの記事・類似タグの付いた記事）"""
+    if near_matches is None:
+        near_matches = fuzzy_search(search_query, limit=20)
+    title_ids = [match['id'] for match in near_matches if match['type'] == 'title']
+    tag_ids = [match['id'] for match in near_matches if match['type'] == 'tag']
+
+    conditions = [get_search_filter(search_query)]
+    if title_ids:
+        conditions.append(Knowledge.id.in_(title_ids))
+    if tag_ids:
+        conditions.append(Knowledge.tags.any(Tag.id.in_(tag_ids)))
+    return db.or_(*conditions)
+
+
+def get_did_you_mean(search_query, near_matches, limit=3):
+    """「もしかして」候補（検索語と同じものを除いた類似タイトル・タグ名）"""
+    normalized_query = normalize_text(search_query).strip()
+    candidates = []
+    for match in near_matches:
+        if normalize_text(match['text']).strip() != normalized_query and match['text'] not in candidates:
+            candidates.append(match['text'])
+    return candidates[:limit]
@@ -0,0 +1,591 @@
+"""
+プロセス内転置インデックス
+
+データベースの種類に依存しない全文検索エンジン。文字バイグラムで分割した
+転置インデックスをメモリ上に保持し、SQLAlchemyのイベントから差分更新する。
+
+Note: インデックスはプロセスごとに保持されるため、複数ワーカー構成では
+他のワーカーでの更新は反映されない（再起動時に再構築される）。
+"""
+
+import math
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from sqlalchemy import text
+
+# インデックス対象フィールド
+INDEX_FIELDS = ('title', 'content', 'comments', 'attachments')
+
+# BM25パラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# カタカナ → ひらがな変換テーブル（ァ〜ヶ）
+_KANA_TABLE = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def normalize_text(text):
+    """検索用に文字列を正規化（NFKC・小文字化・カタカナをひらがなに統一）"""
+    if not text:
+        return ''
+    return unicodedata.normalize('NFKC', text).lower().translate(_KANA_TABLE)
+
+
+def tokenize(normalized):
+    """正規化済み文字列を文字バイグラムに分割
+
+    空白で区切られた語ごとに隣接2文字を取り出す。1文字だけの語はそのまま返す。
+    """
+    tokens = []
+    for word in normalized.split():
+        if len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+class _BuildableIndex:
+    """全件構築と差分更新を行うインデックスの共通処理
+
+    構築中に反映しようとした差分更新は、構築の読み込みに含まれていない可能性があるため保留し、構築後に反映する。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._pending_lock = threading.Lock()
+        self._pending = None  # 構築中のみ、構築後に反映する更新のリスト
+        self.is_built = False
+
+    def locked(self):
+        """インデックスのロック（複数の更新をまとめて排他実行する場合に with で使用、再入可能）"""
+        return self._lock
+
+    def ensure_built(self, build):
+        """未構築であれば build() で全件構築（同時に呼ばれた場合も構築は1回）"""
+        if self.is_built:
+            return
+        with self._lock:
+            if not self.is_built:
+                self.rebuild(build)
+
+    def rebuild(self, build):
+        """build() で全件構築し、構築中に保留した更新を反映"""
+        with self._lock:
+            with self._pending_lock:
+                self._pending = []
+            try:
+                build()
+            finally:
+                with self._pending_lock:
+                    pending, self._pending = self._pending, None
+            if self.is_built:
+                for apply in pending:
+                    apply()
+
+    def apply_update(self, apply):
+        """apply() で差分更新を反映
+
+        構築中は構築後に反映する。未構築の場合はコミット済みの内容が構築時に読み込まれるため何もしない。
+        """
+        with self._pending_lock:
+            if self._pending is not None:
+                self._pending.append(apply)
+                return
+            if not self.is_built:
+                return
+        with self._lock:
+            apply()
+
+
+class InvertedIndex(_BuildableIndex):
+    """文字バイグラムの転置インデックス
+
+    ポスティングはトークンごとにソート済みの array('I')（記事ID列）で保持する。
+    バイグラムの共通部分で候補を絞り込んだ後、正規化済みテキストで部分一致を確認する。
+    """
+
+    def __init__(self, fields=INDEX_FIELDS):
+        super().__init__()
+        self.fields = fields
+        self._postings = {}
+        self._documents = {}
+        self._field_lengths = {field: 0 for field in fields}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add_document(self, doc_id, values):
+        """文書を追加（既存の場合は置き換え）"""
+        document = {field: normalize_text(values.get(field)) for field in self.fields}
+        tokens = set()
+        for field_text in document.values():
+            tokens.update(tokenize(field_text))
+
+        with self._lock:
+            self._remove(doc_id)
+            self._documents[doc_id] = document
+            for field, field_text in document.items():
+                self._field_lengths[field] += len(field_text)
+            for token in tokens:
+                postings = self._postings.get(token)
+                if postings is None:
+                    self._postings[token] = array('I', [doc_id])
+                    continue
+                position = bisect_left(postings, doc_id)
+                postings.insert(position, doc_id)
+
+    def remove_document(self, doc_id):
+        """文書を削除"""
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        document = self._documents.pop(doc_id, None)
+        if document is None:
+            return
+        tokens = set()
+        for field, field_text in document.items():
+            self._field_lengths[field] -= len(field_text)
+            tokens.update(tokenize(field_text))
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            position = bisect_left(postings, doc_id)
+            if position < len(postings) and postings[position] == doc_id:
+                del postings[position]
+            if not postings:
+                del self._postings[token]
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._documents = {}
+            self._field_lengths = {field: 0 for field in self.fields}
+            self.is_built = False
+
+    def get_document(self, doc_id):
+        """正規化済みのフィールドテキストを取得"""
+        return self._documents.get(doc_id)
+
+    def _candidates(self, term):
+        """1語に対する候補文書IDの集合（バイグラムのAND）"""
+        tokens = set(tokenize(term))
+        if len(term) == 1 or not tokens:
+            # 1文字の語はポスティングを持たないため全文書が候補
+            return set(self._documents)
+
+        posting_lists = sorted((self._postings.get(token) for token in tokens),
+                               key=lambda postings: len(postings) if postings is not None else 0)
+        if posting_lists[0] is None:
+            return set()
+
+        candidates = set(posting_lists[0])
+        for postings in posting_lists[1:]:
+            candidates.intersection_update(postings)
+            if not candidates:
+                break
+        return candidates
+
+    def _matching(self, term, within=None):
+        """1語を部分一致で含む文書IDの集合"""
+        candidates = self._candidates(term)
+        if within is not None:
+            candidates &= within
+        return {
+            doc_id for doc_id in candidates
+            if any(term in field_text for field_text in self._documents[doc_id].values())
+        }
+
+    def search(self, query):
+        """検索語（空白区切りでAND）にマッチする文書IDのリストを返す"""
+        terms = normalize_text(query).split()
+        if not terms:
+            return []
+
+        with self._lock:
+            result = None
+            for term in sorted(terms, key=len, reverse=True):
+                result = self._matching(term, result)
+                if not result:
+                    return []
+            return sorted(result)
+
+    def rank(self, query, field_weights, doc_ids=None):
+        """BM25（フィールド重み付き）で関連度を計算
+
+        Args:
+            query: 検索文字列（空白区切りでAND）
+            field_weights: {field: weight} フィールドごとの重み
+            doc_ids: 対象を限定する文書IDの集合（None=全文書）
+
+        Returns:
+            list: [(doc_id, score)] スコアの高い順
+        """
+        terms = normalize_text(query).split()
+        if not terms:
+            return []
+
+        with self._lock:
+            total_docs = len(self._documents)
+            if not total_docs:
+                return []
+            average_lengths = {
+                field: (self._field_lengths[field] / total_docs) or 1.0 for field in self.fields
+            }
+
+            # 語ごとの出現文書（IDF計算用）と全語を含む文書
+            matches = {}
+            result = set(doc_ids) if doc_ids is not None else None
+            for term in set(terms):
+                matches[term] = self._matching(term)
+                result = matches[term] if result is None else result & matches[term]
+                if not result:
+                    return []
+
+            scores = []
+            for doc_id in result:
+                document = self._documents[doc_id]
+                score = 0.0
+                for term, matched in matches.items():
+                    idf = math.log(1 + (total_docs - len(matched) + 0.5) / (len(matched) + 0.5))
+                    weighted_tf = 0.0
+                    for field, weight in field_weights.items():
+                        field_text = document.get(field, '')
+                        tf = field_text.count(term)
+                        if tf:
+                            norm = 1 - BM25_B + BM25_B * len(field_text) / average_lengths[field]
+                            weighted_tf += weight * tf / norm
+                    score += idf * weighted_tf * (BM25_K1 + 1) / (weighted_tf + BM25_K1)
+                scores.append((doc_id, score))
+
+        scores.sort(key=lambda item: (-item[1], item[0]))
+        return scores
+
+
+class PrefixIndex(_BuildableIndex):
+    """前方一致検索用のソート済み配列（入力補完用）
+
+    (正規化済みキー, 種別, ID) をソート順に保持し、bisectで前方一致範囲を探索する。
+    タイトルは先頭に加えて空白区切りの各語の先頭からも一致させる。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._keys = []
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, kind, item_id, label):
+        """候補を追加（既存の場合は置き換え）"""
+        normalized = normalize_text(label)
+        keys = set()
+        position = 0
+        for word in normalized.split():
+            position = normalized.index(word, position)
+            keys.add(normalized[position:])
+            position += len(word)
+
+        with self._lock:
+            self._remove(kind, item_id)
+            self._entries[(kind, item_id)] = (label, keys)
+            for key in keys:
+                insort(self._keys, (key, kind, item_id))
+
+    def remove(self, kind, item_id):
+        """候補を削除"""
+        with self._lock:
+            self._remove(kind, item_id)
+
+    def _remove(self, kind, item_id):
+        entry = self._entries.pop((kind, item_id), None)
+        if entry is None:
+            return
+        for key in entry[1]:
+            position = bisect_left(self._keys, (key, kind, item_id))
+            if position < len(self._keys) and self._keys[position] == (key, kind, item_id):
+                del self._keys[position]
+
+    def clear(self):
+        with self._lock:
+            self._keys = []
+            self._entries = {}
+            self.is_built = False
+
+    def suggest(self, prefix, limit=10, kinds=None):
+        """前方一致する候補を返す
+
+        Returns:
+            list: [{'type': 種別, 'id': ID, 'text': 表示文字列}]
+        """
+        prefix = normalize_text(prefix).strip()
+        if not prefix:
+            return []
+
+        results = []
+        seen = set()
+        with self._lock:
+            position = bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(results) < limit:
+                key, kind, item_id = self._keys[position]
+                if not key.startswith(prefix):
+                    break
+                position += 1
+                if (kinds and kind not in kinds) or (kind, item_id) in seen:
+                    continue
+                seen.add((kind, item_id))
+                results.append({'type': kind, 'id': item_id, 'text': self._entries[(kind, item_id)][0]})
+        return results
+
+
+def trigrams(normalized):
+    """正規化済み文字列の文字トライグラム集合（前後を空白で埋める）"""
+    padded = f'  {normalized} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SimilarityIndex:
+    """トライグラム類似度（Dice係数）によるあいまい検索インデックス
+
+    タイトルは全体に加えて空白区切りの各語も候補として登録し、最も近いものの類似度を採用する。
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, kind, item_id, label):
+        """候補を追加（既存の場合は置き換え）"""
+        normalized = normalize_text(label).strip()
+        variants = [normalized] + [word for word in normalized.split() if word != normalized]
+        gram_sets = [trigrams(variant) for variant in variants if variant]
+
+        with self._lock:
+            self._remove(kind, item_id)
+            self._entries[(kind, item_id)] = (label, gram_sets)
+            for variant, grams in enumerate(gram_sets):
+                for gram in grams:
+                    self._postings.setdefault(gram, set()).add((kind, item_id, variant))
+
+    def remove(self, kind, item_id):
+        """候補を削除"""
+        with self._lock:
+            self._remove(kind, item_id)
+
+    def _remove(self, kind, item_id):
+        entry = self._entries.pop((kind, item_id), None)
+        if entry is None:
+            return
+        for variant, grams in enumerate(entry[1]):
+            for gram in grams:
+                postings = self._postings.get(gram)
+                if postings is None:
+                    continue
+                postings.discard((kind, item_id, variant))
+                if not postings:
+                    del self._postings[gram]
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._entries = {}
+
+    def search(self, query, limit=5, kinds=None, threshold=0.35):
+        """類似度の高い候補を返す
+
+        Returns:
+            list: [{'type': 種別, 'id': ID, 'text': 表示文字列, 'similarity': 類似度}]
+        """
+        query_grams = trigrams(normalize_text(query).strip())
+
+        with self._lock:
+            overlaps = {}
+            for gram in query_grams:
+                for key in self._postings.get(gram, ()):
+                    overlaps[key] = overlaps.get(key, 0) + 1
+
+            best = {}
+            for (kind, item_id, variant), overlap in overlaps.items():
+                if kinds and kind not in kinds:
+                    continue
+                grams = self._entries[(kind, item_id)][1][variant]
+                similarity = 2 * overlap / (len(query_grams) + len(grams))
+                if similarity >= threshold and similarity > best.get((kind, item_id), 0):
+                    best[(kind, item_id)] = similarity
+
+            ranked = sorted(best.items(), key=lambda item: (-item[1], item[0]))[:limit]
+            return [
+                {'type': kind, 'id': item_id, 'text': self._entries[(kind, item_id)][0],
+                 'similarity': round(similarity, 3)}
+                for (kind, item_id), similarity in ranked
+            ]
+
+
+def build_snippet(text, query, width=100):
+    """検索語の周辺を切り出し、一致箇所を<mark>で囲んだHTMLを返す"""
+    from markupsafe import escape
+
+    if not text:
+        return ''
+
+    # 元テキストの位置を保持したまま正規化
+    normalized_chars = []
+    origins = []
+    for position, char in enumerate(text):
+        piece = normalize_text(char)
+        normalized_chars.append(piece)
+        origins.extend([position] * len(piece))
+    normalized = ''.join(normalized_chars)
+
+    terms = [term for term in normalize_text(query).split() if term]
+    spans = []
+    for term in terms:
+        start = normalized.find(term)
+        while start != -1:
+            end = start + len(term) - 1
+            spans.append((origins[start], origins[end] + 1))
+            start = normalized.find(term, start + len(term))
+    spans.sort()
+
+    # 最初の一致箇所を中心に切り出し
+    first = spans[0][0] if spans else 0
+    window_start = max(0, first - width // 4)
+    window_end = min(len(text), window_start + width)
+
+    parts = ['…'] if window_start > 0 else []
+    cursor = window_start
+    for span_start, span_end in spans:
+        if span_start < cursor or span_start >= window_end:
+            continue
+        parts.append(str(escape(text[cursor:span_start])))
+        parts.append('<mark>' + str(escape(text[span_start:min(span_end, window_end)])) + '</mark>')
+        cursor = min(span_end, window_end)
+    parts.append(str(escape(text[cursor:window_end])))
+    if window_end < len(text):
+        parts.append('…')
+    return ''.join(parts).replace('\n', ' ')
+
+
+# 記事検索用のインデックス（アプリ全体で共有）
+knowledge_index = InvertedIndex()
+
+# タイトル・タグ名の入力補完用・あいまい検索用インデックス（アプリ全体で共有）
+suggest_index = PrefixIndex()
+similarity_index = SimilarityIndex()
+
+
+def _fetch_documents(connection, knowledge_id=None):
+    """記事・コメント・添付ファイルのテキストを読み込み {id: {field: text}} を返す"""
+    params = {}
+    knowledge_sql = "SELECT id, title, content FROM knowledge"
+    comment_sql = "SELECT knowledge_id, content FROM comment"
+    attachment_sql = "SELECT knowledge_id, extracted_text AS content FROM attachment WHERE extracted_text IS NOT NULL"
+    if knowledge_id is not None:
+        knowledge_sql += " WHERE id = :id"
+        comment_sql += " WHERE knowledge_id = :id"
+        attachment_sql += " AND knowledge_id = :id"
+        params['id'] = knowledge_id
+
+    documents = {}
+    for row in connection.execute(text(knowledge_sql), params):
+        documents[row.id] = {'title': row.title, 'content': row.content, 'comments': [], 'attachments': []}
+    for field, sql in (('comments', comment_sql), ('attachments', attachment_sql)):
+        for row in connection.execute(text(sql + " ORDER BY id"), params):
+            if row.knowledge_id in documents:
+                documents[row.knowledge_id][field].append(row.content)
+    for document in documents.values():
+        document['comments'] = '\n'.join(document['comments'])
+        document['attachments'] = '\n'.join(document['attachments'])
+    return documents
+
+
+def build_knowledge_index(connection):
+    """データベースから記事インデックスを全件構築（knowledge_index.ensure_built() / rebuild() から呼び出す）"""
+    documents = _fetch_documents(connection)
+    with knowledge_index.locked():
+        knowledge_index.clear()
+        for doc_id, values in documents.items():
+            knowledge_index.add_document(doc_id, values)
+        knowledge_index.is_built = True
+
+
+def stage_knowledge_update(session, connection, knowledge_id):
+    """記事の再インデックスを予約（コミット時に反映、ロールバック時は破棄）
+
+    フラッシュ中のイベントリスナーから呼び出し、同一トランザクション内の
+    最新状態をスナップショットとして保持する。インデックスの構築前・構築中に
+    予約した更新も、構築の読み込みに含まれない場合に備えて保持する。
+    """
+    if session is None:
+        return
+    documents = _fetch_documents(connection, knowledge_id)
+    pending = session.info.setdefault('search_index_pending', {})
+    pending[knowledge_id] = documents.get(knowledge_id)
+
+
+def build_suggest_index(connection):
+    """データベースから入力補完・あいまい検索インデックスを全件構築（公開記事のタイトルと全タグ名）
+
+    suggest_index.ensure_built() / rebuild() から呼び出す。
+    """
+    titles = connection.execute(
+        text("SELECT id, title FROM knowledge WHERE is_draft = :is_draft"), {'is_draft': False}
+    ).all()
+    tags = connection.execute(text("SELECT id, name FROM tag")).all()
+    with suggest_index.locked():
+        suggest_index.clear()
+        similarity_index.clear()
+        for kind, rows in (('title', titles), ('tag', tags)):
+            for row in rows:
+                label = row[1]
+                suggest_index.add(kind, row.id, label)
+                similarity_index.add(kind, row.id, label)
+        suggest_index.is_built = True
+
+
+def stage_suggestion_update(session, kind, item_id, label):
+    """入力補完候補の更新を予約（label=None で削除）"""
+    if session is None:
+        return
+    pending = session.info.setdefault('suggest_index_pending', {})
+    pending[(kind, item_id)] = label
+
+
+def apply_staged_updates(session):
+    """コミットされた再インデックスを反映（インデックスの構築中は構築後に反映）"""
+    pending = session.info.pop('search_index_pending', None)
+    if pending:
+        def apply_knowledge_updates():
+            for knowledge_id, values in pending.items():
+                if values is None:
+                    knowledge_index.remove_document(knowledge_id)
+                else:
+                    knowledge_index.add_document(knowledge_id, values)
+        knowledge_index.apply_update(apply_knowledge_updates)
+
+    suggestions = session.info.pop('suggest_index_pending', None)
+    if suggestions:
+        def apply_suggestion_updates():
+            for (kind, item_id), label in suggestions.items():
+                if label is None:
+                    suggest_index.remove(kind, item_id)
+                    similarity_index.remove(kind, item_id)
+                else:
+                    suggest_index.add(kind, item_id, label)
+                    similarity_index.add(kind, item_id, label)
+        suggest_index.apply_update(apply_suggestion_updates)
+
+
+def discard_staged_updates(session):
+    """ロールバックされた再インデックスを破棄"""
+    session.info.pop('search_index_pending', None)
+    session.info.pop('suggest_index_pending', None)
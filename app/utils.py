@@ -202,119 +202,261 @@ def recalculate_tag_usage_counts():
     db.session.commit()
     audit_logger.info(f"Recalculated usage counts for {len(tag_counts)} tags")
 
+# 一覧表示用の抜粋の行数・最大文字数
+EXCERPT_MAX_LINES = 5
+EXCERPT_MAX_LENGTH = 1000
+
+def make_excerpt(content):
+    """一覧表示用の抜粋を作成（先頭5行、省略した場合は最終行に '...'）"""
+    if not content:
+        return ''
+    
+    lines = content.split('\n', EXCERPT_MAX_LINES)
+    truncated = len(lines) > EXCERPT_MAX_LINES
+    excerpt = '\n'.join(lines[:EXCERPT_MAX_LINES])
+    if len(excerpt) > EXCERPT_MAX_LENGTH:
+        excerpt = excerpt[:EXCERPT_MAX_LENGTH]
+        truncated = True
+    return excerpt + '\n...' if truncated else excerpt
+
+def listing_query_options():
+    """一覧表示用のクエリオプション（本文と描画結果のカラムは読み込まない）"""
+    from sqlalchemy.orm import defer, raiseload
+    from .models import Knowledge
+    
+    # タグ・添付ファイル数は get_listing_engagement() で一括取得する
+    return (
+        defer(Knowledge.content, raiseload=True),
+        defer(Knowledge.rendered_html, raiseload=True),
+        raiseload(Knowledge.tags),
+        raiseload(Knowledge.attachments)
+    )
+
 def get_bulk_view_counts(knowledge_list, days=None):
     """複数の記事の閲覧数を一括取得（N+1問題を回避）
     
+    期間指定がない場合は集計カラム、ある場合は日別集計（knowledge_daily_stats）を参照する。
+    
     Note: 単一記事の場合は knowledge.get_view_count() を使用
     """
-    from .models import ViewHistory, db
-    from datetime import datetime, timezone, timedelta
-    from sqlalchemy import func
-    
-    if not knowledge_list:
-        return {}
+    return {knowledge_id: stats['views'] for knowledge_id, stats in get_listing_engagement([knowledge.id for knowledge in knowledge_list], days).items()}
+
+def get_bulk_like_counts(knowledge_list, days=None):
+    """複数の記事のいいね数を一括取得（N+1問題を回避）
     
-    knowledge_ids = [k.id for k in knowledge_list]
+    期間指定がない場合は集計カラム、ある場合は日別集計（knowledge_daily_stats）を参照する。
     
-    # 基本クエリ
-    query = db.session.query(
-        ViewHistory.knowledge_id,
-        func.count(ViewHistory.id).label('view_count')
-    ).filter(ViewHistory.knowledge_id.in_(knowledge_ids))
+    Note: 単一記事の場合は knowledge.get_like_count() を使用
+    """
+    return {knowledge_id: stats['likes'] for knowledge_id, stats in get_listing_engagement([knowledge.id for knowledge in knowledge_list], days).items()}
+
+def get_bulk_comment_counts(knowledge_list, days=None):
+    """複数の記事のコメント数を一括取得（N+1問題を回避）
     
-    # 期間指定がある場合
-    if days:
-        cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
-        query = query.filter(ViewHistory.viewed_at >= cutoff_date)
+    期間指定がない場合は集計カラム、ある場合は日別集計（knowledge_daily_stats）を参照する。
     
-    # 結果を辞書に変換
-    results = query.group_by(ViewHistory.knowledge_id).all()
-    return {result.knowledge_id: result.view_count for result in results}
+    Note: 単一記事の場合は knowledge.get_comment_count() を使用
+    """
+    return {knowledge_id: stats['comments'] for knowledge_id, stats in get_listing_engagement([knowledge.id for knowledge in knowledge_list], days).items()}
 
-def get_bulk_like_counts(knowledge_list, days=None):
-    """複数の記事のいいね数を一括取得（N+1問題を回避）
+def get_listing_engagement(knowledge_ids, days=None):
+    """一覧表示用に複数の記事の閲覧・いいね・コメント数、添付ファイル数、タグを1回のクエリで取得
     
-    Note: 単一記事の場合は knowledge.get_like_count() を使用
+    記事とタグの外部結合（記事×タグごとに1行）に、添付ファイル数と期間指定時の日別集計の合計を
+    相関スカラーサブクエリで付与する。期間指定がない場合の件数は記事の集計カラムを使う。
+    
+    Args:
+        knowledge_ids: 記事IDのリスト
+        days: 期間指定（None=全期間、30=直近30日など、日単位で集計）
+    
+    Returns:
+        dict: {knowledge_id: {'views': count, 'likes': count, 'comments': count, 'attachments': count, 'tags': [Tag]}}
     """
-    from .models import Like, db
     from datetime import datetime, timezone, timedelta
-    from sqlalchemy import func
+    from sqlalchemy import func, select
+    from .models import Knowledge, KnowledgeDailyStats, knowledge_tags
     
-    if not knowledge_list:
-        return {}
+    attachments = select(func.count(Attachment.id)).where(
+        Attachment.knowledge_id == Knowledge.id
+    ).correlate(Knowledge).scalar_subquery()
     
-    knowledge_ids = [k.id for k in knowledge_list]
+    if days:
+        first_day = datetime.now(timezone.utc).date() - timedelta(days=days)
+        def period_total(column):
+            return select(func.coalesce(func.sum(column), 0)).where(
+                KnowledgeDailyStats.knowledge_id == Knowledge.id,
+                KnowledgeDailyStats.day >= first_day
+            ).correlate(Knowledge).scalar_subquery()
+        counts = (period_total(KnowledgeDailyStats.views), period_total(KnowledgeDailyStats.likes),
+                  period_total(KnowledgeDailyStats.comments))
+    else:
+        counts = (Knowledge.view_count, Knowledge.like_count, Knowledge.comment_count)
+    
+    knowledge_ids = list(knowledge_ids)
+    engagement = {}
+    for start in range(0, len(knowledge_ids), 500):
+        rows = db.session.query(
+            Knowledge.id, counts[0].label('views'), counts[1].label('likes'), counts[2].label('comments'),
+            attachments.label('attachments'), Tag
+        ).outerjoin(
+            knowledge_tags, knowledge_tags.c.knowledge_id == Knowledge.id
+        ).outerjoin(
+            Tag, Tag.id == knowledge_tags.c.tag_id
+        ).filter(
+            Knowledge.id.in_(knowledge_ids[start:start + 500])
+        ).order_by(Knowledge.id, Tag.id)
+        
+        for row in rows:
+            stats = engagement.setdefault(row.id, {
+                'views': row.views or 0,
+                'likes': row.likes or 0,
+                'comments': row.comments or 0,
+                'attachments': row.attachments,
+                'tags': []
+            })
+            if row.Tag is not None:
+                stats['tags'].append(row.Tag)
+    
+    return engagement
+
+def get_bulk_comment_engagement(comments, user_id):
+    """複数のコメントのいいね数と、指定ユーザーのいいね状態を一括取得（N+1問題を回避）
     
-    # 基本クエリ
-    query = db.session.query(
-        Like.knowledge_id,
-        func.count(Like.id).label('like_count')
-    ).filter(Like.knowledge_id.in_(knowledge_ids))
+    いいね数はコメントの集計カラムを返し、いいね状態は1回のクエリで取得する。
     
-    # 期間指定がある場合
-    if days:
-        cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
-        query = query.filter(Like.created_at >= cutoff_date)
+    Args:
+        comments: Comment オブジェクトのリスト
+        user_id: いいね状態を調べるユーザーID
+    
+    Returns:
+        dict: {comment.id: {'likes': count, 'liked': bool}}
+    """
+    from .models import CommentLike
+    
+    comment_ids = [comment.id for comment in comments]
+    liked_ids = set()
+    for start in range(0, len(comment_ids), 500):
+        liked_ids.update(row.comment_id for row in CommentLike.query.with_entities(CommentLike.comment_id).filter(
+            CommentLike.user_id == user_id,
+            CommentLike.comment_id.in_(comment_ids[start:start + 500])
+        ))
+    
+    return {
+        comment.id: {'likes': comment.like_count, 'liked': comment.id in liked_ids}
+        for comment in comments
+    }
+
+def encode_cursor(sort_value, knowledge_id):
+    """キーセットページネーションのカーソル（並び順の日時と記事ID）を不透明な文字列に変換"""
+    import base64
+    import json
     
-    # 結果を辞書に変換
-    results = query.group_by(Like.knowledge_id).all()
-    return {result.knowledge_id: result.like_count for result in results}
+    raw = json.dumps([sort_value.isoformat(), knowledge_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
 
-def get_bulk_comment_counts(knowledge_list, days=None):
-    """複数の記事のコメント数を一括取得（N+1問題を回避）
+def decode_cursor(cursor):
+    """カーソル文字列を (並び順の日時, 記事ID) に戻す
     
-    Note: 単一記事の場合は knowledge.get_comment_count() を使用
+    Raises:
+        ValueError: カーソルの形式が不正な場合
     """
-    from .models import Comment, db
-    from datetime import datetime, timezone, timedelta
-    from sqlalchemy import func
+    import base64
+    import binascii
+    import json
+    from datetime import datetime
     
-    if not knowledge_list:
-        return {}
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        sort_value, knowledge_id = json.loads(raw)
+        return datetime.fromisoformat(sort_value), int(knowledge_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+
+def apply_keyset_cursor(query, column, cursor=None):
+    """記事のクエリを (column, id) の降順に並べ、カーソルより後の記事に絞り込む
     
-    knowledge_ids = [k.id for k in knowledge_list]
+    OFFSETと異なり、読み飛ばす行数によらず索引でカーソルの位置から読み始められる。
     
-    # 基本クエリ
-    query = db.session.query(
-        Comment.knowledge_id,
-        func.count(Comment.id).label('comment_count')
-    ).filter(Comment.knowledge_id.in_(knowledge_ids))
+    Args:
+        query: Knowledge のクエリ
+        column: 並び順の日時カラム（Knowledge.created_at / Knowledge.updated_at）
+        cursor: encode_cursor() で作成したカーソル（省略時は先頭から）
     
-    # 期間指定がある場合
-    if days:
-        cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
-        query = query.filter(Comment.created_at >= cutoff_date)
+    Raises:
+        ValueError: カーソルの形式が不正な場合
+    """
+    from .models import Knowledge
     
-    # 結果を辞書に変換
-    results = query.group_by(Comment.knowledge_id).all()
-    return {result.knowledge_id: result.comment_count for result in results}
+    if cursor:
+        sort_value, knowledge_id = decode_cursor(cursor)
+        query = query.filter(db.or_(
+            column < sort_value,
+            db.and_(column == sort_value, Knowledge.id < knowledge_id)
+        ))
+    return query.order_by(column.desc(), Knowledge.id.desc())
 
-def get_bulk_engagement_stats(knowledge_list, days=None):
-    """複数の記事のエンゲージメント統計を一括取得（閲覧・いいね・コメント）
+def get_facet_counts(query):
+    """絞り込み結果のタグ別・作成者別の記事数を1回のクエリで集計
     
     Args:
-        knowledge_list: Knowledge オブジェクトのリスト
-        days: 期間指定（None=全期間、30=直近30日など）
+        query: 絞り込み条件を適用した Knowledge のクエリ（並び順・ページングは無視）
     
     Returns:
-        dict: {knowledge.id: {'views': count, 'likes': count, 'comments': count}}
+        dict: {'tags': [{'name', 'color', 'count'}], 'authors': [{'name', 'count'}]}
+              いずれも件数の多い順
+    """
+    from .models import Knowledge, Tag, knowledge_tags, db
+    from sqlalchemy import func, literal, null, select, union_all
+    
+    # 絞り込み結果の記事ID（集計の対象集合）
+    matched_ids = select(query.with_entities(Knowledge.id).order_by(None).subquery().c.id)
+    
+    tag_counts = select(
+        literal('tag').label('facet'),
+        Tag.name.label('value'),
+        Tag.color.label('color'),
+        func.count().label('article_count')
+    ).select_from(knowledge_tags.join(Tag, Tag.id == knowledge_tags.c.tag_id)).where(
+        knowledge_tags.c.knowledge_id.in_(matched_ids)
+    ).group_by(Tag.id, Tag.name, Tag.color)
+    
+    author_counts = select(
+        literal('author').label('facet'),
+        Knowledge.author.label('value'),
+        null().label('color'),
+        func.count().label('article_count')
+    ).where(
+        Knowledge.id.in_(matched_ids)
+    ).group_by(Knowledge.author)
+    
+    facets = {'tags': [], 'authors': []}
+    for row in db.session.execute(union_all(tag_counts, author_counts)):
+        if row.facet == 'tag':
+            facets['tags'].append({'name': row.value, 'color': row.color, 'count': row.article_count})
+        else:
+            facets['authors'].append({'name': row.value, 'count': row.article_count})
+    
+    for items in facets.values():
+        items.sort(key=lambda item: (-item['count'], item['name']))
+    return facets
+
+def get_tag_cloud():
+    """絞り込みなしの一覧用のタグ一覧（公開記事で使用されているタグ、使用回数順）
     
-    Note: 個別記事の場合は以下の統一APIを使用:
-        - knowledge.get_view_count()     # 総閲覧数
-        - knowledge.get_like_count()     # 総いいね数
-        - knowledge.get_comment_count()  # 総コメント数
+    集計クエリは行わず Tag.usage_count をそのまま件数とする。
+    
+    Returns:
+        dict: get_facet_counts() と同じ形式（authors は空）
     """
-    view_counts = get_bulk_view_counts(knowledge_list, days)
-    like_counts = get_bulk_like_counts(knowledge_list, days)
-    comment_counts = get_bulk_comment_counts(knowledge_list, days)
-    
-    # 全記事のIDでデフォルト値0の辞書を作成
-    stats = {}
-    for knowledge in knowledge_list:
-        stats[knowledge.id] = {
-            'views': view_counts.get(knowledge.id, 0),
-            'likes': like_counts.get(knowledge.id, 0),
-            'comments': comment_counts.get(knowledge.id, 0)
-        }
-    
-    return stats
\ No newline at end of file
+    from .models import Knowledge, Tag
+    
+    tags = Tag.query.join(
+        Tag.knowledge_items
+    ).filter(
+        Knowledge.is_draft == False,
+        Tag.usage_count > 0
+    ).distinct().order_by(Tag.usage_count.desc()).all()
+    return {
+        'tags': [{'name': tag.name, 'color': tag.color, 'count': tag.usage_count} for tag in tags],
+        'authors': []
+    }
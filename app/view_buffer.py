@@ -0,0 +1,252 @@
+"""
+閲覧履歴の書き込みバッファ
+
+記事の閲覧ごとにINSERTとコミットを行うと、SQLiteでは閲覧ページが書き込みロック待ちで直列化されるため、
+閲覧イベントをメモリ上に溜めてバックグラウンドスレッドでまとめて書き込む。
+
+- 同一ユーザー・同一記事・同一日（UTC）の閲覧は1回のみ記録する（バッファ内で重複を除き、
+  書き込み時は (user_id, knowledge_id, view_date) の一意制約で既存行との重複を除く）
+- VIEW_BUFFER_SIZE 件溜まるか VIEW_FLUSH_INTERVAL_SECONDS 秒経過すると、1トランザクションで
+  閲覧履歴をまとめてINSERT（executemany）し、挿入できた分だけ閲覧数・日別集計・ユニーク閲覧者のスケッチを更新する
+- 書き込みに失敗した場合（SQLiteのロック待ちの時間切れなど）はイベントをバッファに戻し、次回に再試行する
+- プロセス終了時に未書き込みのイベントを書き込む
+- 1日1回、保持期間（VIEW_HISTORY_RETENTION_DAYS）を過ぎた閲覧履歴を集約・削除する
+- VIEW_FLUSH_INTERVAL_SECONDS が0以下の場合はバッファを使わず閲覧ごとに書き込む
+"""
+
+import atexit
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+# 書き込み時に1回のクエリで扱うイベント数
+VIEW_FLUSH_CHUNK_SIZE = 500
+
+# 書き込みに失敗した閲覧イベントをバッファに戻す場合の、バッファ全体の上限件数（超えた分は古いものから破棄）
+VIEW_BUFFER_MAX_PENDING = 100000
+
+# 保持期間を過ぎた閲覧履歴の集約・削除の間隔（秒）
+VIEW_COMPACTION_INTERVAL_SECONDS = 24 * 60 * 60
+
+_pending = OrderedDict()  # {(user_id, knowledge_id, day): viewed_at}
+_pending_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flush_requested = threading.Event()
+_thread = None
+_app = None
+
+
+def init_view_buffer(app):
+    """書き込みスレッドを起動し、終了時の書き込みを登録"""
+    global _app, _thread
+    from .config import VIEW_FLUSH_INTERVAL_SECONDS
+
+    _app = app
+    if VIEW_FLUSH_INTERVAL_SECONDS <= 0 or _thread is not None:
+        return
+    _thread = threading.Thread(target=_run, name='view-buffer', daemon=True)
+    _thread.start()
+    atexit.register(flush_view_buffer)
+
+
+def record_view(user_id, knowledge_id, viewed_at=None):
+    """閲覧イベントを記録（同じ日の同じ閲覧がバッファにあれば何もしない）
+
+    Returns:
+        bool: 新しいイベントとして受け付けた場合 True
+    """
+    from .config import VIEW_BUFFER_SIZE, VIEW_FLUSH_INTERVAL_SECONDS
+
+    viewed_at = viewed_at or datetime.now(timezone.utc)
+    key = (user_id, knowledge_id, viewed_at.date())
+
+    if VIEW_FLUSH_INTERVAL_SECONDS <= 0 or _thread is None:
+        return write_views([(user_id, knowledge_id, viewed_at)]) > 0
+
+    with _pending_lock:
+        if key in _pending:
+            return False
+        _pending[key] = viewed_at
+        pending_count = len(_pending)
+    if pending_count >= VIEW_BUFFER_SIZE:
+        _flush_requested.set()
+    return True
+
+
+def get_pending_view_count():
+    """書き込み待ちの閲覧イベント数"""
+    with _pending_lock:
+        return len(_pending)
+
+
+def _insert_new_views(rows):
+    """同じ日の閲覧履歴がない行のみ挿入し、挿入した行の (knowledge_id, view_date, user_id) を返す
+
+    SQLite・PostgreSQLでは INSERT ... ON CONFLICT DO NOTHING RETURNING で一意制約により重複を除き、
+    それ以外のデータベースでは既存行を閲覧日で検索してから挿入する。
+    """
+    from .models import db, ViewHistory
+
+    table = ViewHistory.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table).on_conflict_do_nothing(
+            index_elements=['user_id', 'knowledge_id', 'view_date']
+        ).returning(table.c.knowledge_id, table.c.view_date, table.c.user_id)
+        return [(row.knowledge_id, row.view_date, row.user_id) for row in db.session.execute(statement, rows)]
+
+    recorded = {
+        (row.user_id, row.knowledge_id, row.view_date)
+        for row in db.session.query(
+            ViewHistory.user_id, ViewHistory.knowledge_id, ViewHistory.view_date
+        ).filter(
+            ViewHistory.knowledge_id.in_({row['knowledge_id'] for row in rows}),
+            ViewHistory.user_id.in_({row['user_id'] for row in rows}),
+            ViewHistory.view_date.in_({row['view_date'] for row in rows})
+        )
+    }
+    rows = [row for row in rows if (row['user_id'], row['knowledge_id'], row['view_date']) not in recorded]
+    if rows:
+        db.session.execute(table.insert(), rows)
+    return [(row['knowledge_id'], row['view_date'], row['user_id']) for row in rows]
+
+
+def write_views(events):
+    """閲覧イベントをまとめて書き込み、閲覧数と日別集計を加算してコミット
+
+    既に同じ日の閲覧履歴がある閲覧と、削除済みの記事への閲覧は書き込まない。
+
+    Args:
+        events: [(user_id, knowledge_id, viewed_at)]
+
+    Returns:
+        int: 書き込んだ閲覧履歴の件数
+    """
+    from .models import db, Knowledge
+    from .engagement import increment_view_count
+    from .readers import record_readers
+
+    written = 0
+    try:
+        for start in range(0, len(events), VIEW_FLUSH_CHUNK_SIZE):
+            chunk = events[start:start + VIEW_FLUSH_CHUNK_SIZE]
+            existing_ids = {row.id for row in db.session.query(Knowledge.id).filter(
+                Knowledge.id.in_({knowledge_id for _, knowledge_id, _ in chunk})
+            )}
+            rows = [
+                {'user_id': user_id, 'knowledge_id': knowledge_id, 'viewed_at': viewed_at, 'view_date': viewed_at.date()}
+                for user_id, knowledge_id, viewed_at in chunk if knowledge_id in existing_ids
+            ]
+            if not rows:
+                continue
+
+            inserted = _insert_new_views(rows)
+            for (knowledge_id, day), count in Counter(
+                (knowledge_id, day) for knowledge_id, day, _ in inserted
+            ).items():
+                increment_view_count(knowledge_id, count, day=day)
+            record_readers(inserted)
+            written += len(inserted)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return written
+
+
+def flush_view_buffer():
+    """書き込み待ちの閲覧イベントをすべて書き込む
+
+    Returns:
+        int: 書き込んだ閲覧履歴の件数
+    """
+    from .models import db
+    from .utils import audit_logger
+
+    if _app is None:
+        return 0
+
+    with _flush_lock:
+        with _pending_lock:
+            events = [(user_id, knowledge_id, viewed_at) for (user_id, knowledge_id, _), viewed_at in _pending.items()]
+            _pending.clear()
+        if not events:
+            return 0
+
+        with _app.app_context():
+            try:
+                written = write_views(events)
+                audit_logger.info(f"View history flushed - Events:{len(events)}, Recorded:{written}")
+                return written
+            except Exception as e:
+                dropped = _requeue(events)
+                audit_logger.error(f"View history flush failed - Events:{len(events)}, Requeued:{len(events) - dropped}, Error:{e}")
+                return 0
+            finally:
+                db.session.remove()
+
+
+def _requeue(events):
+    """書き込みに失敗したイベントをバッファの先頭に戻す
+
+    同じ日の同じ閲覧が既にバッファにある場合はそちらを残し、VIEW_BUFFER_MAX_PENDING 件を超える分は古いものから破棄する。
+
+    Returns:
+        int: 破棄したイベント数
+    """
+    from .utils import audit_logger
+
+    with _pending_lock:
+        failed = OrderedDict()
+        for user_id, knowledge_id, viewed_at in events:
+            key = (user_id, knowledge_id, viewed_at.date())
+            if key not in _pending:
+                failed[key] = viewed_at
+        dropped = min(len(failed), max(0, len(failed) + len(_pending) - VIEW_BUFFER_MAX_PENDING))
+        for _ in range(dropped):
+            failed.popitem(last=False)
+        failed.update(_pending)
+        _pending.clear()
+        _pending.update(failed)
+    if dropped:
+        audit_logger.error(f"View history buffer full - Dropped:{dropped}")
+    return dropped
+
+
+def _compact():
+    """保持期間を過ぎた閲覧履歴を集約・削除"""
+    from .models import db
+    from .engagement import compact_view_history
+    from .utils import audit_logger
+
+    with _app.app_context():
+        try:
+            archived = compact_view_history()
+            if archived:
+                audit_logger.info(f"View history compacted - Archived:{archived}")
+        except Exception as e:
+            db.session.rollback()
+            audit_logger.error(f"View history compaction failed: {e}")
+        finally:
+            db.session.remove()
+
+
+def _run():
+    from .config import VIEW_FLUSH_INTERVAL_SECONDS
+
+    last_compaction = None
+    while True:
+        _flush_requested.wait(VIEW_FLUSH_INTERVAL_SECONDS)
+        _flush_requested.clear()
+        flush_view_buffer()
+
+        # 閲覧履歴の書き込みと同じスレッドで1日1回、保持期間を過ぎた閲覧履歴を集約・削除
+        if last_compaction is None or time.monotonic() - last_compaction >= VIEW_COMPACTION_INTERVAL_SECONDS:
+            last_compaction = time.monotonic()
+            _compact()
@@ -23,6 +23,9 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app import create_app
 from app.models import db, Knowledge, Comment, Like, CommentLike, Attachment, Tag, ViewHistory
+from app.search import rebuild_search_index
+from app.engagement import reconcile_engagement_counters, rebuild_daily_stats, rebuild_trending_scores
+from app.readers import rebuild_reader_sketches
 
 def create_test_data():
     """包括的なテストデータを作成"""
@@ -1818,7 +1821,7 @@ def login():
                         existing_view = ViewHistory.query.filter(
                             ViewHistory.user_id == user,
                             ViewHistory.knowledge_id == article.id,
-                            db.func.date(ViewHistory.viewed_at) == view_date.date()
+                            ViewHistory.view_date == view_date.date()
                         ).first()
                         
                         if not existing_view:
@@ -1834,7 +1837,8 @@ def login():
                             view_history = ViewHistory(
                                 user_id=user,
                                 knowledge_id=article.id,
-                                viewed_at=view_time
+                                viewed_at=view_time,
+                                view_date=view_time.date()
                             )
                             db.session.add(view_history)
                             total_views += 1
@@ -1842,6 +1846,17 @@ def login():
         db.session.commit()
         print(f"   ✅ {total_views}件の閲覧履歴を作成しました")
         
+        # 7. 検索インデックスの再構築（drop_all()では全文検索インデックスが削除されないため）
+        print("\n🔍 検索インデックスを再構築中...")
+        rebuild_search_index()
+        
+        # 8. 閲覧数・いいね数・コメント数の集計カラム・日別集計・閲覧者のスケッチ・トレンドスコアを更新（ORMで直接作成したため）
+        print("\n🔢 集計値を更新中...")
+        reconcile_engagement_counters()
+        rebuild_daily_stats()
+        rebuild_reader_sketches()
+        rebuild_trending_scores()
+        
         # 更新された統計情報の表示
         print("\n📊 作成されたテストデータの統計:")
         print(f"   📚 記事総数: {Knowledge.query.count()}件")
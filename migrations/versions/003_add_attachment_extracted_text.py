@@ -0,0 +1,28 @@
+"""Add extracted_text to Attachment for attachment full-text search
+
+Revision ID: 003_add_attachment_text
+Revises: 002_add_view_history
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '003_add_attachment_text'
+down_revision = '002_add_view_history'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 添付ファイルから抽出したテキスト（検索インデックス用）
+    # 既存の添付ファイルはアプリ起動時にバックグラウンドで抽出される
+    with op.batch_alter_table('attachment') as batch_op:
+        batch_op.add_column(sa.Column('extracted_text', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('attachment') as batch_op:
+        batch_op.drop_column('extracted_text')
@@ -0,0 +1,36 @@
+"""Add related_knowledge table for precomputed related articles
+
+Revision ID: 004_add_related_knowledge
+Revises: 003_add_attachment_text
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '004_add_related_knowledge'
+down_revision = '003_add_attachment_text'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 関連記事テーブル（TF-IDFのコサイン類似度上位k件を事前計算して保存）
+    # 内容はアプリ起動時または flask rebuild-related で構築される
+    op.create_table('related_knowledge',
+    sa.Column('knowledge_id', sa.Integer(), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.Column('related_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['knowledge_id'], ['knowledge.id'], ),
+    sa.ForeignKeyConstraint(['related_id'], ['knowledge.id'], ),
+    sa.PrimaryKeyConstraint('knowledge_id', 'rank')
+    )
+    op.create_index(op.f('ix_related_knowledge_related_id'), 'related_knowledge', ['related_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_related_knowledge_related_id'), table_name='related_knowledge')
+    op.drop_table('related_knowledge')
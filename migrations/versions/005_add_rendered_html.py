@@ -0,0 +1,37 @@
+"""Add rendered_html cache columns to knowledge and comment
+
+Revision ID: 005_add_rendered_html
+Revises: 004_add_related_knowledge
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '005_add_rendered_html'
+down_revision = '004_add_related_knowledge'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Markdownの描画結果のキャッシュ（記事・コメントの初回表示時に保存される）
+    with op.batch_alter_table('knowledge') as batch_op:
+        batch_op.add_column(sa.Column('rendered_html', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('rendered_key', sa.String(length=100), nullable=True))
+
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.add_column(sa.Column('rendered_html', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('rendered_key', sa.String(length=100), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.drop_column('rendered_key')
+        batch_op.drop_column('rendered_html')
+
+    with op.batch_alter_table('knowledge') as batch_op:
+        batch_op.drop_column('rendered_key')
+        batch_op.drop_column('rendered_html')
@@ -0,0 +1,67 @@
+"""Add excerpt to knowledge for listing pages
+
+Revision ID: 006_add_knowledge_excerpt
+Revises: 005_add_rendered_html
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '006_add_knowledge_excerpt'
+down_revision = '005_add_rendered_html'
+branch_labels = None
+depends_on = None
+
+# app.utils.make_excerpt と同じ規則（マイグレーションはアプリのコードに依存させない）
+EXCERPT_MAX_LINES = 5
+EXCERPT_MAX_LENGTH = 1000
+BATCH_SIZE = 500
+
+
+def make_excerpt(content):
+    if not content:
+        return ''
+    lines = content.split('\n', EXCERPT_MAX_LINES)
+    truncated = len(lines) > EXCERPT_MAX_LINES
+    excerpt = '\n'.join(lines[:EXCERPT_MAX_LINES])
+    if len(excerpt) > EXCERPT_MAX_LENGTH:
+        excerpt = excerpt[:EXCERPT_MAX_LENGTH]
+        truncated = True
+    return excerpt + '\n...' if truncated else excerpt
+
+
+def upgrade():
+    # 一覧表示用の抜粋（保存時に作成、一覧では本文を読み込まない）
+    with op.batch_alter_table('knowledge') as batch_op:
+        batch_op.add_column(sa.Column('excerpt', sa.Text(), nullable=True))
+
+    # 既存記事の抜粋をID順にバッチで作成
+    connection = op.get_bind()
+    knowledge = sa.table('knowledge',
+        sa.column('id', sa.Integer),
+        sa.column('content', sa.Text),
+        sa.column('excerpt', sa.Text)
+    )
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(knowledge.c.id, knowledge.c.content)
+            .where(knowledge.c.id > last_id)
+            .order_by(knowledge.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(
+            knowledge.update().where(knowledge.c.id == sa.bindparam('knowledge_id')),
+            [{'knowledge_id': row.id, 'excerpt': make_excerpt(row.content)} for row in rows]
+        )
+        last_id = rows[-1].id
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge') as batch_op:
+        batch_op.drop_column('excerpt')
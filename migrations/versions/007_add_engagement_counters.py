@@ -0,0 +1,49 @@
+"""Add denormalized engagement counters to knowledge and comment
+
+Revision ID: 007_add_engagement_counters
+Revises: 006_add_knowledge_excerpt
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '007_add_engagement_counters'
+down_revision = '006_add_knowledge_excerpt'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 閲覧数・いいね数・コメント数の集計カラム（書き込み時に原子的に更新）
+    with op.batch_alter_table('knowledge') as batch_op:
+        batch_op.add_column(sa.Column('view_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.add_column(sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+
+    # 既存データの件数で初期化
+    op.execute("""
+        UPDATE knowledge SET
+            view_count = (SELECT COUNT(*) FROM view_history WHERE view_history.knowledge_id = knowledge.id),
+            like_count = (SELECT COUNT(*) FROM "like" WHERE "like".knowledge_id = knowledge.id),
+            comment_count = (SELECT COUNT(*) FROM comment WHERE comment.knowledge_id = knowledge.id)
+    """)
+    op.execute("""
+        UPDATE comment SET
+            like_count = (SELECT COUNT(*) FROM comment_like WHERE comment_like.comment_id = comment.id)
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.drop_column('like_count')
+
+    with op.batch_alter_table('knowledge') as batch_op:
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('like_count')
+        batch_op.drop_column('view_count')
@@ -0,0 +1,72 @@
+"""Add knowledge_daily_stats rollup for windowed engagement statistics
+
+Revision ID: 008_add_knowledge_daily_stats
+Revises: 007_add_engagement_counters
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '008_add_knowledge_daily_stats'
+down_revision = '007_add_engagement_counters'
+branch_labels = None
+depends_on = None
+
+# 既存データの集計で1回に処理する記事IDの範囲
+CHUNK_SIZE = 500
+
+
+def upgrade():
+    # 記事ごと・日ごと（UTC）の閲覧・いいね・コメント数（書き込み時に加算）
+    op.create_table('knowledge_daily_stats',
+    sa.Column('knowledge_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('views', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('likes', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('comments', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['knowledge_id'], ['knowledge.id'], ),
+    sa.PrimaryKeyConstraint('knowledge_id', 'day')
+    )
+    op.create_index(op.f('ix_knowledge_daily_stats_day'), 'knowledge_daily_stats', ['day'], unique=False)
+
+    # 既存の閲覧履歴・いいね・コメントから記事IDの範囲ごとに集計
+    connection = op.get_bind()
+    stats = sa.table('knowledge_daily_stats',
+        sa.column('knowledge_id', sa.Integer), sa.column('day', sa.Date),
+        sa.column('views', sa.Integer), sa.column('likes', sa.Integer), sa.column('comments', sa.Integer)
+    )
+    sources = [
+        (sa.table('view_history', sa.column('knowledge_id', sa.Integer), sa.column('viewed_at', sa.DateTime)), 'viewed_at', 'views'),
+        (sa.table('like', sa.column('knowledge_id', sa.Integer), sa.column('created_at', sa.DateTime)), 'created_at', 'likes'),
+        (sa.table('comment', sa.column('knowledge_id', sa.Integer), sa.column('created_at', sa.DateTime)), 'created_at', 'comments'),
+    ]
+    max_id = connection.execute(sa.text('SELECT MAX(id) FROM knowledge')).scalar() or 0
+
+    for first_id in range(1, max_id + 1, CHUNK_SIZE):
+        last_id = first_id + CHUNK_SIZE - 1
+        selects = []
+        for table, timestamp, column in sources:
+            day = sa.func.date(table.c[timestamp])
+            counts = {name: sa.literal(0) for name in ('views', 'likes', 'comments')}
+            counts[column] = sa.func.count()
+            selects.append(sa.select(
+                table.c.knowledge_id.label('knowledge_id'),
+                day.label('day'),
+                *[value.label(name) for name, value in counts.items()]
+            ).where(table.c.knowledge_id.between(first_id, last_id)).group_by(table.c.knowledge_id, day))
+        events = sa.union_all(*selects).subquery()
+        connection.execute(stats.insert().from_select(
+            ['knowledge_id', 'day', 'views', 'likes', 'comments'],
+            sa.select(
+                events.c.knowledge_id, events.c.day,
+                sa.func.sum(events.c.views), sa.func.sum(events.c.likes), sa.func.sum(events.c.comments)
+            ).group_by(events.c.knowledge_id, events.c.day)
+        ))
+
+
+def downgrade():
+    op.drop_index(op.f('ix_knowledge_daily_stats_day'), table_name='knowledge_daily_stats')
+    op.drop_table('knowledge_daily_stats')
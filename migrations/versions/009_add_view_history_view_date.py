@@ -0,0 +1,74 @@
+"""Add view_date to view_history with a unique daily view constraint
+
+Revision ID: 009_add_view_date
+Revises: 008_add_knowledge_daily_stats
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '009_add_view_date'
+down_revision = '008_add_knowledge_daily_stats'
+branch_labels = None
+depends_on = None
+
+# 既存データの閲覧日の設定で1回に処理する閲覧履歴IDの範囲
+CHUNK_SIZE = 5000
+
+
+def upgrade():
+    with op.batch_alter_table('view_history') as batch_op:
+        batch_op.add_column(sa.Column('view_date', sa.Date(), nullable=True))
+
+    connection = op.get_bind()
+    view_history = sa.table('view_history',
+        sa.column('id', sa.Integer), sa.column('user_id', sa.String), sa.column('knowledge_id', sa.Integer),
+        sa.column('viewed_at', sa.DateTime), sa.column('view_date', sa.Date)
+    )
+
+    # 既存の閲覧履歴の閲覧日を閲覧日時から設定（IDの範囲ごと）
+    max_id = connection.execute(sa.select(sa.func.max(view_history.c.id))).scalar() or 0
+    for first_id in range(1, max_id + 1, CHUNK_SIZE):
+        connection.execute(view_history.update().where(
+            view_history.c.id.between(first_id, first_id + CHUNK_SIZE - 1)
+        ).values(view_date=sa.func.date(view_history.c.viewed_at)))
+
+    # 同時リクエストで重複した同じ日の閲覧を削除し（最初の1件を残す）、集計値から差し引く
+    duplicates = connection.execute(sa.select(
+        view_history.c.knowledge_id, view_history.c.view_date, (sa.func.count() - 1).label('extra')
+    ).group_by(
+        view_history.c.user_id, view_history.c.knowledge_id, view_history.c.view_date
+    ).having(sa.func.count() > 1)).all()
+    if duplicates:
+        keep_ids = sa.select(sa.func.min(view_history.c.id)).group_by(
+            view_history.c.user_id, view_history.c.knowledge_id, view_history.c.view_date
+        )
+        connection.execute(view_history.delete().where(view_history.c.id.notin_(keep_ids.scalar_subquery())))
+
+        knowledge = sa.table('knowledge', sa.column('id', sa.Integer), sa.column('view_count', sa.Integer))
+        stats = sa.table('knowledge_daily_stats',
+            sa.column('knowledge_id', sa.Integer), sa.column('day', sa.Date), sa.column('views', sa.Integer)
+        )
+        for row in duplicates:
+            connection.execute(knowledge.update().where(knowledge.c.id == row.knowledge_id).values(
+                view_count=knowledge.c.view_count - row.extra
+            ))
+            connection.execute(stats.update().where(
+                stats.c.knowledge_id == row.knowledge_id, stats.c.day == row.view_date
+            ).values(views=stats.c.views - row.extra))
+
+    # 日付関数を使わずに検索できる一意制約に置き換え
+    op.drop_index('idx_view_history_user_knowledge_date', table_name='view_history')
+    with op.batch_alter_table('view_history') as batch_op:
+        batch_op.alter_column('view_date', existing_type=sa.Date(), nullable=False)
+        batch_op.create_unique_constraint('unique_user_knowledge_view_date', ['user_id', 'knowledge_id', 'view_date'])
+
+
+def downgrade():
+    with op.batch_alter_table('view_history') as batch_op:
+        batch_op.drop_constraint('unique_user_knowledge_view_date', type_='unique')
+        batch_op.drop_column('view_date')
+    op.create_index('idx_view_history_user_knowledge_date', 'view_history', ['user_id', 'knowledge_id', 'viewed_at'])
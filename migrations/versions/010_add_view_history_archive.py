@@ -0,0 +1,31 @@
+"""Add view_history_archive for view history retention
+
+Revision ID: 010_add_view_history_archive
+Revises: 009_add_view_date
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '010_add_view_history_archive'
+down_revision = '009_add_view_date'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 保持期間を過ぎて削除した閲覧履歴の記事ごと・日ごとの件数
+    op.create_table('view_history_archive',
+    sa.Column('knowledge_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('views', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['knowledge_id'], ['knowledge.id'], ),
+    sa.PrimaryKeyConstraint('knowledge_id', 'day')
+    )
+
+
+def downgrade():
+    op.drop_table('view_history_archive')
@@ -0,0 +1,73 @@
+"""Add knowledge_daily_readers HyperLogLog sketches for unique reader counts
+
+Revision ID: 011_add_knowledge_daily_readers
+Revises: 010_add_view_history_archive
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import hashlib
+import zlib
+from collections import defaultdict
+
+
+# revision identifiers, used by Alembic.
+revision = '011_add_knowledge_daily_readers'
+down_revision = '010_add_view_history_archive'
+branch_labels = None
+depends_on = None
+
+# app/readers.py と同じ精度（レジスタ数 2048）
+HLL_PRECISION = 11
+
+# 既存データの集計で1回に処理する記事IDの範囲
+CHUNK_SIZE = 500
+
+
+def add_to_registers(registers, user_id):
+    value = int.from_bytes(hashlib.blake2b(user_id.encode('utf-8'), digest_size=8).digest(), 'big')
+    index = value >> (64 - HLL_PRECISION)
+    remaining = value & ((1 << (64 - HLL_PRECISION)) - 1)
+    rank = (64 - HLL_PRECISION) - remaining.bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+def upgrade():
+    # 記事ごと・日ごと（UTC）の閲覧ユーザーのHyperLogLogスケッチ（zlib圧縮）
+    op.create_table('knowledge_daily_readers',
+    sa.Column('knowledge_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('sketch', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['knowledge_id'], ['knowledge.id'], ),
+    sa.PrimaryKeyConstraint('knowledge_id', 'day')
+    )
+    op.create_index(op.f('ix_knowledge_daily_readers_day'), 'knowledge_daily_readers', ['day'], unique=False)
+
+    # 既存の閲覧履歴から記事IDの範囲ごとに作成
+    connection = op.get_bind()
+    readers = sa.table('knowledge_daily_readers',
+        sa.column('knowledge_id', sa.Integer), sa.column('day', sa.Date), sa.column('sketch', sa.LargeBinary)
+    )
+    view_history = sa.table('view_history',
+        sa.column('knowledge_id', sa.Integer), sa.column('view_date', sa.Date), sa.column('user_id', sa.String)
+    )
+    max_id = connection.execute(sa.text('SELECT MAX(id) FROM knowledge')).scalar() or 0
+
+    for first_id in range(1, max_id + 1, CHUNK_SIZE):
+        registers_by_key = defaultdict(lambda: bytearray(1 << HLL_PRECISION))
+        for row in connection.execute(sa.select(
+            view_history.c.knowledge_id, view_history.c.view_date, view_history.c.user_id
+        ).where(view_history.c.knowledge_id.between(first_id, first_id + CHUNK_SIZE - 1))):
+            add_to_registers(registers_by_key[(row.knowledge_id, row.view_date)], row.user_id)
+        if registers_by_key:
+            connection.execute(readers.insert(), [
+                {'knowledge_id': knowledge_id, 'day': day, 'sketch': zlib.compress(bytes(registers))}
+                for (knowledge_id, day), registers in registers_by_key.items()
+            ])
+
+
+def downgrade():
+    op.drop_index(op.f('ix_knowledge_daily_readers_day'), table_name='knowledge_daily_readers')
+    op.drop_table('knowledge_daily_readers')
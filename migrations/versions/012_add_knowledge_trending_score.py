@@ -0,0 +1,85 @@
+"""Add trending_score to knowledge
+
+Revision ID: 012_add_trending_score
+Revises: 011_add_knowledge_daily_readers
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import math
+import os
+from datetime import datetime, timezone
+
+
+# revision identifiers, used by Alembic.
+revision = '012_add_trending_score'
+down_revision = '011_add_knowledge_daily_readers'
+branch_labels = None
+depends_on = None
+
+# app/engagement.py と同じ重み・基準時刻、app/config.py と同じ半減期
+TRENDING_WEIGHTS = {'views': 1.0, 'likes': 3.0, 'comments': 5.0}
+TRENDING_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', '24'))
+
+# 既存データの集計で1回に処理する記事IDの範囲
+CHUNK_SIZE = 500
+
+
+def contribution(metric, at, count=1):
+    if isinstance(at, str):
+        at = datetime.fromisoformat(at)
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    exponent = (at - TRENDING_EPOCH).total_seconds() / 3600 / TRENDING_HALF_LIFE_HOURS
+    return math.log2(TRENDING_WEIGHTS[metric] * count) + exponent
+
+
+def add_log2(a, b):
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def upgrade():
+    with op.batch_alter_table('knowledge') as batch_op:
+        batch_op.add_column(sa.Column('trending_score', sa.Float(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_knowledge_trending_score'), ['trending_score'], unique=False)
+
+    # 既存の閲覧履歴・いいね・コメントから記事IDの範囲ごとに計算
+    connection = op.get_bind()
+    knowledge = sa.table('knowledge', sa.column('id', sa.Integer), sa.column('trending_score', sa.Float))
+    sources = [
+        (sa.table('view_history', sa.column('knowledge_id', sa.Integer), sa.column('viewed_at', sa.DateTime)), 'viewed_at', 'views'),
+        (sa.table('like', sa.column('knowledge_id', sa.Integer), sa.column('created_at', sa.DateTime)), 'created_at', 'likes'),
+        (sa.table('comment', sa.column('knowledge_id', sa.Integer), sa.column('created_at', sa.DateTime)), 'created_at', 'comments'),
+    ]
+    archive = sa.table('view_history_archive',
+        sa.column('knowledge_id', sa.Integer), sa.column('day', sa.Date), sa.column('views', sa.Integer)
+    )
+    max_id = connection.execute(sa.text('SELECT MAX(id) FROM knowledge')).scalar() or 0
+
+    for first_id in range(1, max_id + 1, CHUNK_SIZE):
+        last_id = first_id + CHUNK_SIZE - 1
+        scores = {}
+        for table, timestamp, metric in sources:
+            for row in connection.execute(sa.select(table.c.knowledge_id, table.c[timestamp]).where(
+                table.c.knowledge_id.between(first_id, last_id), table.c[timestamp].isnot(None)
+            )):
+                scores[row[0]] = add_log2(scores.get(row[0]), contribution(metric, row[1]))
+        for row in connection.execute(sa.select(archive.c.knowledge_id, archive.c.day, archive.c.views).where(
+            archive.c.knowledge_id.between(first_id, last_id), archive.c.views > 0
+        )):
+            noon = datetime(row.day.year, row.day.month, row.day.day, 12)
+            scores[row.knowledge_id] = add_log2(scores.get(row.knowledge_id), contribution('views', noon, row.views))
+
+        for knowledge_id, score in scores.items():
+            connection.execute(knowledge.update().where(knowledge.c.id == knowledge_id).values(trending_score=score))
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_knowledge_trending_score'))
+        batch_op.drop_column('trending_score')
@@ -0,0 +1,27 @@
+"""Add (is_draft, created_at, id) / (is_draft, updated_at, id) indexes for keyset pagination
+
+Revision ID: 013_add_listing_indexes
+Revises: 012_add_trending_score
+Create Date: 2026-10-17 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '013_add_listing_indexes'
+down_revision = '012_add_trending_score'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 記事一覧（作成日時順）・最新記事API（更新日時順）のカーソル位置から索引で読み始めるための索引
+    op.create_index('idx_knowledge_draft_created_id', 'knowledge', ['is_draft', 'created_at', 'id'])
+    op.create_index('idx_knowledge_draft_updated_id', 'knowledge', ['is_draft', 'updated_at', 'id'])
+
+
+def downgrade():
+    op.drop_index('idx_knowledge_draft_updated_id', table_name='knowledge')
+    op.drop_index('idx_knowledge_draft_created_id', table_name='knowledge')
@@ -0,0 +1,81 @@
+"""
+テスト共通設定
+
+データベース・アップロード・監査ログを一時ディレクトリに作成し、アプリケーションを1回だけ作成する。
+閲覧履歴はバッファを使わず閲覧ごとに書き込む（VIEW_FLUSH_INTERVAL_SECONDS=0）。
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_work_dir = tempfile.mkdtemp(prefix='knowledge-test-')
+atexit.register(shutil.rmtree, _work_dir, ignore_errors=True)
+
+# app.config はインポート時に環境変数を読むため、アプリケーションのインポート前に設定する
+os.environ['DATABASE_DIR'] = os.path.join(_work_dir, 'db')
+os.environ['UPLOAD_DIR'] = os.path.join(_work_dir, 'uploads')
+os.environ['AUDIT_LOG_DIR'] = os.path.join(_work_dir, 'logs')
+os.environ['VIEW_FLUSH_INTERVAL_SECONDS'] = '0'
+os.environ.pop('API_KEY', None)
+
+sys.path.insert(0, ROOT_DIR)
+
+
+@pytest.fixture(scope='session')
+def app():
+    # マイグレーションはリポジトリ直下の migrations ディレクトリを使う
+    os.chdir(ROOT_DIR)
+    from app import create_app
+    return create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def create_article(client):
+    """記事を投稿して記事IDを返す"""
+    from app.models import Knowledge
+
+    def create(title, content, tags='', author='alice'):
+        response = client.post('/create', data={'title': title, 'content': content, 'tags': tags},
+                               headers={'X-User-ID': author})
+        assert response.status_code == 302
+        with client.application.app_context():
+            return Knowledge.query.filter_by(title=title).order_by(Knowledge.id.desc()).first().id
+
+    return create
+
+
+@pytest.fixture
+def count_statements(app, client):
+    """GETリクエスト1回で実行されたSQL文の数を返す（バックグラウンドのワーカーのクエリは数えない）"""
+    import threading
+    from sqlalchemy import event
+    from app.models import db
+
+    def count(url, headers=None):
+        statements = []
+        thread_id = threading.get_ident()
+
+        def record(*args):
+            if threading.get_ident() == thread_id:
+                statements.append(args[2])
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            assert client.get(url, headers=headers).status_code == 200
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        return len(statements)
+
+    return count
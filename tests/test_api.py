@@ -0,0 +1,63 @@
+def test_search_returns_each_article_once(client, create_article):
+    ids = [
+        create_article('検索テスト 一', 'zebracorn の記事 その1'),
+        create_article('検索テスト 二', 'zebracorn の記事 その2'),
+        create_article('検索テスト 三', 'zebracorn の記事 その3'),
+    ]
+
+    response = client.get('/api/v1/search?q=zebracorn&limit=10')
+    assert response.status_code == 200
+    data = response.get_json()['data']
+
+    returned_ids = [article['id'] for article in data['articles']]
+    assert len(returned_ids) == 3
+    assert sorted(returned_ids) == sorted(ids)
+    assert data['pagination']['total'] == 3
+    assert all('score' in article and 'snippet' in article for article in data['articles'])
+
+
+def test_article_attachment_count_and_tags(client, create_article):
+    import io
+
+    article_id = create_article('API添付テスト', 'okapiattach の本文', tags='API添付')
+    client.post(f'/edit/{article_id}', data={
+        'title': 'API添付テスト', 'content': 'okapiattach の本文', 'tags': 'API添付',
+        'attachments': (io.BytesIO(b'hello'), 'note.txt')
+    }, headers={'X-User-ID': 'alice'}, content_type='multipart/form-data')
+
+    article = client.get(f'/api/v1/articles/{article_id}').get_json()['data']
+    assert article['attachment_count'] == 1
+    assert [tag['name'] for tag in article['tags']] == ['API添付']
+
+    listed = client.get('/api/v1/search?q=okapiattach').get_json()['data']['articles']
+    assert [(item['id'], item['attachment_count']) for item in listed] == [(article_id, 1)]
+    assert [tag['name'] for tag in listed[0]['tags']] == ['API添付']
+
+
+def test_latest_query_count_does_not_depend_on_limit(create_article, count_statements):
+    for i in range(6):
+        create_article(f'件数テスト {i}', '本文', tags=f'件数{i}')
+
+    # 記事ごとの添付ファイル数・タグの取得はまとめて行う（N+1にならない）
+    assert count_statements('/api/v1/articles/latest?limit=1') == count_statements('/api/v1/articles/latest?limit=6')
+
+
+def test_article_with_comments_query_count_does_not_depend_on_comments(client, create_article, count_statements):
+    from app.models import Comment
+
+    few = create_article('コメント件数テスト 少', '本文')
+    many = create_article('コメント件数テスト 多', '本文')
+    for article_id, comment_count in ((few, 1), (many, 5)):
+        for i in range(comment_count):
+            client.post(f'/comment/{article_id}', data={'content': f'コメント {i}'}, headers={'X-User-ID': 'bobby'})
+    with client.application.app_context():
+        comment_ids = [comment.id for comment in Comment.query.filter_by(knowledge_id=many)]
+    for comment_id in comment_ids:
+        client.post(f'/comment/like/{comment_id}', headers={'X-User-ID': 'alice'})
+
+    data = client.get(f'/api/v1/articles/{many}').get_json()['data']
+    assert data['comment_count'] == 5
+    assert [comment['like_count'] for comment in data['comments']] == [1] * 5
+
+    # コメント・コメントのいいね数の取得はコメント数によらない
+    assert count_statements(f'/api/v1/articles/{few}') == count_statements(f'/api/v1/articles/{many}')
@@ -0,0 +1,37 @@
+import os
+
+
+def test_startup_extracts_only_text_attachments(app, client, create_article, monkeypatch):
+    from app import extraction
+    from app.models import db, Attachment
+
+    knowledge_id = create_article('添付ファイル抽出 テスト', '本文')
+    # 他のテストでアップロードした添付ファイルの抽出を済ませ、以降の追加時はワーカーに投入しない
+    extraction._executor.submit(lambda: None).result()
+    monkeypatch.setattr(extraction, '_app', None)
+    with app.app_context():
+        for stored_filename, filename, content in (
+            ('startup-notes.txt', 'notes.TXT', b'quokkaberry meeting notes'),
+            ('startup-image.png', 'image.png', b'\x89PNG'),
+        ):
+            with open(os.path.join(app.config['UPLOAD_FOLDER'], stored_filename), 'wb') as f:
+                f.write(content)
+            db.session.add(Attachment(
+                filename=filename, stored_filename=stored_filename, file_size=len(content),
+                mime_type='application/octet-stream', knowledge_id=knowledge_id, uploaded_by='alice'
+            ))
+        db.session.commit()
+
+    scheduled = []
+    monkeypatch.setattr(extraction, 'schedule_text_extraction', scheduled.append)
+    extraction.init_text_extraction(app)
+    monkeypatch.undo()
+
+    with app.app_context():
+        ids = {a.filename: a.id for a in Attachment.query.filter_by(knowledge_id=knowledge_id)}
+    assert scheduled == [ids['notes.TXT']]
+
+    # 抽出結果は保存時のイベントで検索インデックスに反映される
+    extraction._run_extraction(ids['notes.TXT'])
+    data = client.get('/api/v1/search?q=quokkaberry').get_json()['data']
+    assert [article['id'] for article in data['articles']] == [knowledge_id]
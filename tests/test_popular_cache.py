@@ -0,0 +1,66 @@
+import threading
+import time
+
+
+def test_concurrent_misses_compute_once(monkeypatch):
+    from app import popular_cache
+
+    popular_cache.clear_popular_cache()
+    calls = []
+
+    def compute(days, limit):
+        calls.append((days, limit))
+        time.sleep(0.2)
+        return {'views': [(1, 10)]}
+    monkeypatch.setattr(popular_cache, '_compute', compute)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(popular_cache.get_cached_popular_rankings(5, days=7)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [(7, 5)]
+    assert results == [{'views': [(1, 10)]}] * 5
+    stats = popular_cache.get_popular_cache_stats()
+    assert stats['misses'] == 1
+    assert stats['miss_waits'] == 4
+
+
+def test_waiting_request_recomputes_when_the_first_computation_fails(monkeypatch):
+    from app import popular_cache
+
+    popular_cache.clear_popular_cache()
+    calls = []
+    started = threading.Event()
+
+    def compute(days, limit):
+        calls.append(threading.get_ident())
+        if len(calls) == 1:
+            started.set()
+            time.sleep(0.2)
+            raise RuntimeError('ranking query failed')
+        return {'views': []}
+    monkeypatch.setattr(popular_cache, '_compute', compute)
+
+    outcome = {}
+
+    def first():
+        try:
+            popular_cache.get_cached_popular_rankings(3, days=30)
+        except RuntimeError:
+            outcome['first'] = 'failed'
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    started.wait(5)
+    # 計算中のリクエストが失敗したら、待っていたリクエストが計算する
+    outcome['second'] = popular_cache.get_cached_popular_rankings(3, days=30)
+    thread.join()
+
+    assert outcome == {'first': 'failed', 'second': {'views': []}}
+    assert len(calls) == 2
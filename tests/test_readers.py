@@ -0,0 +1,23 @@
+from datetime import date
+
+
+def test_record_readers_merges_into_existing_sketch(app, create_article):
+    from app.models import db, KnowledgeDailyReaders
+    from app.readers import record_readers, decode_sketch, estimate_cardinality, encode_sketch, add_to_registers, HLL_REGISTERS
+
+    knowledge_id = create_article('閲覧者スケッチ テスト', '本文')
+    day = date(2026, 1, 1)
+    with app.app_context():
+        # 別のプロセスが先に同じ記事・日のスケッチを作成していた場合
+        registers = bytearray(HLL_REGISTERS)
+        add_to_registers(registers, 'other-process-user')
+        db.session.add(KnowledgeDailyReaders(knowledge_id=knowledge_id, day=day, sketch=encode_sketch(registers)))
+        db.session.commit()
+
+        record_readers([(knowledge_id, day, 'user-a'), (knowledge_id, day, 'user-b')])
+        record_readers([(knowledge_id, date(2026, 1, 2), 'user-a')])
+        db.session.commit()
+
+        sketches = {row.day: row.sketch for row in KnowledgeDailyReaders.query.filter_by(knowledge_id=knowledge_id)}
+        assert estimate_cardinality(decode_sketch(sketches[day])) == 3
+        assert estimate_cardinality(decode_sketch(sketches[date(2026, 1, 2)])) == 1
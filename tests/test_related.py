@@ -0,0 +1,153 @@
+def _wait_for_worker():
+    from app.related import _executor
+    _executor.submit(lambda: None).result()
+
+
+def _saved_neighbours():
+    from app.models import RelatedKnowledge
+    saved = {}
+    for entry in RelatedKnowledge.query.order_by(RelatedKnowledge.knowledge_id, RelatedKnowledge.rank):
+        saved.setdefault(entry.knowledge_id, []).append((entry.related_id, entry.score))
+    return saved
+
+
+def _scores(neighbours):
+    # 同点の記事の順序は計算ごとに異なりうるため、類似度の並びで比較する
+    return {knowledge_id: [round(score, 5) for _, score in items] for knowledge_id, items in neighbours.items()}
+
+
+def test_incremental_update_matches_recomputation(app, client, create_article, monkeypatch):
+    from app import related
+    from app.models import db, Knowledge
+    from app.config import RELATED_ARTICLES_COUNT
+
+    topics = ['python flask routing', 'python numpy array', 'sqlite index query', 'flask template jinja', 'numpy matrix python']
+    monkeypatch.setattr(related.RelatedModel, 'REFIT_MIN_DOCUMENTS', 0)
+    ids = [create_article(f'関連テスト {i}', f'{topics[i % 5]} {topics[(i + 1) % 5]} note{i % 3}') for i in range(20)]
+    _wait_for_worker()
+
+    with app.app_context():
+        related.rebuild_related_articles()
+        model = related._model
+
+        # 既存の語彙の範囲で本文を変更し、1件を非公開にする
+        article = db.session.get(Knowledge, ids[0])
+        article.content = 'sqlite index query sqlite index'
+        db.session.get(Knowledge, ids[1]).is_draft = True
+        db.session.commit()
+        _wait_for_worker()
+
+        # 差分更新では全記事を読み込まない
+        def load_all():
+            raise AssertionError('update_related_articles loaded every article')
+        with monkeypatch.context() as patch:
+            patch.setattr(related, '_load_documents', load_all)
+            related.update_related_articles({ids[0], ids[1]})
+        assert related._model is model
+        assert ids[1] not in model
+
+        expected = {}
+        for knowledge_id in model.ids.tolist() + list(model._changes):
+            if knowledge_id in model:
+                top = model.top_k(knowledge_id, RELATED_ARTICLES_COUNT)
+                if top:
+                    expected[knowledge_id] = top
+        saved = _saved_neighbours()
+        assert _scores(saved) == _scores(expected)
+        assert all(ids[1] != related_id for items in saved.values() for related_id, _ in items)
+
+
+def test_vocabulary_is_refitted_after_growth(app, client, create_article, monkeypatch):
+    from app import related
+
+    monkeypatch.setattr(related.RelatedModel, 'REFIT_MIN_DOCUMENTS', 0)
+    with app.app_context():
+        related.rebuild_related_articles()
+        model = related._model
+        fitted_count = model.fitted_count
+
+    # 語彙作成時の記事数から REFIT_GROWTH_RATIO を超えて増えたら語彙・IDFを作り直す
+    for i in range(int(fitted_count * related.RelatedModel.REFIT_GROWTH_RATIO) + 1):
+        create_article(f'新しい話題 {i}', 'kubernetes helm chart deploy')
+    _wait_for_worker()
+
+    assert related._model is not model
+    assert 'kubernetes' in related._model.vocabulary
+
+
+def test_deleted_article_is_removed_from_model_and_lists(app, client, create_article, monkeypatch):
+    from app import related
+    from app.models import RelatedKnowledge
+
+    monkeypatch.setattr(related.RelatedModel, 'REFIT_MIN_DOCUMENTS', 0)
+    ids = [create_article(f'削除テスト {i}', f'walrus harbor ferry note{i % 2}') for i in range(6)]
+    _wait_for_worker()
+    with app.app_context():
+        related.rebuild_related_articles()
+        model = related._model
+        assert RelatedKnowledge.query.filter(RelatedKnowledge.related_id == ids[0]).count() > 0
+
+    # 他の記事の一覧に含まれている記事を削除
+    response = client.get(f'/delete/{ids[0]}', headers={'X-User-ID': 'alice'})
+    assert response.status_code == 302
+    _wait_for_worker()
+
+    with app.app_context():
+        assert related._model is model
+        assert ids[0] not in model
+        assert RelatedKnowledge.query.filter(
+            (RelatedKnowledge.related_id == ids[0]) | (RelatedKnowledge.knowledge_id == ids[0])
+        ).count() == 0
+        # 一覧を含んでいた記事は残りの記事で再計算されている
+        assert RelatedKnowledge.query.filter(RelatedKnowledge.knowledge_id == ids[1]).count() > 0
+
+
+def test_top_k_neighbours_matches_dense_similarities():
+    import numpy as np
+    from app.related import RelatedModel, top_k_neighbours
+
+    words = ['alpha', 'beta', 'gamma', 'delta', 'omega', 'sigma']
+    token_lists = [[words[i % 6], words[(i * 2) % 6], words[(i + 3) % 6]] * (1 + i % 2) for i in range(15)]
+    token_lists[4] = ['unique']  # 語彙に含まれる語のない記事（空の行）
+    ids = list(range(100, 115))
+    model = RelatedModel(np, ids, token_lists)
+
+    dense = model.dense_rows(0, len(ids))
+    similarities = dense @ dense.T
+    np.fill_diagonal(similarities, -1.0)
+
+    # バッチ・チャンクを小さくして区切りをまたぐ場合も密行列の結果と一致する
+    neighbours = top_k_neighbours(model, 4, batch_size=4, chunk_size=3)
+    assert sorted(neighbours) == ids
+    for row, knowledge_id in enumerate(ids):
+        expected = sorted((score for score in similarities[row] if score > 0), reverse=True)[:4]
+        assert [round(score, 5) for _, score in neighbours[knowledge_id]] == [round(float(s), 5) for s in expected]
+        for related_id, score in neighbours[knowledge_id]:
+            assert abs(similarities[row, ids.index(related_id)] - score) < 1e-5
+    assert neighbours[104] == []
+
+
+def test_related_api_returns_similar_published_articles(app, client, create_article):
+    from app import related
+
+    base = create_article('関連API 火山', 'volcano magma eruption lava 観測')
+    similar = create_article('関連API 火山の記録', 'volcano magma eruption 記録')
+    draft = create_article('関連API 火山の下書き', 'volcano magma eruption lava 下書き')
+    client.post(f'/edit/{draft}', data={
+        'title': '関連API 火山の下書き', 'content': 'volcano magma eruption lava 下書き', 'save_draft': '1'
+    }, headers={'X-User-ID': 'alice'})
+    _wait_for_worker()
+    with app.app_context():
+        from app.models import db, Knowledge
+        assert db.session.get(Knowledge, draft).is_draft
+        related.rebuild_related_articles()
+
+    response = client.get(f'/api/v1/articles/{base}/related')
+    assert response.status_code == 200
+    articles = response.get_json()['data']['articles']
+    related_ids = [article['id'] for article in articles]
+    assert similar in related_ids
+    assert draft not in related_ids
+    assert all(article['score'] > 0 for article in articles)
+
+    assert client.get('/api/v1/articles/999999/related').status_code == 404
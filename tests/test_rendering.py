@@ -0,0 +1,85 @@
+import threading
+import time
+
+
+def _slow_document():
+    # ワーカーで1秒以上かかる長い本文
+    return '\n\n'.join(f'## 見出し{i}\n\n- **項目** {i} `code` [link](http://example.com/{i})' for i in range(6000))
+
+
+def _medium_document():
+    return '\n\n'.join(f'段落 {i} *強調* と `code`' for i in range(2000))
+
+
+def test_timeout_stops_only_the_timed_out_render(app):
+    from app.rendering import RenderWorkerPool
+
+    pool = RenderWorkerPool(2)
+    outcome = {}
+
+    def render_slow():
+        try:
+            pool.render(_slow_document(), timeout=0.2)
+        except TimeoutError:
+            outcome['slow'] = 'timeout'
+
+    def render_medium():
+        outcome['medium'] = pool.render(_medium_document(), timeout=60)
+
+    try:
+        threads = [threading.Thread(target=render_slow), threading.Thread(target=render_medium)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert outcome['slow'] == 'timeout'
+        assert outcome['medium'].startswith('<p>段落 0')
+        # 時間切れのワーカーは置き換えられ、以降の変換も行える
+        assert pool.render('**ok**', timeout=60) == '<p><strong>ok</strong></p>'
+    finally:
+        pool.shutdown()
+
+
+def test_waiting_for_a_worker_does_not_count_against_the_timeout(app):
+    from app.rendering import RenderWorkerPool
+
+    pool = RenderWorkerPool(1)
+    pool.render('warm up', timeout=60)
+    results = {}
+
+    def render_busy():
+        results['busy'] = pool.render(_slow_document(), timeout=60)
+
+    try:
+        busy = threading.Thread(target=render_busy)
+        busy.start()
+        time.sleep(0.2)
+        # 唯一のワーカーが使用中の間に投入し、待ち時間より短い制限時間でも変換できる
+        results['queued'] = pool.render('*queued*', timeout=2)
+        busy.join()
+
+        assert results['queued'] == '<p><em>queued</em></p>'
+        assert results['busy'].startswith('<h2>')
+    finally:
+        pool.shutdown()
+
+
+def test_fallback_is_not_cached(app, monkeypatch):
+    from app import rendering
+
+    calls = []
+
+    def convert(text, key=None):
+        calls.append(key)
+        if len(calls) == 1:
+            return rendering.fallback_html(text), False
+        return '<p>rendered</p>', True
+
+    monkeypatch.setattr(rendering, 'convert_markdown_with_timeout', convert)
+    text = 'fallback cache test'
+    key = rendering.get_cache_key(text)
+
+    assert rendering.render_markdown(text, key).startswith('<pre class="render-fallback">')
+    assert rendering.render_markdown(text, key) == '<p>rendered</p>'
+    assert len(calls) == 2
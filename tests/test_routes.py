@@ -0,0 +1,31 @@
+def test_index_facets_only_when_filtered(client, create_article, monkeypatch):
+    from app import routes
+
+    create_article('ファセットテスト', 'quokkafacet の本文', tags='ファセット')
+    calls = []
+    original = routes.get_facet_counts
+
+    def counting_facet_counts(query):
+        calls.append(query)
+        return original(query)
+    monkeypatch.setattr(routes, 'get_facet_counts', counting_facet_counts)
+
+    # 絞り込みなしは集計せず、使用回数順のタグ一覧を表示
+    response = client.get('/')
+    assert response.status_code == 200
+    assert 'ファセット (1)' in response.get_data(as_text=True)
+    assert calls == []
+
+    response = client.get('/?search=quokkafacet')
+    assert response.status_code == 200
+    assert 'ファセット (1)' in response.get_data(as_text=True)
+    assert len(calls) == 1
+
+
+def test_listing_query_count_does_not_depend_on_article_count(create_article, count_statements):
+    create_article('一覧件数テスト 単独', '本文', tags='一覧件数1')
+    for i in range(6):
+        create_article(f'一覧件数テスト {i}', '本文', tags='一覧件数6, 一覧件数その他')
+
+    # 件数・添付ファイル数・タグは1回のクエリで取得する（記事数によらない）
+    assert count_statements('/?tag=一覧件数1') == count_statements('/?tag=一覧件数6')
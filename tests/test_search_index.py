@@ -0,0 +1,102 @@
+import threading
+import time
+
+
+def test_ensure_built_builds_once():
+    from app.search_index import InvertedIndex
+
+    index = InvertedIndex()
+    builds = []
+
+    def build():
+        builds.append(threading.get_ident())
+        time.sleep(0.05)
+        index.add_document(1, {'title': 'テスト'})
+        index.is_built = True
+
+    threads = [threading.Thread(target=index.ensure_built, args=(build,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(builds) == 1
+    assert index.search('テスト') == [1]
+
+
+def test_updates_during_build_are_applied_after_build():
+    from app.search_index import InvertedIndex
+
+    index = InvertedIndex()
+    # 未構築の間の更新は構築時に読み込まれるため反映しない
+    index.apply_update(lambda: index.add_document(9, {'title': '未構築'}))
+    assert len(index) == 0
+
+    def build():
+        # 構築の読み込み後にコミットされた更新（別スレッド）は待たずに保留される
+        index.clear()
+        index.add_document(1, {'title': '構築時の記事'})
+        committer = threading.Thread(target=index.apply_update, args=(
+            lambda: index.add_document(2, {'title': '構築中の記事'}),
+        ))
+        committer.start()
+        committer.join(timeout=5)
+        assert not committer.is_alive()
+        assert index.get_document(2) is None
+        index.is_built = True
+
+    index.ensure_built(build)
+    assert index.search('記事') == [1, 2]
+
+
+def test_memory_search_filter_is_capped(app, client, create_article, monkeypatch):
+    from app import search
+    from app.models import Knowledge
+
+    ids = [create_article(f'上限テスト {i}', 'capybaralimit の本文') for i in range(3)]
+    monkeypatch.setattr(search, '_backend', 'memory')
+    monkeypatch.setattr(search, 'MEMORY_FILTER_MAX_IDS', 2)
+    with app.app_context():
+        search.rebuild_search_index()
+        matched = Knowledge.query.filter(search.get_search_filter('capybaralimit')).order_by(Knowledge.id).all()
+        assert [article.id for article in matched] == ids[1:]
+
+        # 関連度順の検索は上限なし
+        total, results = search.search_ranked('capybaralimit', limit=10)
+        assert total == 3
+        assert sorted(result['id'] for result in results) == ids
+
+
+def test_memory_backend_follows_committed_changes(app, client, create_article, monkeypatch):
+    from app import search
+    from app.models import db, Knowledge
+
+    monkeypatch.setattr(search, '_backend', 'memory')
+    with app.app_context():
+        search.rebuild_search_index()
+
+    kept = create_article('メモリ検索 残す', 'narwhalmemo の本文')
+    edited = create_article('メモリ検索 編集', 'narwhalmemo の本文')
+    removed = create_article('メモリ検索 削除', 'narwhalmemo の本文')
+
+    def found(query):
+        with app.app_context():
+            total, results = search.search_ranked(query, limit=10)
+            assert total == len(results)
+            return sorted(result['id'] for result in results)
+
+    assert found('narwhalmemo') == sorted([kept, edited, removed])
+
+    headers = {'X-User-ID': 'alice'}
+    client.post(f'/edit/{edited}', data={'title': 'メモリ検索 編集', 'content': 'ocelotmemo に変更'}, headers=headers)
+    client.get(f'/delete/{removed}', headers=headers)
+    assert found('narwhalmemo') == [kept]
+    assert found('ocelotmemo') == [edited]
+
+    # ロールバックした変更は反映しない
+    with app.app_context():
+        db.session.get(Knowledge, kept).content = 'ibexmemo'
+        db.session.flush()
+        db.session.rollback()
+    assert found('ibexmemo') == []
+    assert found('narwhalmemo') == [kept]
@@ -0,0 +1,28 @@
+import io
+
+
+def test_listing_engagement_counts_and_tags(app, client, create_article):
+    from app.utils import get_listing_engagement, get_bulk_like_counts
+    from app.models import db, Knowledge
+
+    tagged = create_article('一覧集計テスト', '本文', tags='集計A, 集計B')
+    plain = create_article('一覧集計テスト 添付', '本文')
+    client.post(f'/like/{tagged}', headers={'X-User-ID': 'bobby'})
+    client.post(f'/comment/{tagged}', data={'content': 'コメント'}, headers={'X-User-ID': 'bobby'})
+    client.post(f'/edit/{plain}', data={
+        'title': '一覧集計テスト 添付', 'content': '本文',
+        'attachments': (io.BytesIO(b'hello'), 'note.txt')
+    }, headers={'X-User-ID': 'alice'}, content_type='multipart/form-data')
+
+    with app.app_context():
+        engagement = get_listing_engagement([tagged, plain])
+        assert engagement[tagged]['likes'] == 1
+        assert engagement[tagged]['comments'] == 1
+        assert engagement[tagged]['attachments'] == 0
+        assert sorted(tag.name for tag in engagement[tagged]['tags']) == ['集計A', '集計B']
+        assert engagement[plain]['attachments'] == 1
+        assert engagement[plain]['tags'] == []
+
+        # 期間指定時は日別集計の合計
+        assert get_listing_engagement([tagged], days=7)[tagged]['likes'] == 1
+        assert get_bulk_like_counts([db.session.get(Knowledge, tagged)]) == {tagged: 1}
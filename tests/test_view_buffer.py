@@ -0,0 +1,50 @@
+from datetime import datetime, timezone
+
+import pytest
+
+
+@pytest.fixture
+def view_buffer(app):
+    from app import view_buffer
+
+    with view_buffer._pending_lock:
+        view_buffer._pending.clear()
+    yield view_buffer
+    with view_buffer._pending_lock:
+        view_buffer._pending.clear()
+
+
+def test_failed_flush_keeps_events_pending(view_buffer, monkeypatch, create_article):
+    knowledge_id = create_article('閲覧バッファ テスト', '本文')
+    viewed_at = datetime.now(timezone.utc)
+    with view_buffer._pending_lock:
+        view_buffer._pending[('reader1', knowledge_id, viewed_at.date())] = viewed_at
+        view_buffer._pending[('reader2', knowledge_id, viewed_at.date())] = viewed_at
+
+    def fail(events):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(view_buffer, 'write_views', fail)
+    assert view_buffer.flush_view_buffer() == 0
+    assert view_buffer.get_pending_view_count() == 2
+
+    # 次回の書き込みで再試行される
+    monkeypatch.undo()
+    assert view_buffer.flush_view_buffer() == 2
+    assert view_buffer.get_pending_view_count() == 0
+
+
+def test_requeue_keeps_newer_events_and_bound(view_buffer, monkeypatch):
+    day = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    newer = datetime(2026, 1, 1, 12, tzinfo=timezone.utc)
+    with view_buffer._pending_lock:
+        view_buffer._pending[('reader1', 1, day.date())] = newer
+
+    monkeypatch.setattr(view_buffer, 'VIEW_BUFFER_MAX_PENDING', 3)
+    dropped = view_buffer._requeue([('reader1', 1, day), ('reader2', 1, day), ('reader3', 1, day), ('reader4', 1, day)])
+
+    assert dropped == 1
+    pending = dict(view_buffer._pending)
+    assert len(pending) == 3
+    assert pending[('reader1', 1, day.date())] == newer
+    assert ('reader2', 1, day.date()) not in pending